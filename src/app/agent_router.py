@@ -0,0 +1,248 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+import deadlines
+import instrumentation
+
+# Routes agent sessions across several region/agent/alias endpoints.
+#
+# Each endpoint keeps a rolling picture of its health: an exponentially
+# weighted time to first byte and the error rate over its last turns. A new
+# session goes to the healthy endpoint with the best score (latency, inflated
+# by errors) and stays pinned there, because the agent's conversation memory
+# lives in that region. An endpoint that fails several turns in a row is
+# taken out of rotation for a cooldown, after which one session probes it;
+# sessions pinned to it move to the best remaining endpoint on their next
+# turn and start a fresh conversation there.
+#
+#   BR_AGENT_ENDPOINTS  JSON list, or @path to a JSON file, of
+#                       {"name", "region", "agentId", "agentAliasId", "endpoint"}
+#                       ("endpoint" defaults to the region's public URL)
+
+AgentEndpoint = namedtuple('AgentEndpoint', ['name', 'region', 'agent_id', 'alias_id', 'base_url'])
+
+LATENCY_ALPHA = 0.2       # weight of the newest time-to-first-byte sample
+ERROR_WINDOW = 50         # turns the error rate is measured over
+ERROR_PENALTY = 4.0       # score multiplier per unit of error rate
+FAILURE_THRESHOLD = 3     # consecutive failed turns that take an endpoint out
+COOLDOWN = 30.0           # seconds before a failed endpoint is probed again
+STALE_AFTER = 60.0        # seconds without samples before latency is re-measured
+MAX_PINNED_SESSIONS = 10000
+
+
+def public_url(region):
+    return f"https://bedrock-agent-runtime.{region}.amazonaws.com"
+
+
+def session_url(target, session_id):
+    return f'{target.base_url}/agents/{target.agent_id}/agentAliases/{target.alias_id}/sessions/{session_id}/text'
+
+
+def load_endpoints(config=None):
+    config = config if config is not None else os.environ.get("BR_AGENT_ENDPOINTS", "")
+    if not config:
+        return []
+    if config.startswith("@"):
+        with open(config[1:]) as f:
+            config = f.read()
+    endpoints = []
+    for entry in json.loads(config):
+        region = entry["region"]
+        endpoints.append(AgentEndpoint(
+            entry.get("name") or region, region, entry["agentId"], entry["agentAliasId"],
+            entry.get("endpoint") or public_url(region)))
+    if len({e.name for e in endpoints}) != len(endpoints):
+        raise ValueError("BR_AGENT_ENDPOINTS names must be unique")
+    return endpoints
+
+
+class EndpointStats:
+
+    def __init__(self):
+        self.latency = None
+        self.last_sample = None
+        self.outcomes = deque(maxlen=ERROR_WINDOW)
+        self.consecutive_failures = 0
+        self.open_until = None
+        # when the probe of a recovering endpoint was sent, if one is out
+        self.probe_started = None
+        # when a session was last sent to re-measure a stale endpoint
+        self.explored_at = None
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+class AgentRouter:
+
+    def __init__(self, endpoints, clock=time.monotonic):
+        if not endpoints:
+            raise ValueError("AgentRouter needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self._by_name = {e.name: e for e in self.endpoints}
+        self._stats = {e.name: EndpointStats() for e in self.endpoints}
+        self._pins = OrderedDict()
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def _available(self, stats, now):
+        # closed circuit, or open with the cooldown over and no probe out yet
+        # (a probe that never reported back counts as lost after a cooldown)
+        if stats.open_until is None:
+            return True
+        if now < stats.open_until:
+            return False
+        return stats.probe_started is None or now - stats.probe_started > COOLDOWN
+
+    def _score(self, stats):
+        if stats.latency is None:
+            return float("inf")
+        return stats.latency * (1.0 + ERROR_PENALTY * stats.error_rate())
+
+    def _stale(self, stats, now):
+        # nothing measured lately, and no session sent to measure it either
+        return ((stats.last_sample is None or now - stats.last_sample > STALE_AFTER)
+                and (stats.explored_at is None or now - stats.explored_at > STALE_AFTER))
+
+    def _choose(self, now, exclude=None):
+        # (endpoint, whether it is picked to re-measure it), changing nothing
+        candidates = [e for e in self.endpoints
+                      if e.name != exclude and self._available(self._stats[e.name], now)]
+        if not candidates:
+            # everything is failing: use whichever comes back soonest
+            candidates = sorted(self.endpoints, key=lambda e: self._stats[e.name].open_until or 0.0)[:1]
+        # a recovering endpoint gets its probe first, then stale ones are re-measured
+        target = next((e for e in candidates if self._stats[e.name].open_until is not None), None)
+        if target is not None:
+            return target, False
+        target = next((e for e in candidates if self._stale(self._stats[e.name], now)), None)
+        if target is not None:
+            return target, True
+        # min() keeps configuration order on ties, so the first endpoint is primary
+        return min(candidates, key=lambda e: self._score(self._stats[e.name])), False
+
+    def _best(self, now, exclude=None):
+        target, exploring = self._choose(now, exclude)
+        stats = self._stats[target.name]
+        if exploring:
+            stats.explored_at = now
+        if stats.open_until is not None and now >= stats.open_until:
+            stats.probe_started = now
+        return target
+
+    def route(self, session_id):
+        with self._lock:
+            now = self._clock()
+            pinned = self._pins.get(session_id)
+            if pinned is not None:
+                stats = self._stats[pinned]
+                if stats.open_until is None:
+                    self._pins.move_to_end(session_id)
+                    return self._by_name[pinned]
+            target = self._best(now, exclude=pinned)
+            if pinned is not None and target.name != pinned:
+                instrumentation.registry.increment("failovers", labels={"from": pinned, "to": target.name})
+            self._pins[session_id] = target.name
+            self._pins.move_to_end(session_id)
+            while len(self._pins) > MAX_PINNED_SESSIONS:
+                self._pins.popitem(last=False)
+            return target
+
+    def peek(self, session_id):
+        # the endpoint route() would pick now, without pinning the session,
+        # starting a probe or counting as a re-measurement
+        with self._lock:
+            pinned = self._pins.get(session_id)
+            if pinned is not None and self._stats[pinned].open_until is None:
+                return self._by_name[pinned]
+            return self._choose(self._clock(), exclude=pinned)[0]
+
+    def pinned(self, session_id):
+        with self._lock:
+            name = self._pins.get(session_id)
+        return self._by_name[name] if name is not None else None
+
+    def pin(self, session_id, name):
+        # adopt a pin made by another replica (the client sends the endpoint
+        # name back); ignored for unknown or failing endpoints
+        with self._lock:
+            stats = self._stats.get(name)
+            if session_id in self._pins or stats is None or stats.open_until is not None:
+                return
+            self._pins[session_id] = name
+            while len(self._pins) > MAX_PINNED_SESSIONS:
+                self._pins.popitem(last=False)
+
+    def forget(self, session_id):
+        with self._lock:
+            self._pins.pop(session_id, None)
+
+    def record(self, target, ok, first_byte=None):
+        # outcome of one turn; first_byte is its time to first byte in seconds.
+        # ok=None (turn cancelled by the user) says nothing about health.
+        with self._lock:
+            now = self._clock()
+            stats = self._stats[target.name]
+            stats.probe_started = None
+            if ok is None:
+                return
+            stats.outcomes.append(ok)
+            if first_byte is not None:
+                stats.latency = first_byte if stats.latency is None else (
+                    LATENCY_ALPHA * first_byte + (1 - LATENCY_ALPHA) * stats.latency)
+                stats.last_sample = now
+            if ok:
+                stats.consecutive_failures = 0
+                stats.open_until = None
+            else:
+                stats.consecutive_failures += 1
+                if stats.consecutive_failures >= FAILURE_THRESHOLD or stats.open_until is not None:
+                    stats.open_until = now + COOLDOWN
+        instrumentation.registry.increment("endpoint_turns", labels={"endpoint": target.name, "ok": str(ok).lower()})
+
+    def record_turn(self, target, turn):
+        error = turn.error
+        if (error is None and turn.counters.get("cancelled")) or isinstance(error, deadlines.TurnCancelled) \
+                or getattr(error, "status_code", None) == 400:
+            # stopped by the user, or a bad request: not the endpoint's fault
+            self.record(target, None)
+        else:
+            self.record(target, error is None, turn.durations.get("ttfb"))
+
+    def snapshot(self):
+        # per-endpoint health, for logs and dashboards
+        with self._lock:
+            now = self._clock()
+            return [{
+                "name": e.name,
+                "region": e.region,
+                "available": self._available(self._stats[e.name], now),
+                "latency": self._stats[e.name].latency,
+                "error_rate": round(self._stats[e.name].error_rate(), 3),
+                "pinned_sessions": sum(1 for name in self._pins.values() if name == e.name),
+            } for e in self.endpoints]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router(default_endpoint):
+    # default_endpoint() builds the single endpoint used when none are configured
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = AgentRouter(load_endpoints() or [default_endpoint()])
+    return _router
+
+
+def set_router(router):
+    global _router
+    with _router_lock:
+        _router = router
@@ -0,0 +1,221 @@
+from collections import namedtuple
+
+# Typed view of the Bedrock agent trace events kept by a TraceCollector, and
+# a per-turn latency waterfall built from them.
+#
+# Each trace event carries one part of one phase, e.g.
+#   {"trace": {"orchestrationTrace": {"invocationInput": {...}}}}
+# and is flattened into a TraceStep. Matching input/output steps (model
+# invocation, knowledge base lookup, action group call) are paired into
+# spans. Span timing uses the service-reported totalTimeMs when the trace
+# metadata has it, and otherwise the arrival time of the events on our side.
+
+PHASES = {
+    'preProcessingTrace': 'preProcessing',
+    'orchestrationTrace': 'orchestration',
+    'postProcessingTrace': 'postProcessing',
+    'failureTrace': 'failure',
+    'guardrailTrace': 'guardrail',
+}
+
+TraceStep = namedtuple('TraceStep', [
+    'elapsed',        # seconds since the turn started, on arrival
+    'phase',          # preProcessing / orchestration / postProcessing / ...
+    'kind',           # modelInvocationInput, rationale, knowledgeBaseLookupInput, ...
+    'trace_id',
+    'name',           # action group name or knowledge base id, when relevant
+    'text',           # rationale, query, observation or final response text
+    'input_tokens',
+    'output_tokens',
+    'duration',       # service-reported step duration in seconds, if any
+])
+
+Span = namedtuple('Span', ['name', 'category', 'start', 'end', 'input_tokens', 'output_tokens'])
+
+# category totals: retrieval, model, action_group, other
+TurnLatency = namedtuple('TurnLatency', [
+    'spans', 'total', 'first_chunk', 'by_category', 'input_tokens', 'output_tokens'])
+
+
+def _usage(part):
+    usage = part.get('metadata', {}).get('usage', {})
+    return usage.get('inputTokens'), usage.get('outputTokens')
+
+
+def _duration(part):
+    total_ms = part.get('metadata', {}).get('totalTimeMs')
+    return total_ms / 1000.0 if total_ms is not None else None
+
+
+def _steps_for_phase(elapsed, phase, body):
+    steps = []
+    if phase == 'failure':
+        steps.append(TraceStep(elapsed, phase, 'failure', body.get('traceId'), None,
+                               body.get('failureReason'), None, None, None))
+        return steps
+
+    model_input = body.get('modelInvocationInput')
+    if model_input:
+        steps.append(TraceStep(elapsed, phase, 'modelInvocationInput', model_input.get('traceId'),
+                               model_input.get('type'), None, None, None, None))
+
+    rationale = body.get('rationale')
+    if rationale:
+        steps.append(TraceStep(elapsed, phase, 'rationale', rationale.get('traceId'), None,
+                               rationale.get('text'), None, None, None))
+
+    invocation = body.get('invocationInput')
+    if invocation:
+        trace_id = invocation.get('traceId')
+        action = invocation.get('actionGroupInvocationInput')
+        lookup = invocation.get('knowledgeBaseLookupInput')
+        if action:
+            name = action.get('actionGroupName')
+            if action.get('apiPath'):
+                name = f"{name} {action.get('verb', '').upper()} {action['apiPath']}".strip()
+            steps.append(TraceStep(elapsed, phase, 'actionGroupInvocationInput', trace_id, name,
+                                   None, None, None, None))
+        if lookup:
+            steps.append(TraceStep(elapsed, phase, 'knowledgeBaseLookupInput', trace_id,
+                                   lookup.get('knowledgeBaseId'), lookup.get('text'), None, None, None))
+
+    observation = body.get('observation')
+    if observation:
+        trace_id = observation.get('traceId')
+        if 'actionGroupInvocationOutput' in observation:
+            output = observation['actionGroupInvocationOutput']
+            steps.append(TraceStep(elapsed, phase, 'actionGroupInvocationOutput', trace_id, None,
+                                   output.get('text'), None, None, _duration(output)))
+        if 'knowledgeBaseLookupOutput' in observation:
+            output = observation['knowledgeBaseLookupOutput']
+            references = output.get('retrievedReferences', [])
+            steps.append(TraceStep(elapsed, phase, 'knowledgeBaseLookupOutput', trace_id, None,
+                                   f"{len(references)} references", None, None, _duration(output)))
+        if 'finalResponse' in observation:
+            output = observation['finalResponse']
+            steps.append(TraceStep(elapsed, phase, 'finalResponse', trace_id, None,
+                                   output.get('text'), None, None, None))
+
+    model_output = body.get('modelInvocationOutput')
+    if model_output:
+        input_tokens, output_tokens = _usage(model_output)
+        steps.append(TraceStep(elapsed, phase, 'modelInvocationOutput', model_output.get('traceId'),
+                               None, None, input_tokens, output_tokens, _duration(model_output)))
+    return steps
+
+
+def parse_steps(records):
+    # records: TraceCollector.records (or anything with elapsed/event_type/payload)
+    steps = []
+    for record in records:
+        if record.event_type != 'trace':
+            continue
+        trace = record.payload.get('trace', {})
+        for key, body in trace.items():
+            phase = PHASES.get(key)
+            if phase is None or not isinstance(body, dict):
+                continue
+            steps.extend(_steps_for_phase(record.elapsed, phase, body))
+    return steps
+
+
+# input kind -> (output kind, category)
+_PAIRS = {
+    'modelInvocationInput': ('modelInvocationOutput', 'model'),
+    'knowledgeBaseLookupInput': ('knowledgeBaseLookupOutput', 'retrieval'),
+    'actionGroupInvocationInput': ('actionGroupInvocationOutput', 'action_group'),
+}
+_OUTPUTS = {output: (kind, category) for kind, (output, category) in _PAIRS.items()}
+
+
+def _span_name(category, phase, start_step):
+    if category == 'model':
+        return f"{phase} model"
+    if category == 'retrieval':
+        return "knowledge base lookup"
+    return f"action group {start_step.name}" if start_step and start_step.name else "action group"
+
+
+def build_spans(steps):
+    spans = []
+    open_steps = {}
+    previous_elapsed = 0.0
+    for step in steps:
+        if step.kind in _PAIRS:
+            open_steps[(step.phase, step.kind)] = step
+        elif step.kind in _OUTPUTS:
+            input_kind, category = _OUTPUTS[step.kind]
+            start_step = open_steps.pop((step.phase, input_kind), None)
+            end = step.elapsed
+            if step.duration is not None:
+                start = max(0.0, end - step.duration)
+            elif start_step is not None:
+                start = start_step.elapsed
+            else:
+                start = previous_elapsed
+            spans.append(Span(_span_name(category, step.phase, start_step), category, start, end,
+                              step.input_tokens, step.output_tokens))
+        previous_elapsed = step.elapsed
+    return spans
+
+
+def turn_latency(records):
+    records = list(records)
+    spans = build_spans(parse_steps(records))
+    total = records[-1].elapsed if records else 0.0
+    first_chunk = next((r.elapsed for r in records if r.event_type == 'chunk'), None)
+
+    by_category = {'retrieval': 0.0, 'model': 0.0, 'action_group': 0.0}
+    for span in spans:
+        by_category[span.category] += span.end - span.start
+    by_category['other'] = max(0.0, total - sum(by_category.values()))
+
+    input_tokens = sum(span.input_tokens or 0 for span in spans)
+    output_tokens = sum(span.output_tokens or 0 for span in spans)
+    return TurnLatency(spans, total, first_chunk, by_category, input_tokens, output_tokens)
+
+
+def waterfall_rows(latency):
+    # flat rows for tables (st.table, logs, JSON)
+    rows = []
+    for span in latency.spans:
+        rows.append({
+            "step": span.name,
+            "start (s)": round(span.start, 3),
+            "duration (s)": round(span.end - span.start, 3),
+            "input tokens": span.input_tokens,
+            "output tokens": span.output_tokens,
+        })
+    return rows
+
+
+def _location_uri(reference):
+    # {"location": {"type": "S3", "s3Location": {"uri": "s3://..."}}}, or a
+    # web / confluence / ... location with a url
+    for key, value in reference.get('location', {}).items():
+        if isinstance(value, dict):
+            uri = value.get('uri') or value.get('url')
+            if uri:
+                return uri
+    return None
+
+
+def cited_sources(records):
+    # Documents the answer cites (chunk attributions), or when it cites none,
+    # the documents the knowledge base lookups returned. Unique, in order.
+    cited, retrieved = [], []
+    for record in records:
+        if record.event_type == 'chunk':
+            for citation in record.payload.get('attribution', {}).get('citations', []):
+                cited.extend(citation.get('retrievedReferences', []))
+        elif record.event_type == 'trace':
+            for body in record.payload.get('trace', {}).values():
+                if isinstance(body, dict):
+                    output = body.get('observation', {}).get('knowledgeBaseLookupOutput', {})
+                    retrieved.extend(output.get('retrievedReferences', []))
+    sources = []
+    for reference in cited or retrieved:
+        uri = _location_uri(reference)
+        if uri and uri not in sources:
+            sources.append(uri)
+    return sources
@@ -0,0 +1,177 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Process-wide cache of agent answers for repeated (FAQ style) questions.
+#
+# Keys are the normalized question plus the agent and alias ids, so a new
+# agent version never serves answers from an old one. Entries live in an
+# in-memory LRU with a TTL; an optional SQLite file keeps them across
+# restarts. Only turns that answered from the knowledge base without calling
+# an action group (e.g. password reset) are stored; see is_cacheable().
+#
+#   BR_AGENT_CACHE_SIZE         max in-memory entries (default 512, 0 disables)
+#   BR_AGENT_CACHE_TTL          entry lifetime in seconds (default 3600)
+#   BR_AGENT_CACHE_SQLITE       path of the on-disk tier (default: memory only)
+#   BR_AGENT_CACHE_SQLITE_ROWS  max rows kept in the on-disk tier (default 10000)
+
+CACHE_SIZE = int(os.environ.get("BR_AGENT_CACHE_SIZE", "512"))
+CACHE_TTL = float(os.environ.get("BR_AGENT_CACHE_TTL", "3600"))
+CACHE_SQLITE = os.environ.get("BR_AGENT_CACHE_SQLITE")
+CACHE_SQLITE_ROWS = int(os.environ.get("BR_AGENT_CACHE_SQLITE_ROWS", "10000"))
+
+_whitespace = re.compile(r"\s+")
+_trailing_punctuation = re.compile(r"[\s?.!]+$")
+
+
+def normalize_question(question):
+    question = _whitespace.sub(" ", question.strip().lower())
+    return _trailing_punctuation.sub("", question)
+
+
+def cache_key(question, agent_id, agent_alias_id):
+    return f"{agent_id}/{agent_alias_id}/{normalize_question(question)}"
+
+
+def _inspect(records):
+    # (stateful, used_knowledge_base) for the records of one turn
+    used_knowledge_base = False
+    for record in records:
+        if record.event_type == 'returnControl':
+            return True, used_knowledge_base
+        if record.event_type != 'trace':
+            continue
+        for body in record.payload.get('trace', {}).values():
+            if not isinstance(body, dict):
+                continue
+            if 'failureReason' in body:
+                return True, used_knowledge_base
+            invocation = body.get('invocationInput', {})
+            observation = body.get('observation', {})
+            if 'actionGroupInvocationInput' in invocation or 'actionGroupInvocationOutput' in observation:
+                return True, used_knowledge_base
+            if 'knowledgeBaseLookupOutput' in observation:
+                used_knowledge_base = True
+    return False, used_knowledge_base
+
+
+def is_stateful(records):
+    # The turn invoked an action group, handed control back to the client or
+    # failed inside the agent: it depends on (or changed) session state.
+    return _inspect(records)[0]
+
+
+def is_cacheable(records):
+    # A turn is safe to replay for other users when it answered from the
+    # knowledge base and was not stateful. Small talk that never reached the
+    # knowledge base is neither cached nor stateful.
+    stateful, used_knowledge_base = _inspect(records)
+    return used_knowledge_base and not stateful
+
+
+class SqliteTier:
+
+    def __init__(self, path, max_rows=CACHE_SQLITE_ROWS):
+        self._path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_expires ON answers (expires)")
+
+    def _connection(self):
+        # sqlite connections are per thread; Streamlit runs each session's
+        # script in its own thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self._path, timeout=5)
+        return conn
+
+    def get(self, key, now):
+        row = self._connection().execute(
+            "SELECT answer, expires FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return row[0], row[1]
+
+    def put(self, key, answer, expires, now):
+        # every write also drops expired rows and, past max_rows, the rows
+        # that expire first (all entries share one TTL, so the oldest)
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?)", (key, answer, expires))
+            conn.execute("DELETE FROM answers WHERE expires <= ?", (now,))
+            conn.execute(
+                "DELETE FROM answers WHERE key IN "
+                "(SELECT key FROM answers ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_rows,))
+
+    def purge_expired(self, now):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM answers WHERE expires <= ?", (now,))
+
+
+class AnswerCache:
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, sqlite_path=CACHE_SQLITE, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()   # key -> (answer, expires)
+        self._lock = threading.Lock()
+        self._disk = SqliteTier(sqlite_path) if sqlite_path else None
+        if self._disk:
+            self._disk.purge_expired(clock())
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, question, agent_id, agent_alias_id):
+        if self.max_entries <= 0:
+            return None
+        key = cache_key(question, agent_id, agent_alias_id)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+        entry = self._disk.get(key, now) if self._disk else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._insert(key, entry)
+            self.hits += 1
+        return entry[0]
+
+    def put(self, question, agent_id, agent_alias_id, answer):
+        if self.max_entries <= 0 or not answer:
+            return
+        key = cache_key(question, agent_id, agent_alias_id)
+        now = self._clock()
+        entry = (answer, now + self.ttl)
+        with self._lock:
+            self._insert(key, entry)
+        if self._disk:
+            self._disk.put(key, *entry, now)
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import uuid
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+import async_agent
+import deadlines
+import instrumentation
+import invoke_br_agent as agenthelper
+from trace_collector import TraceCollector
+
+# HTTP API in front of the agent, for frontends other than the Streamlit app
+# (LMS widget, Slack bot). Runs on any ASGI server:
+#
+#   uvicorn api_server:app --host 0.0.0.0 --port 8080 --workers 4
+#   python api_server.py --port 8080
+#
+#   POST /v1/chat    {"question", "sessionId"?, "endpoint"?, "endSession"?, "traces"?, "stream"?}
+#                    streams Server-Sent Events: session, trace (when asked
+#                    for), chunk, done or error; "stream": false returns JSON
+#   GET  /v1/ws      WebSocket; send the same JSON per turn, receive one
+#                    JSON message per event with a "type" field
+#   GET  /healthz    turns in flight and the router's view of each endpoint
+#   GET  /metrics    Prometheus text from instrumentation.registry
+#
+# The API does not authenticate callers; run it behind a proxy that does
+# (API gateway, load balancer with OIDC) and never expose it directly.
+#
+# Agent sessions are created by the server and returned in the session
+# event. Session ids are signed with BR_API_SESSION_SECRET, so a caller can
+# only continue a session it was given, not guess or pick another one. The
+# router pins each session to a region; the endpoint name it picked is
+# returned too, and sending it back with the session id lets any replica
+# keep the conversation in the same region. One turn runs per session at a
+# time.
+#
+# Admission is bounded: at most BR_API_MAX_TURNS turns stream at once and at
+# most BR_API_MAX_QUEUED wait for a slot, each for up to BR_API_QUEUE_TIMEOUT
+# seconds; beyond that requests get 503 with Retry-After. Chunks are sent
+# with the ASGI server's flow control, so a slow client slows the read from
+# the agent instead of growing a buffer.
+#
+#   BR_API_MAX_TURNS      turns streaming at once per process (default 64)
+#   BR_API_MAX_QUEUED     requests waiting for a turn slot (default 256)
+#   BR_API_QUEUE_TIMEOUT  seconds a request may wait for a slot (default 10)
+#   BR_API_SESSION_SECRET key that signs session ids; set the same value on
+#                         every replica (default: random per process, so
+#                         sessions end with the process)
+
+MAX_TURNS = int(os.environ.get("BR_API_MAX_TURNS", "64"))
+MAX_QUEUED = int(os.environ.get("BR_API_MAX_QUEUED", "256"))
+QUEUE_TIMEOUT = float(os.environ.get("BR_API_QUEUE_TIMEOUT", "10"))
+SESSION_SECRET = os.environ.get("BR_API_SESSION_SECRET", "").encode() or secrets.token_bytes(32)
+
+
+class Busy(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class TurnSlots:
+    # bounded admission: a fixed number of running turns and a bounded queue
+
+    def __init__(self, max_turns=MAX_TURNS, max_queued=MAX_QUEUED, queue_timeout=QUEUE_TIMEOUT):
+        self.max_turns = max_turns
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_turns)
+        self.running = 0
+        self.waiting = 0
+        self._sessions = set()
+
+    @contextlib.asynccontextmanager
+    async def turn(self, session_id):
+        if session_id in self._sessions:
+            raise Busy(409, "A turn is already running for this session")
+        if self._semaphore.locked() and self.waiting >= self.max_queued:
+            instrumentation.registry.increment("api_rejected", labels={"reason": "queue_full"})
+            raise Busy(503, "Too many requests waiting")
+        self._sessions.add(session_id)
+        try:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                instrumentation.registry.increment("api_rejected", labels={"reason": "queue_timeout"})
+                raise Busy(503, "No capacity to answer right now")
+            finally:
+                self.waiting -= 1
+            self.running += 1
+            try:
+                yield
+            finally:
+                self.running -= 1
+                self._semaphore.release()
+        finally:
+            self._sessions.discard(session_id)
+
+
+def session_signature(random_part):
+    return hmac.new(SESSION_SECRET, random_part.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def issue_session_id():
+    # "<random>.<signature>", 65 characters Bedrock accepts as a sessionId
+    random_part = uuid.uuid4().hex
+    return f"{random_part}.{session_signature(random_part)}"
+
+
+def is_issued_session_id(session_id):
+    random_part, _, signature = session_id.rpartition(".")
+    return bool(random_part) and hmac.compare_digest(signature, session_signature(random_part))
+
+
+def parse_turn(body):
+    # validated turn request, or ValueError with a message for the client
+    if not isinstance(body, dict):
+        raise ValueError("Expected a JSON object")
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("question is required")
+    session_id = body.get("sessionId")
+    endpoint = body.get("endpoint")
+    if not session_id:
+        # a new session goes wherever the router sends it
+        session_id = issue_session_id()
+        endpoint = None
+    elif not isinstance(session_id, str) or not is_issued_session_id(session_id):
+        raise ValueError("sessionId must be one returned by this API")
+    if endpoint is not None and not isinstance(endpoint, str):
+        raise ValueError("endpoint must be a string")
+    return {
+        "sessionId": session_id,
+        "question": question,
+        "endSession": "true" if body.get("endSession") else "false",
+        "endpoint": endpoint,
+        "traces": bool(body.get("traces")),
+    }
+
+
+async def run_turn(turn):
+    # yields (event name, data) for one turn: session, trace, chunk, then done
+    # or error. Errors once the turn has started are reported in-band.
+    router = agenthelper.get_router()
+    if turn["endpoint"]:
+        router.pin(turn["sessionId"], turn["endpoint"])
+    collector = TraceCollector()
+    event = {"sessionId": turn["sessionId"], "question": turn["question"], "endSession": turn["endSession"]}
+    started = False
+    try:
+        async for kind, data in async_agent.event_handler_async(event, collector, deadlines.Deadline()):
+            if not started:
+                # the router has pinned the session by now
+                started = True
+                yield "session", session_info(router, turn)
+            if kind == "chunk":
+                yield "chunk", {"text": data}
+            elif turn["traces"]:
+                yield "trace", data
+    except Exception as e:
+        if not started:
+            yield "session", session_info(router, turn)
+        yield "error", {"error": type(e).__name__, "message": str(e)}
+        return
+    if not started:
+        yield "session", session_info(router, turn)
+    yield "done", {"durations": collector.turn.as_dict()["durations"]}
+
+
+def session_info(router, turn):
+    target = router.pinned(turn["sessionId"])
+    return {"sessionId": turn["sessionId"], "endpoint": target.name if target is not None else None}
+
+
+def sse(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+def busy_response(error):
+    headers = {"Retry-After": "1"} if error.status == 503 else None
+    return JSONResponse({"error": str(error)}, status_code=error.status, headers=headers)
+
+
+async def chat(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Body must be JSON"}, status_code=400)
+    try:
+        turn = parse_turn(body)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    slots = request.app.state.slots
+
+    if body.get("stream", True) is False:
+        try:
+            async with slots.turn(turn["sessionId"]):
+                result, answer = {}, []
+                async for name, data in run_turn(turn):
+                    if name == "chunk":
+                        answer.append(data["text"])
+                    else:
+                        result[name] = data
+        except Busy as e:
+            return busy_response(e)
+        if "error" in result:
+            return JSONResponse(dict(result["session"], **result["error"]), status_code=502)
+        return JSONResponse(dict(result["session"], answer="".join(answer)))
+
+    # take the slot before answering so overload is a plain 409/503, not a
+    # half-open event stream
+    slot = slots.turn(turn["sessionId"])
+    try:
+        await slot.__aenter__()
+    except Busy as e:
+        return busy_response(e)
+    return TurnStream(run_turn(turn), slot)
+
+
+class TurnStream(StreamingResponse):
+    # SSE response that closes the turn and frees its slot however the
+    # response ends: finished, client gone, or server shutting down
+
+    def __init__(self, events, slot):
+        super().__init__(self._encode(events), media_type="text/event-stream",
+                         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        self.events = events
+        self.slot = slot
+
+    async def _encode(self, events):
+        async for name, data in events:
+            yield sse(name, data)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+                await self.events.aclose()
+            finally:
+                await self.slot.__aexit__(None, None, None)
+
+
+async def chat_ws(websocket):
+    await websocket.accept()
+    slots = websocket.app.state.slots
+    try:
+        while True:
+            try:
+                turn = parse_turn(json.loads(await websocket.receive_text()))
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "error": "ValidationError", "message": str(e)})
+                continue
+            try:
+                async with slots.turn(turn["sessionId"]):
+                    async for name, data in run_turn(turn):
+                        message = {"type": name, "trace": data} if name == "trace" else dict(data, type=name)
+                        await websocket.send_json(message)
+            except Busy as e:
+                await websocket.send_json({"type": "error", "error": "Busy", "status": e.status, "message": str(e)})
+    except WebSocketDisconnect:
+        pass
+
+
+async def healthz(request):
+    slots = request.app.state.slots
+    return JSONResponse({
+        "running": slots.running,
+        "waiting": slots.waiting,
+        "max_turns": slots.max_turns,
+        "endpoints": agenthelper.get_router().snapshot(),
+    })
+
+
+async def metrics(request):
+    return PlainTextResponse(instrumentation.registry.render_prometheus(),
+                             media_type="text/plain; version=0.0.4")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.slots = TurnSlots()
+    yield
+    await async_agent.get_client().close()
+
+
+def create_app():
+    return Starlette(routes=[
+        Route("/v1/chat", chat, methods=["POST"]),
+        WebSocketRoute("/v1/ws", chat_ws),
+        Route("/healthz", healthz),
+        Route("/metrics", metrics),
+    ], lifespan=lifespan)
+
+
+app = create_app()
+
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Serve the agent over HTTP (SSE) and WebSocket")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    uvicorn.run("api_server:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import asyncio
+import json
+import os
+
+import aiohttp
+
+import agent_router
+import aws_auth
+import deadlines
+import eventstream
+import instrumentation
+import invoke_br_agent as agenthelper
+import rate_limit
+import transport
+from trace_collector import TraceCollector
+
+# asyncio counterpart of invoke_br_agent: one event loop can multiplex many
+# concurrent, mostly idle agent conversations without a thread per user.
+# Requests are signed inline (the signing key is cached, so this is a single
+# HMAC), connections are kept alive in a shared aiohttp pool, and the number
+# of agent turns in flight is capped by a semaphore.
+#
+#   BR_AGENT_MAX_CONCURRENCY  max agent turns in flight per client (default 200)
+
+MAX_CONCURRENCY = int(os.environ.get("BR_AGENT_MAX_CONCURRENCY", "200"))
+
+
+async def _on_connection_create_start(session, context, params):
+    context.connect_started = asyncio.get_running_loop().time()
+
+
+async def _on_connection_create_end(session, context, params):
+    instrumentation.record("connect", asyncio.get_running_loop().time() - context.connect_started)
+    instrumentation.count("connections_opened")
+
+
+def _connection_trace_config():
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    return trace_config
+
+
+class AsyncAgentClient:
+
+    def __init__(self, pool_size=transport.POOL_SIZE, max_concurrency=MAX_CONCURRENCY,
+                 connect_timeout=transport.CONNECT_TIMEOUT, read_timeout=transport.READ_TIMEOUT):
+        self._pool_size = pool_size
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._timeout,
+                trace_configs=[_connection_trace_config()],
+                # shared between users, so never carry cookies across
+                cookie_jar=aiohttp.DummyCookieJar()
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _signed_headers(self, url, body):
+        provider = aws_auth.get_credential_provider()
+        credentials = provider.get_credentials_nowait()
+        if credentials is None:
+            # first use or about to expire: resolve off the event loop
+            credentials = await asyncio.to_thread(provider.get_credentials)
+        with instrumentation.timed("sign"):
+            req = aws_auth.sign_request(
+                url, 'POST', body, None,
+                {'content-type': 'application/json', 'accept': 'application/json'},
+                'bedrock', agenthelper.region_for(url), credentials
+            )
+        return dict(req.headers.items())
+
+    async def stream_events(self, question, url, endSession=True, streamFinalResponse=False, collector=None,
+                            deadline=None):
+        if collector is None:
+            collector = TraceCollector()
+        if deadline is None:
+            deadline = deadlines.Deadline()
+        turn = collector.turn
+        loop = asyncio.get_running_loop()
+        body = agenthelper.question_body(question, endSession, streamFinalResponse)
+        limiter = rate_limit.get_limiter()
+        async with self._semaphore:
+            # same pacing and retry rules as invoke_br_agent.iter_question_events
+            attempt = 0
+            while True:
+                attempt += 1
+                wait = limiter.reserve()
+                if wait > 0:
+                    if not deadline.allows(wait):
+                        raise deadlines.DeadlineExceeded("total", deadline.total)
+                    with turn.timer("rate_limit_wait"):
+                        await asyncio.sleep(wait)
+                try:
+                    connect, read = deadline.request_timeout(self._connect_timeout, self._read_timeout)
+                    timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+                    response = await self._send(url, body, turn, timeout)
+                except (deadlines.DeadlineExceeded, deadlines.TurnCancelled):
+                    raise
+                except Exception as e:
+                    deadline.check()
+                    backoff = retry_wait(e, attempt, turn)
+                    if backoff is None or not deadline.allows(backoff):
+                        raise
+                else:
+                    async with response:
+                        # the watchdog runs on its own thread
+                        remove = deadline.on_expire(lambda: loop.call_soon_threadsafe(response.close))
+                        try:
+                            async for event in self._events(response, collector, deadline):
+                                yield event
+                            deadline.check()
+                            limiter.on_success()
+                            return
+                        except eventstream.AgentStreamError as e:
+                            deadline.check()
+                            backoff = None if collector.records else retry_wait(e, attempt, turn)
+                            if backoff is None or not deadline.allows(backoff):
+                                raise
+                        except (deadlines.DeadlineExceeded, deadlines.TurnCancelled):
+                            raise
+                        except Exception:
+                            deadline.check()
+                            raise
+                        finally:
+                            remove()
+                with turn.timer("backoff"):
+                    await asyncio.sleep(backoff)
+
+    async def _send(self, url, body, turn, timeout):
+        # signing and connection setup are timed into the collector's turn
+        with turn.active():
+            headers = await self._signed_headers(url, body)
+            response = await self._get_session().post(url, data=body, headers=headers, timeout=timeout)
+        if response.status != 200:
+            async with response:
+                text = await response.text()
+                error_type = response.headers.get("x-amzn-ErrorType", "").split(":")[0]
+                raise agenthelper.AgentRequestError(response.status, error_type, text)
+        return response
+
+    async def _events(self, response, collector, deadline):
+        turn = collector.turn
+        decoder = eventstream.EventStreamDecoder()
+        async for data in response.content.iter_chunked(eventstream.READ_CHUNK_SIZE):
+            turn.first_byte()
+            deadline.first_byte_received()
+            turn.count("bytes_received", len(data))
+            with turn.timer("decode"):
+                events = []
+                for message in decoder.feed(data):
+                    events.append(eventstream.to_agent_event(message))
+                    if events[-1].event_type == 'trace':
+                        turn.count("trace_bytes", len(message.payload))
+            for event in events:
+                collector.add(event)
+                yield event
+        decoder.close()
+
+
+def retry_wait(error, attempt, turn):
+    # aiohttp raises its own connection errors; a read timeout means the
+    # agent may already be working on the question, so it is not retried
+    if isinstance(error, aiohttp.ClientConnectionError) and (
+            not isinstance(error, asyncio.TimeoutError) or isinstance(error, aiohttp.ConnectionTimeoutError)):
+        if attempt >= rate_limit.MAX_ATTEMPTS:
+            return None
+        turn.count("retries")
+        return rate_limit.backoff_delay(attempt)
+    return agenthelper.retry_wait(error, attempt, turn)
+
+
+# one client per event loop; aiohttp sessions cannot be shared across loops
+_clients = {}
+
+
+async def _close_at_shutdown(client):
+    # asyncio.run() closes the async generators still suspended on its loop
+    # before closing the loop, while the loop can still run the session's
+    # close(); once the loop is closed its sockets can no longer be released
+    try:
+        yield
+    finally:
+        await client.close()
+
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        for other in [l for l in _clients if l.is_closed()]:
+            del _clients[other]
+        client = _clients[loop] = AsyncAgentClient()
+        # the loop only tracks async generators weakly
+        client._closer = _close_at_shutdown(client)
+        asyncio.ensure_future(client._closer.asend(None))
+    return client
+
+
+async def askQuestion_async(question, url, endSession=True, collector=None, deadline=None):
+    if collector is None:
+        collector = TraceCollector()
+    try:
+        async for event in get_client().stream_events(question, url, endSession, collector=collector,
+                                                      deadline=deadline):
+            pass
+    except Exception as e:
+        collector.turn.finish(e)
+        raise
+    collector.turn.finish()
+    return collector.text(), agenthelper.clean_response(collector.answer())
+
+
+async def askQuestionEvents_async(question, url, endSession=True, collector=None, deadline=None):
+    # yields ('trace', payload) and ('chunk', text) in arrival order; the
+    # answer is streamed when the agent supports it, else sent once at the end
+    if collector is None:
+        collector = TraceCollector()
+    error = None
+    try:
+        streamed = False
+        events = get_client().stream_events(
+            question, url, endSession, streamFinalResponse=True, collector=collector, deadline=deadline)
+        async for event in events:
+            if event.event_type == 'chunk':
+                streamed = True
+                yield 'chunk', agenthelper.clean_response(event.text)
+            elif event.event_type == 'trace':
+                yield 'trace', event.payload
+        if not streamed:
+            final_response = collector.answer()
+            if final_response:
+                yield 'chunk', agenthelper.clean_response(final_response)
+    except (GeneratorExit, asyncio.CancelledError):
+        collector.turn.count("cancelled")
+        raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        collector.turn.finish(error)
+
+
+async def askQuestionStream_async(question, url, endSession=True, collector=None, deadline=None):
+    async for kind, data in askQuestionEvents_async(question, url, endSession, collector, deadline):
+        if kind == 'chunk':
+            yield data
+
+
+async def lambda_handler_async(event):
+    sessionId, question, endSession = agenthelper.parse_event(event)
+    router = agenthelper.get_router()
+    target = router.route(sessionId)
+    url = agent_router.session_url(target, sessionId)
+    collector = TraceCollector()
+
+    try:
+        response, trace_data = await askQuestion_async(question, url, endSession, collector)
+        return {
+            "status_code": 200,
+            "body": json.dumps({"response": response, "trace_data": trace_data})
+        }
+    except Exception as e:
+        return {
+            "status_code": 500,
+            "body": json.dumps({"error": str(e)})
+        }
+    finally:
+        router.record_turn(target, collector.turn)
+        if endSession:
+            router.forget(sessionId)
+
+
+async def event_handler_async(event, collector=None, deadline=None):
+    # routed like lambda_handler_async; yields ('trace', payload) and
+    # ('chunk', text) pairs for callers that show the agent's progress
+    sessionId, question, endSession = agenthelper.parse_event(event)
+    router = agenthelper.get_router()
+    target = router.route(sessionId)
+    url = agent_router.session_url(target, sessionId)
+    if collector is None:
+        collector = TraceCollector()
+    try:
+        async for item in askQuestionEvents_async(question, url, endSession, collector, deadline):
+            yield item
+    finally:
+        router.record_turn(target, collector.turn)
+        if endSession:
+            router.forget(sessionId)
+
+
+async def stream_handler_async(event, collector=None, deadline=None):
+    async for kind, data in event_handler_async(event, collector, deadline):
+        if kind == 'chunk':
+            yield data
@@ -0,0 +1,125 @@
+import hashlib
+import hmac
+import threading
+
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.exceptions import NoCredentialsError
+
+# Credentials and SigV4 signing shared by every request in the process.
+#
+# CredentialProvider resolves the normal boto3 credential chain once, on
+# first use, and keeps the resulting botocore credentials object. Each
+# signature takes get_frozen_credentials() from it, and botocore refreshes
+# refreshable credentials (STS, SSO, instance/container roles) from their
+# own source as they near expiry: in the advisory window one caller refreshes
+# while the others keep signing with the current values, in the mandatory
+# window callers wait for the refresh.
+
+
+def _default_session():
+    # botocore resolves the same credential chain as boto3 (profiles, SSO,
+    # STS, instance/container roles) without importing boto3 and s3transfer
+    import botocore.session
+    return botocore.session.get_session()
+
+
+class CredentialProvider:
+
+    def __init__(self, session_factory=_default_session):
+        self._session_factory = session_factory
+        self._credentials = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if self._credentials is None:
+            with self._lock:
+                if self._credentials is None:
+                    credentials = self._session_factory().get_credentials()
+                    if credentials is None:
+                        raise NoCredentialsError()
+                    self._credentials = credentials
+        return self._credentials
+
+    def get_credentials(self):
+        return self._resolve().get_frozen_credentials()
+
+    def get_credentials_nowait(self):
+        # None when getting them could block on the credential chain or a
+        # refresh; lets event loop code push only that case onto a thread
+        credentials = self._credentials
+        if credentials is None:
+            return None
+        refresh_needed = getattr(credentials, 'refresh_needed', None)
+        if refresh_needed is not None and refresh_needed():
+            return None
+        return credentials.get_frozen_credentials()
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_credential_provider():
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = CredentialProvider()
+    return _provider
+
+
+# Derived SigV4 signing keys, one per (access key, date, region, service).
+# A key is valid for the whole UTC day, so signing a request costs a single
+# HMAC over the string to sign instead of the five-HMAC derivation chain.
+
+MAX_SIGNING_KEYS = 64
+
+_signing_keys = {}
+_signing_keys_lock = threading.Lock()
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+
+def signing_key(credentials, date_stamp, region, service):
+    cache_key = (credentials.access_key, date_stamp, region, service)
+    key = _signing_keys.get(cache_key)
+    if key is not None:
+        return key
+
+    k_date = _hmac(f"AWS4{credentials.secret_key}".encode('utf-8'), date_stamp)
+    k_region = _hmac(k_date, region)
+    k_service = _hmac(k_region, service)
+    key = _hmac(k_service, 'aws4_request')
+
+    with _signing_keys_lock:
+        # keys from earlier days (or rotated credentials) are never used again
+        if len(_signing_keys) >= MAX_SIGNING_KEYS:
+            for stale in [k for k in _signing_keys if k[1] != date_stamp]:
+                del _signing_keys[stale]
+            if len(_signing_keys) >= MAX_SIGNING_KEYS:
+                _signing_keys.clear()
+        _signing_keys[cache_key] = key
+    return key
+
+
+class CachedSigV4Auth(SigV4Auth):
+
+    def signature(self, string_to_sign, request):
+        key = signing_key(self.credentials, request.context["timestamp"][0:8],
+                          self._region_name, self._service_name)
+        return hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def sign_request(url, method, body, params, headers, service, region, credentials):
+    req = AWSRequest(
+        method=method,
+        url=url,
+        data=body,
+        params=params,
+        headers=headers
+    )
+    CachedSigV4Auth(credentials, service, region).add_auth(req)
+    return req.prepare()
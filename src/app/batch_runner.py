@@ -0,0 +1,251 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import agent_trace
+import answer_cache
+from trace_collector import TraceCollector
+
+# Replays a file of questions against the agent for offline evaluation.
+#
+#   python batch_runner.py questions.jsonl results.jsonl --concurrency 16
+#
+# Input is JSONL or CSV (picked by file extension, or --format) with a
+# `question` column and optional `id` and `session` columns. Questions that
+# share a session value form one conversation: they are asked in file order
+# on the same agent session, which is ended after the last one. Questions
+# without a session each get their own. Sessions are independent, so up to
+# --concurrency of them run at once.
+#
+# Each answered question is appended to the output as one JSON line with the
+# answer, the parsed trace steps and the turn timings. When the output file
+# already exists the run resumes: sessions whose questions all succeeded are
+# kept and skipped, anything else is dropped from the file and asked again
+# from the session's first question, since the agent's memory of a broken
+# conversation is gone.
+
+
+def load_questions(path, fmt=None):
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, newline="") as f:
+        if fmt == "csv":
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    questions = []
+    seen = set()
+    for index, row in enumerate(rows, 1):
+        question = (row.get("question") or "").strip()
+        if not question:
+            raise ValueError(f"{path}: row {index} has no question")
+        question_id = str(row.get("id") or index)
+        if question_id in seen:
+            raise ValueError(f"{path}: duplicate id {question_id}")
+        seen.add(question_id)
+        questions.append({"id": question_id, "question": question, "session": row.get("session") or None})
+    return questions
+
+
+def group_questions(questions):
+    # session key -> questions in file order; unsessioned questions stand alone
+    groups = OrderedDict()
+    for question in questions:
+        key = question["session"] if question["session"] is not None else "\0" + question["id"]
+        groups.setdefault(key, []).append(question)
+    return groups
+
+
+def _read_rows(path):
+    rows = []
+    if not os.path.exists(path):
+        return rows
+    with open(path) as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                # the last line of an interrupted run may be cut short
+                continue
+    return rows
+
+
+def prepare_resume(output_path, groups):
+    # keeps the rows of fully answered sessions and returns their keys
+    rows = [row for row in _read_rows(output_path) if row.get("status") == "ok"]
+    ok_ids = {row.get("id") for row in rows}
+    done = {key for key, group in groups.items() if all(q["id"] in ok_ids for q in group)}
+    done_ids = {q["id"] for key in done for q in groups[key]}
+
+    kept = [row for row in rows if row.get("id") in done_ids]
+    if os.path.exists(output_path):
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for row in kept:
+                f.write(json.dumps(row) + "\n")
+        os.replace(tmp_path, output_path)
+    return done
+
+
+class ResultWriter:
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+
+    def write(self, row):
+        line = json.dumps(row)
+        with self._lock:
+            self._file.write(line + "\n")
+            # flushed per row so an interrupted run loses at most one line
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def result_row(question, agent_session_id, turn_index, result, collector, latency_s, error=None):
+    row = {
+        "id": question["id"],
+        "session": question["session"],
+        "agent_session_id": agent_session_id,
+        "turn": turn_index,
+        "question": question["question"],
+        "status": "error",
+        "answer": None,
+        "error": error,
+        "latency_s": round(latency_s, 6),
+    }
+    if result is not None:
+        body = json.loads(result["body"])
+        if result["status_code"] == 200:
+            row["status"] = "ok"
+            # lambda_handler puts the answer under trace_data and the raw
+            # trace under response, as the chat frontend has always read them
+            row["answer"] = body["trace_data"]
+        else:
+            row["error"] = body.get("error")
+
+    latency = agent_trace.turn_latency(collector.records)
+    turn = collector.turn.as_dict()
+    row["timings"] = turn["durations"]
+    row["counters"] = turn["counters"]
+    row["trace_latency"] = {
+        "total": round(latency.total, 6),
+        "first_chunk": None if latency.first_chunk is None else round(latency.first_chunk, 6),
+        "by_category": {k: round(v, 6) for k, v in latency.by_category.items()},
+        "input_tokens": latency.input_tokens,
+        "output_tokens": latency.output_tokens,
+    }
+    row["steps"] = [step._asdict() for step in agent_trace.parse_steps(collector.records)]
+    # documents the answer came from, kept for building the FAQ index
+    row["sources"] = agent_trace.cited_sources(collector.records)
+    # whether the answer may be shown to anyone else, as for the answer cache
+    row["cacheable"] = answer_cache.is_cacheable(collector.records)
+    return row
+
+
+def run_group(group, handler, writer, stop):
+    agent_session_id = uuid.uuid4().hex
+    rows = []
+    for turn_index, question in enumerate(group):
+        if stop.is_set():
+            break
+        event = {
+            "sessionId": agent_session_id,
+            "question": question["question"],
+            "endSession": "true" if turn_index == len(group) - 1 else "false",
+        }
+        collector = TraceCollector()
+        result = error = None
+        started = time.perf_counter()
+        try:
+            result = handler(event, collector)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        row = result_row(question, agent_session_id, turn_index, result, collector,
+                         time.perf_counter() - started, error)
+        writer.write(row)
+        rows.append(row)
+    return rows
+
+
+def run_batch(questions, output_path, handler, concurrency=8, resume=True, progress=None):
+    groups = group_questions(questions)
+    if resume:
+        done = prepare_resume(output_path, groups)
+    else:
+        done = set()
+        open(output_path, "w").close()
+    pending = [group for key, group in groups.items() if key not in done]
+
+    summary = {
+        "questions": len(questions),
+        "sessions": len(groups),
+        "skipped": sum(len(groups[key]) for key in done),
+        "ok": 0,
+        "errors": 0,
+    }
+    writer = ResultWriter(output_path)
+    stop = threading.Event()
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        futures = [pool.submit(run_group, group, handler, writer, stop) for group in pending]
+        for future in as_completed(futures):
+            for row in future.result():
+                summary["ok" if row["status"] == "ok" else "errors"] += 1
+            if progress is not None:
+                progress(summary)
+    except BaseException:
+        # sessions in flight finish their current question; the rest never start
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        pool.shutdown(wait=True)
+        writer.close()
+    summary["wall_time_s"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask a file of questions to the agent and write the answers as JSONL")
+    parser.add_argument("questions", help="JSONL or CSV with question and optional id, session columns")
+    parser.add_argument("output", help="JSONL results; resumed if it exists")
+    parser.add_argument("--format", choices=("jsonl", "csv"))
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions run at once")
+    parser.add_argument("--restart", action="store_true", help="discard existing results instead of resuming")
+    parser.add_argument("--endpoint", help="agent runtime endpoint, e.g. the bench stub")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions, args.format)
+    if args.endpoint:
+        os.environ["BR_AGENT_ENDPOINT"] = args.endpoint
+    # one pooled connection per concurrent session
+    os.environ.setdefault("BR_AGENT_POOL_SIZE", str(max(args.concurrency, 1)))
+    # keep stdout for the summary instead of every question and URL
+    os.environ.setdefault("BR_AGENT_LOG_TURNS", "false")
+    import invoke_br_agent
+
+    def progress(summary):
+        done = summary["skipped"] + summary["ok"] + summary["errors"]
+        print(f"{done}/{summary['questions']} questions, {summary['errors']} errors", file=sys.stderr)
+
+    summary = run_batch(questions, args.output, invoke_br_agent.lambda_handler,
+                        args.concurrency, not args.restart, progress)
+    for key, value in summary.items():
+        print(f"{key:>12}: {value}")
+    if summary["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
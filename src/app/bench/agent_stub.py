@@ -0,0 +1,205 @@
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import eventstream
+
+# Local stand-in for the bedrock-agent-runtime InvokeAgent endpoint
+#   POST /agents/{agentId}/agentAliases/{agentAliasId}/sessions/{sessionId}/text
+# It answers with real event-stream frames (trace events, then answer
+# chunks) over a keep-alive HTTP/1.1 connection, with configurable sizes,
+# delays and error rates. Signatures are not checked.
+#
+#   python bench/agent_stub.py --port 8900 --chunks 20 --chunk-delay 0.05
+#   BR_AGENT_ENDPOINT=http://127.0.0.1:8900 streamlit run main.py
+
+PATH_PATTERN = re.compile(r'^/agents/[^/]+/agentAliases/[^/]+/sessions/([^/]+)/text$')
+
+DEFAULT_CONFIG = {
+    "chunks": 10,             # answer chunk frames per response
+    "chunk_size": 200,        # characters per answer chunk
+    "traces": 6,              # trace frames sent before the answer
+    "trace_size": 2000,       # characters of rationale text per trace frame
+    "header_delay": 0.0,      # seconds before the response headers
+    "first_byte_delay": 0.0,  # seconds before the first frame
+    "chunk_delay": 0.0,       # seconds between frames
+    "error_rate": 0.0,        # fraction of requests failed with an HTTP error up front
+    "throttle_rate": 0.0,     # fraction of requests rejected with HTTP 429
+    "stream_error_rate": 0.0, # fraction of streams ending in an exception frame
+    "max_rps": 0.0,           # requests per second accepted before answering 429 (0: no limit)
+}
+
+
+def trace_frame(session_id, index, size):
+    payload = {
+        "agentId": "STUBAGENT",
+        "agentAliasId": "STUBALIAS",
+        "sessionId": session_id,
+        "trace": {"orchestrationTrace": {"rationale": {
+            "traceId": f"stub-{index}",
+            "text": ("lorem ipsum " * (size // 12 + 1))[:size],
+        }}},
+    }
+    return eventstream.encode_agent_event('trace', payload)
+
+
+def chunk_frame(index, size):
+    text = (f"[{index}] " + "answer " * (size // 7 + 1))[:size]
+    return eventstream.encode_agent_event('chunk', {"bytes": base64.b64encode(text.encode()).decode()})
+
+
+def exception_frame(error_type, message):
+    return eventstream.encode_message(
+        {':message-type': 'exception', ':exception-type': error_type, ':content-type': 'application/json'},
+        json.dumps({"message": message}).encode())
+
+
+class ServiceQuota:
+    # token bucket with one second of burst, like a per-account TPS quota
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class AgentStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # every frame is its own small write; with Nagle on, each response waits
+    # for the client's delayed ACK (~40 ms) and the stub measures that instead
+    disable_nagle_algorithm = True
+    config = DEFAULT_CONFIG
+    quota = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json_error(self, status, error_type, message):
+        body = json.dumps({"message": message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("x-amzn-ErrorType", error_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        # HTTP/1.1 chunked transfer encoding
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        match = PATH_PATTERN.match(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        if not match:
+            self._send_json_error(404, "ResourceNotFoundException", f"Unknown path {self.path}")
+            return
+        try:
+            json.loads(body or b"{}")["inputText"]
+        except (ValueError, KeyError):
+            self._send_json_error(400, "ValidationException", "inputText is required")
+            return
+
+        config = self.config
+        roll = random.random()
+        if roll < config["throttle_rate"] or (self.quota is not None and not self.quota.allow()):
+            self._send_json_error(429, "ThrottlingException", "Rate exceeded")
+            return
+        if roll < config["throttle_rate"] + config["error_rate"]:
+            self._send_json_error(500, "InternalServerException", "Stub failure")
+            return
+
+        if config["header_delay"]:
+            time.sleep(config["header_delay"])
+        session_id = match.group(1)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("x-amzn-bedrock-agent-session-id", session_id)
+        self.end_headers()
+
+        if config["first_byte_delay"]:
+            time.sleep(config["first_byte_delay"])
+        frames = [trace_frame(session_id, i, config["trace_size"]) for i in range(config["traces"])]
+        frames += [chunk_frame(i, config["chunk_size"]) for i in range(config["chunks"])]
+        fail_at = None
+        if random.random() < config["stream_error_rate"]:
+            fail_at = random.randrange(len(frames) + 1)
+        try:
+            for index, frame in enumerate(frames):
+                if index == fail_at:
+                    break
+                if index and config["chunk_delay"]:
+                    time.sleep(config["chunk_delay"])
+                self._write_chunk(frame)
+            if fail_at is not None:
+                self._write_chunk(exception_frame("internalServerException", "Stub stream failure"))
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up on the turn (deadline, stop button)
+            self.close_connection = True
+
+
+class AgentStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connects under load (1 s SYN retry)
+    request_queue_size = 256
+
+
+def start_stub(config=None, host="127.0.0.1", port=0):
+    # runs the stub on a background thread; returns (server, base url)
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    quota = ServiceQuota(config["max_rps"]) if config["max_rps"] else None
+    handler = type("ConfiguredAgentStubHandler", (AgentStubHandler,), {"config": config, "quota": quota})
+    server = AgentStubServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="agent-stub", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_stub_arguments(parser):
+    for key, default in DEFAULT_CONFIG.items():
+        parser.add_argument("--" + key.replace("_", "-"), type=type(default), default=default)
+
+
+def stub_config(args):
+    return {key: getattr(args, key) for key in DEFAULT_CONFIG}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local bedrock-agent-runtime stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    server, url = start_stub(stub_config(args), args.host, args.port)
+    print(f"Agent stub listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import agent_stub
+
+# Load driver for invoke_br_agent.lambda_handler against the local stub (or
+# any endpoint given with --endpoint). Each worker thread owns one agent
+# session and sends its questions back to back, like a chat user would.
+#
+#   python bench/load_test.py --concurrency 32 --requests 20 --chunks 40 --chunk-delay 0.01
+#
+# Reports throughput, latency and time-to-first-frame percentiles, error
+# counts, and the peak Python heap of a single request (measured separately
+# with tracemalloc so it does not slow the timed run).
+#
+# --transport http,boto3 runs the same workload once per transport (see
+# boto_transport) and prints the summaries side by side.
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    # nearest-rank
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100.0 * len(values)) - 1)]
+
+
+def run_request(agenthelper, TraceCollector, session_id, question):
+    collector = TraceCollector()
+    started = time.perf_counter()
+    result = agenthelper.lambda_handler(
+        {"sessionId": session_id, "question": question, "endSession": "false"}, collector)
+    latency = time.perf_counter() - started
+    first_frame = collector.records[0].elapsed if collector.records else None
+    return result["status_code"], latency, first_frame, collector.turn.counters.get("retries", 0)
+
+
+def measure_request_memory(agenthelper, TraceCollector, samples):
+    peaks = []
+    for i in range(samples):
+        tracemalloc.start()
+        run_request(agenthelper, TraceCollector, f"memory-{i}", "How do I access my grades?")
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(peaks) if peaks else None
+
+
+def run_load(agenthelper, TraceCollector, concurrency, requests_per_session):
+    results = []
+    results_lock = threading.Lock()
+    start_barrier = threading.Barrier(concurrency)
+
+    def worker():
+        session_id = uuid.uuid4().hex
+        local = []
+        start_barrier.wait()
+        for i in range(requests_per_session):
+            local.append(run_request(agenthelper, TraceCollector, session_id, f"Question {i}"))
+        with results_lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, wall_time, memory_peak):
+    ok = [r for r in results if r[0] == 200]
+    latencies = [r[1] for r in ok]
+    first_frames = [r[2] for r in ok if r[2] is not None]
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "retries": sum(r[3] for r in results),
+        "wall_time_s": round(wall_time, 3),
+        "throughput_rps": round(len(results) / wall_time, 2) if wall_time else None,
+        "request_peak_memory_kib": round(memory_peak / 1024, 1) if memory_peak else None,
+    }
+    for name, values in (("latency", latencies), ("ttfb", first_frames)):
+        for pct in (50, 95, 99):
+            value = percentile(values, pct)
+            summary[f"{name}_p{pct}_ms"] = round(value * 1000, 1) if value is not None else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test invoke_br_agent.lambda_handler")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent agent sessions")
+    parser.add_argument("--requests", type=int, default=10, help="questions per session")
+    parser.add_argument("--memory-samples", type=int, default=5)
+    parser.add_argument("--endpoint", help="use a running endpoint instead of starting the stub")
+    parser.add_argument("--json", help="also write the summary to this file")
+    parser.add_argument("--transport", default="http",
+                        help="comma separated transports to compare: http, boto3")
+    agent_stub.add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        server, endpoint = agent_stub.start_stub(agent_stub.stub_config(args))
+    os.environ["BR_AGENT_ENDPOINT"] = endpoint
+    # the stub does not check signatures, but signing still needs credentials
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "AKIDLOADTEST")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "load-test-secret")
+    # lambda_handler prints every question; keep the report readable
+    os.environ.setdefault("BR_AGENT_LOG_TURNS", "false")
+
+    import invoke_br_agent as agenthelper
+    from trace_collector import TraceCollector
+
+    summaries = {}
+    for transport_name in args.transport.split(","):
+        agenthelper.TRANSPORT = transport_name
+        run_request(agenthelper, TraceCollector, "warmup", "warm up")
+        memory_peak = measure_request_memory(agenthelper, TraceCollector, args.memory_samples)
+        results, wall_time = run_load(agenthelper, TraceCollector, args.concurrency, args.requests)
+        summary = summarize(results, wall_time, memory_peak)
+        summary["concurrency"] = args.concurrency
+        summaries[transport_name] = summary
+
+    print(f"{'':>26}  " + "".join(f"{name:>12}" for name in summaries))
+    for key in next(iter(summaries.values())):
+        print(f"{key:>26}: " + "".join(f"{str(summary[key]):>12}" for summary in summaries.values()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summaries if len(summaries) > 1 else summary, f, indent=2)
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Startup benchmark for the chatbot: import time of main.py and time to the
+# first rendered page, each measured in a fresh interpreter so nothing is
+# already cached in sys.modules.
+#
+#   python bench/startup_bench.py --runs 5
+#   python bench/startup_bench.py --max-import-ms 600 --max-render-ms 2500
+#
+# With the thresholds set it exits non-zero on a regression. It also fails
+# when a module that should load lazily (boto3, botocore, requests, pandas)
+# is imported by main at startup.
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LAZY_MODULES = ("boto3", "botocore", "requests", "pandas")
+
+IMPORT_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "eager": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+RENDER_SNIPPET = """
+import json, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("main.py", default_timeout=60)
+app.run()
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "exception": [str(e.value) for e in app.exception]}))
+"""
+
+
+def run_snippet(snippet):
+    # the result is the last line of stdout; streamlit logs go to stderr
+    result = subprocess.run([sys.executable, "-c", snippet], cwd=APP_DIR,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(limit):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=APP_DIR, capture_output=True, text=True, check=True)
+    # importtime prints children before their parent, indented two more
+    # spaces; collect the direct children of the top level "main" entry
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue
+        name = parts[2][1:].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name == "main":
+                return sorted(children, reverse=True)[:limit]
+            children = []
+        elif depth == 1:
+            children.append((cumulative, name.strip()))
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure chatbot import time and time to first render")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-render-ms", type=float)
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    imports = [run_snippet(IMPORT_SNIPPET) for _ in range(args.runs)]
+    renders = [run_snippet(RENDER_SNIPPET) for _ in range(args.runs)]
+
+    summary = {
+        "import_ms_median": round(statistics.median(r["seconds"] for r in imports) * 1000, 1),
+        "import_ms_min": round(min(r["seconds"] for r in imports) * 1000, 1),
+        "first_render_ms_median": round(statistics.median(r["seconds"] for r in renders) * 1000, 1),
+        "first_render_ms_min": round(min(r["seconds"] for r in renders) * 1000, 1),
+        "eager_modules": sorted(set(m for r in imports for m in r["eager"])),
+        "render_exceptions": sorted(set(e for r in renders for e in r["exception"])),
+    }
+    for key, value in summary.items():
+        print(f"{key:>24}: {value}")
+    print("slowest imports under main (cumulative ms):")
+    for cumulative, name in slowest_imports(8):
+        print(f"{cumulative / 1000:>10.1f}  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    failures = []
+    if summary["eager_modules"]:
+        failures.append(f"loaded at startup: {', '.join(summary['eager_modules'])}")
+    if summary["render_exceptions"]:
+        failures.append("first render raised an exception")
+    if args.max_import_ms is not None and summary["import_ms_median"] > args.max_import_ms:
+        failures.append(f"import {summary['import_ms_median']} ms > {args.max_import_ms} ms")
+    if args.max_render_ms is not None and summary["first_render_ms_median"] > args.max_render_ms:
+        failures.append(f"first render {summary['first_render_ms_median']} ms > {args.max_render_ms} ms")
+    if failures:
+        print("FAILED: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
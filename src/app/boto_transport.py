@@ -0,0 +1,159 @@
+import base64
+import datetime
+import re
+import threading
+
+import eventstream
+import instrumentation
+import transport
+
+# InvokeAgent through botocore's bedrock-agent-runtime client, as an
+# alternative to the hand-signed requests in invoke_br_agent. botocore signs
+# the request, keeps its own connection pool and parses the event stream;
+# events come out as the same eventstream.AgentEvent values, so the
+# collector, the retry loop and the deadlines work unchanged.
+#
+# One client per endpoint (region and URL) for the whole process. botocore's
+# own retries are off: invoke_br_agent's loop retries, paces and times out
+# every attempt the same way for both transports. Each call's read timeout
+# is clipped to what is left of the turn's deadline through the request
+# context, since the client's config is shared by all calls.
+#
+#   BR_AGENT_TRANSPORT   "http" (default) or "boto3" to use this module
+#   BR_AGENT_POOL_SIZE, BR_AGENT_CONNECT_TIMEOUT and BR_AGENT_READ_TIMEOUT
+#   size the client like the HTTP transport
+
+URL_PATTERN = re.compile(r'^(?P<base>.+)/agents/(?P<agent>[^/]+)/agentAliases/(?P<alias>[^/]+)'
+                         r'/sessions/(?P<session>[^/]+)/text$')
+
+_clients = {}
+_clients_lock = threading.Lock()
+# read timeout of the call the current thread is making
+_call = threading.local()
+
+
+def create_client(region, endpoint_url=None):
+    import botocore.config
+    import botocore.session
+    config = botocore.config.Config(
+        max_pool_connections=transport.POOL_SIZE,
+        connect_timeout=transport.CONNECT_TIMEOUT,
+        read_timeout=transport.READ_TIMEOUT,
+        tcp_keepalive=True,
+        retries={"total_max_attempts": 1},
+    )
+    client = botocore.session.get_session().create_client(
+        'bedrock-agent-runtime', region_name=region, endpoint_url=endpoint_url, config=config)
+    client.meta.events.register('before-call.bedrock-agent-runtime.InvokeAgent', _set_read_timeout)
+    return client
+
+
+def _set_read_timeout(context, **kwargs):
+    # botocore's HTTP session reads a per-request read timeout from here
+    read_timeout = getattr(_call, "read_timeout", None)
+    if read_timeout is not None:
+        context['read_timeout'] = read_timeout
+
+
+def get_client(region, endpoint_url=None):
+    key = (region, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        # botocore clients are thread safe, creating them is not
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = create_client(region, endpoint_url)
+    return client
+
+
+class AgentStream:
+    # the open InvokeAgent response; raw is the urllib3 response under it,
+    # so transport.abort_response can shut its socket down
+
+    def __init__(self, completion):
+        self.completion = completion
+        self.raw = completion._raw_stream
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.completion.close()
+
+
+def send_question(question, url, endSession=True, streamFinalResponse=False, collector=None, timeout=None):
+    # Same arguments as invoke_br_agent.send_question. timeout is the
+    # (connect, read) pair from the turn's deadline; the connect timeout is
+    # the client's, the read timeout applies to this call's socket.
+    import botocore.exceptions
+    import invoke_br_agent
+    match = URL_PATTERN.match(url)
+    if match is None:
+        raise ValueError(f"Not an InvokeAgent URL: {url}")
+    params = {
+        "agentId": match.group("agent"),
+        "agentAliasId": match.group("alias"),
+        "sessionId": match.group("session"),
+        "inputText": question,
+        "enableTrace": True,
+        "endSession": endSession,
+    }
+    if streamFinalResponse:
+        params["streamingConfigurations"] = {"streamFinalResponse": True}
+    turn = collector.turn if collector is not None else instrumentation.Turn()
+    with turn.active():
+        client = get_client(invoke_br_agent.region_for(url), match.group("base"))
+        _call.read_timeout = timeout[1] if timeout is not None else None
+        try:
+            response = client.invoke_agent(**params)
+        except botocore.exceptions.ClientError as e:
+            metadata = e.response.get("ResponseMetadata", {})
+            error = e.response.get("Error", {})
+            raise invoke_br_agent.AgentRequestError(
+                metadata.get("HTTPStatusCode", 0), error.get("Code", ""), error.get("Message", str(e))) from e
+        finally:
+            _call.read_timeout = None
+    return AgentStream(response["completion"])
+
+
+def _jsonable(value):
+    # botocore hands back timestamps as datetimes and blobs as bytes; the
+    # HTTP transport's events are plain JSON, so convert them back
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    return value
+
+
+def to_agent_event(parsed):
+    # {'chunk': {'bytes': b'...'}} -> AgentEvent('chunk', {'bytes': 'base64'}, text)
+    event_type, payload = next(iter(parsed.items()))
+    text = None
+    if event_type == 'chunk' and 'bytes' in payload:
+        text = payload['bytes'].decode('utf-8')
+    return eventstream.AgentEvent(event_type, _jsonable(payload), text)
+
+
+def iter_response_events(stream, collector, deadline=None):
+    # Same contract as invoke_br_agent.iter_response_events. botocore reads
+    # and parses in one step, so there is no separate decode timing.
+    import botocore.exceptions
+    turn = collector.turn
+    try:
+        for parsed in stream.completion:
+            turn.first_byte()
+            if deadline is not None:
+                deadline.first_byte_received()
+            event = to_agent_event(parsed)
+            collector.add(event)
+            yield event
+    except botocore.exceptions.EventStreamError as e:
+        error = e.response.get("Error", {})
+        raise eventstream.AgentStreamError(error.get("Code", "UnknownException"),
+                                           error.get("Message", "")) from e
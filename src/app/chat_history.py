@@ -0,0 +1,56 @@
+import os
+from collections import deque
+
+# Bounded chat history for one browser session.
+#
+# Streamlit re-renders the conversation on every rerun, so only the most
+# recent window of messages is drawn by default; older ones are drawn a page
+# at a time when the user asks for them. The history itself is capped by
+# message count and by total content size, dropping the oldest turns first,
+# so a long support conversation neither slows down nor grows without limit.
+#
+#   BR_CHAT_HISTORY_WINDOW     messages rendered on each rerun (default 20)
+#   BR_CHAT_HISTORY_PAGE       older messages revealed per click (default 20)
+#   BR_CHAT_HISTORY_MESSAGES   max messages kept per session (default 200)
+#   BR_CHAT_HISTORY_BYTES      max content bytes kept per session (default 262144)
+
+HISTORY_WINDOW = int(os.environ.get("BR_CHAT_HISTORY_WINDOW", "20"))
+HISTORY_PAGE = int(os.environ.get("BR_CHAT_HISTORY_PAGE", "20"))
+HISTORY_MAX_MESSAGES = int(os.environ.get("BR_CHAT_HISTORY_MESSAGES", "200"))
+HISTORY_MAX_BYTES = int(os.environ.get("BR_CHAT_HISTORY_BYTES", str(256 * 1024)))
+
+
+class ChatHistory:
+
+    def __init__(self, max_messages=HISTORY_MAX_MESSAGES, max_bytes=HISTORY_MAX_BYTES):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._messages = deque()
+        self._size = 0
+        # messages dropped to stay under the caps
+        self.dropped = 0
+
+    def append(self, message):
+        size = len(message["content"].encode("utf-8"))
+        self._messages.append((message, size))
+        self._size += size
+        # always keep the newest message, even if it alone exceeds the cap
+        while len(self._messages) > 1 and (
+                len(self._messages) > self.max_messages or self._size > self.max_bytes):
+            _, dropped_size = self._messages.popleft()
+            self._size -= dropped_size
+            self.dropped += 1
+
+    def __len__(self):
+        return len(self._messages)
+
+    def size(self):
+        return self._size
+
+    def window(self, count):
+        # the last `count` messages, oldest first
+        start = max(0, len(self._messages) - count)
+        return [self._messages[i][0] for i in range(start, len(self._messages))]
+
+    def hidden_count(self, shown):
+        return max(0, len(self._messages) - shown)
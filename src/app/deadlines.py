@@ -0,0 +1,190 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+# Time budget for one agent turn.
+#
+# A turn has two deadlines measured from when it starts: the first byte of
+# the answer must arrive within BR_AGENT_FIRST_BYTE_TIMEOUT, and the whole
+# answer within BR_AGENT_TURN_TIMEOUT. Connect and per-read socket timeouts
+# are clipped to what is left of the budget, and a watchdog thread fires the
+# turn's abort callbacks (which shut the connection down) the moment a
+# deadline passes, so a stalled stream releases its thread and connection
+# instead of blocking in recv. cancel() does the same on demand.
+#
+#   BR_AGENT_TURN_TIMEOUT        seconds for the whole turn (default 300)
+#   BR_AGENT_FIRST_BYTE_TIMEOUT  seconds until the answer starts (default 60)
+
+TURN_TIMEOUT = float(os.environ.get("BR_AGENT_TURN_TIMEOUT", "300"))
+FIRST_BYTE_TIMEOUT = float(os.environ.get("BR_AGENT_FIRST_BYTE_TIMEOUT", "60"))
+
+
+class DeadlineExceeded(Exception):
+
+    def __init__(self, stage, seconds):
+        super().__init__(f"Agent turn exceeded its {stage} deadline ({seconds:g} s)")
+        self.stage = stage
+        self.seconds = seconds
+
+
+class TurnCancelled(Exception):
+
+    def __init__(self):
+        super().__init__("Agent turn was cancelled")
+
+
+class Deadline:
+
+    def __init__(self, total=TURN_TIMEOUT, first_byte=FIRST_BYTE_TIMEOUT, clock=time.monotonic):
+        self.total = total
+        self.first_byte = first_byte
+        self._clock = clock
+        self.started = clock()
+        self._first_byte_seen = False
+        self._cancelled = False
+        self._fired = False
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._ids = itertools.count()
+
+    def _deadlines(self):
+        # (stage, budget, absolute time) still ahead of this turn
+        deadlines = [("total", self.total, self.started + self.total)]
+        if not self._first_byte_seen and self.first_byte < self.total:
+            deadlines.append(("first byte", self.first_byte, self.started + self.first_byte))
+        return deadlines
+
+    def next_expiry(self):
+        return min(when for _, _, when in self._deadlines())
+
+    def exceeded(self):
+        # the deadline that has passed, as (stage, budget), or None
+        now = self._clock()
+        for stage, budget, when in self._deadlines():
+            if now >= when:
+                return stage, budget
+        return None
+
+    def remaining(self):
+        return max(0.0, self.next_expiry() - self._clock())
+
+    def check(self):
+        if self._cancelled:
+            raise TurnCancelled()
+        exceeded = self.exceeded()
+        if exceeded is not None:
+            raise DeadlineExceeded(*exceeded)
+
+    def request_timeout(self, connect, read):
+        # (connect, read) socket timeouts for the next request of this turn
+        self.check()
+        remaining = self.remaining()
+        return (min(connect, remaining), min(read, remaining))
+
+    def allows(self, seconds):
+        return not self._cancelled and seconds < self.remaining()
+
+    def first_byte_received(self):
+        self._first_byte_seen = True
+
+    def on_expire(self, callback):
+        # callback runs once, from the watchdog thread or cancel(), if the turn
+        # runs out of time while it is registered; returns the unregister hook
+        with self._lock:
+            if self._fired:
+                fire = True
+            else:
+                fire = False
+                if not self._callbacks:
+                    _watchdog().watch(self)
+                key = next(self._ids)
+                self._callbacks[key] = callback
+        if fire:
+            callback()
+            return lambda: None
+
+        def remove():
+            # with no callback left there is nothing to abort, so the
+            # watchdog can forget the turn right away
+            with self._lock:
+                if self._callbacks.pop(key, None) is not None and not self._callbacks:
+                    _watchdog().unwatch(self)
+        return remove
+
+    def cancel(self):
+        self._cancelled = True
+        self._fire()
+
+    def _fire(self):
+        with self._lock:
+            self._fired = True
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+            if callbacks:
+                _watchdog().unwatch(self)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Deadline abort callback failed: {e}")
+
+
+class _Watchdog:
+    # one thread for the whole process, sleeping until the nearest deadline
+
+    def __init__(self):
+        self._heap = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, name="agent-deadlines", daemon=True).start()
+
+    def watch(self, deadline):
+        # scheduled on the watchdog's own clock; the deadline's clock decides
+        # whether it really expired when the entry comes due
+        when = time.monotonic() + max(0.0, deadline.next_expiry() - deadline._clock())
+        with self._condition:
+            heapq.heappush(self._heap, (when, next(self._order), deadline))
+            self._condition.notify()
+
+    def unwatch(self, deadline):
+        with self._condition:
+            heap = [entry for entry in self._heap if entry[2] is not deadline]
+            if len(heap) < len(self._heap):
+                heapq.heapify(heap)
+                self._heap[:] = heap
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                when, _, deadline = self._heap[0]
+                delay = when - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            if deadline._fired or not deadline._callbacks:
+                continue
+            if deadline.exceeded() is not None:
+                deadline._fire()
+                continue
+            with deadline._lock:
+                # the first byte arrived in time; wait for the total deadline
+                if not deadline._fired and deadline._callbacks:
+                    self.watch(deadline)
+
+
+_watchdog_instance = None
+_watchdog_lock = threading.Lock()
+
+
+def _watchdog():
+    global _watchdog_instance
+    if _watchdog_instance is None:
+        with _watchdog_lock:
+            if _watchdog_instance is None:
+                _watchdog_instance = _Watchdog()
+    return _watchdog_instance
@@ -0,0 +1,220 @@
+import base64
+import json
+import struct
+import zlib
+from collections import namedtuple
+
+# Incremental decoder for the AWS event-stream framing used by the
+# bedrock-agent-runtime InvokeAgent response.
+#
+# Every message on the wire is laid out as:
+#   prelude   total length (4) | headers length (4) | prelude CRC32 (4)
+#   headers   name length (1) | name | value type (1) | value ...
+#   payload   total length - headers length - 16 bytes
+#   trailer   message CRC32 (4)
+# Frames are decoded as soon as their last byte arrives, so a read can
+# span any number of frames and a frame can span any number of reads.
+
+PRELUDE_LENGTH = 12
+TRAILER_LENGTH = 4
+MAX_HEADERS_LENGTH = 128 * 1024
+MAX_MESSAGE_LENGTH = 16 * 1024 * 1024 + MAX_HEADERS_LENGTH + PRELUDE_LENGTH + TRAILER_LENGTH
+
+# read size used when pulling the body off the socket
+READ_CHUNK_SIZE = 64 * 1024
+
+EventStreamMessage = namedtuple('EventStreamMessage', ['headers', 'payload'])
+
+# event_type is one of 'chunk', 'trace', 'returnControl' (or any new type the
+# service adds). text holds the decoded answer fragment for 'chunk' events.
+AgentEvent = namedtuple('AgentEvent', ['event_type', 'payload', 'text'])
+
+
+class EventStreamError(Exception):
+    pass
+
+
+class AgentStreamError(Exception):
+    # raised for ':message-type' exception/error frames sent by the service
+    def __init__(self, error_type, message):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+        self.message = message
+
+
+def _decode_headers(data):
+    headers = {}
+    offset = 0
+    end = len(data)
+    while offset < end:
+        name_length = data[offset]
+        offset += 1
+        name = bytes(data[offset:offset + name_length]).decode('utf-8')
+        offset += name_length
+        value_type = data[offset]
+        offset += 1
+        if value_type == 0:
+            value = True
+        elif value_type == 1:
+            value = False
+        elif value_type == 2:
+            value = struct.unpack_from('>b', data, offset)[0]
+            offset += 1
+        elif value_type == 3:
+            value = struct.unpack_from('>h', data, offset)[0]
+            offset += 2
+        elif value_type == 4:
+            value = struct.unpack_from('>i', data, offset)[0]
+            offset += 4
+        elif value_type in (5, 8):
+            # 8 is a timestamp in epoch milliseconds
+            value = struct.unpack_from('>q', data, offset)[0]
+            offset += 8
+        elif value_type in (6, 7):
+            value_length = struct.unpack_from('>H', data, offset)[0]
+            offset += 2
+            value = bytes(data[offset:offset + value_length])
+            if value_type == 7:
+                value = value.decode('utf-8')
+            offset += value_length
+        elif value_type == 9:
+            value = bytes(data[offset:offset + 16])
+            offset += 16
+        else:
+            raise EventStreamError(f"Unknown header value type {value_type} for {name}")
+        headers[name] = value
+    if offset != end:
+        raise EventStreamError("Header block overran its declared length")
+    return headers
+
+
+class EventStreamDecoder:
+    # Feed raw bytes in, get complete messages out. Only the unconsumed tail
+    # (at most one partial message) is kept between calls.
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        if data:
+            self._buffer += data
+        return self._drain()
+
+    def _drain(self):
+        buffer = self._buffer
+        offset = 0
+        messages = []
+        # every view of the buffer is released on the way out, also when a
+        # frame is rejected; a live one would keep the bytearray from growing
+        with memoryview(buffer) as whole:
+            while len(buffer) - offset >= PRELUDE_LENGTH:
+                total_length, headers_length, prelude_crc = struct.unpack_from('>III', buffer, offset)
+                if zlib.crc32(whole[offset:offset + 8]) != prelude_crc:
+                    raise EventStreamError("Prelude checksum mismatch")
+                if headers_length > MAX_HEADERS_LENGTH:
+                    raise EventStreamError(f"Header block too large: {headers_length}")
+                if total_length > MAX_MESSAGE_LENGTH or \
+                        total_length < PRELUDE_LENGTH + headers_length + TRAILER_LENGTH:
+                    raise EventStreamError(f"Invalid message length: {total_length}")
+                if len(buffer) - offset < total_length:
+                    break
+
+                with whole[offset:offset + total_length] as view:
+                    message_crc = struct.unpack_from('>I', view, total_length - TRAILER_LENGTH)[0]
+                    if zlib.crc32(view[:total_length - TRAILER_LENGTH]) != message_crc:
+                        raise EventStreamError("Message checksum mismatch")
+                    headers_end = PRELUDE_LENGTH + headers_length
+                    with view[PRELUDE_LENGTH:headers_end] as header_block:
+                        headers = _decode_headers(header_block)
+                    payload = bytes(view[headers_end:total_length - TRAILER_LENGTH])
+                messages.append(EventStreamMessage(headers, payload))
+                offset += total_length
+
+        if offset:
+            del buffer[:offset]
+        return messages
+
+    def close(self):
+        # a clean end of stream must not leave a partial frame behind
+        if self._buffer:
+            raise EventStreamError(f"Stream ended with {len(self._buffer)} bytes of incomplete frame")
+
+
+def iter_messages(byte_chunks):
+    decoder = EventStreamDecoder()
+    for data in byte_chunks:
+        for message in decoder.feed(data):
+            yield message
+    decoder.close()
+
+
+def to_agent_event(message):
+    headers = message.headers
+    message_type = headers.get(':message-type', 'event')
+    if message_type == 'exception':
+        error_type = headers.get(':exception-type', 'UnknownException')
+        raise AgentStreamError(error_type, _error_message(message.payload))
+    if message_type == 'error':
+        raise AgentStreamError(headers.get(':error-code', 'UnknownError'),
+                               headers.get(':error-message', ''))
+
+    event_type = headers.get(':event-type')
+    payload = json.loads(message.payload) if message.payload else {}
+    text = None
+    if event_type == 'chunk' and 'bytes' in payload:
+        text = base64.b64decode(payload['bytes']).decode('utf-8')
+    return AgentEvent(event_type, payload, text)
+
+
+def iter_agent_events(byte_chunks):
+    for message in iter_messages(byte_chunks):
+        yield to_agent_event(message)
+
+
+def final_response_text(event):
+    # The orchestration trace carries the final answer too; used when the
+    # stream ends without a chunk event.
+    if event.event_type != 'trace':
+        return None
+    orchestration = event.payload.get('trace', {}).get('orchestrationTrace', {})
+    final_response = orchestration.get('observation', {}).get('finalResponse')
+    if final_response:
+        return final_response.get('text')
+    return None
+
+
+def _error_message(payload):
+    try:
+        return json.loads(payload).get('message', '')
+    except (ValueError, AttributeError):
+        return payload.decode('utf-8', errors='replace')
+
+
+def _encode_headers(headers):
+    encoded = bytearray()
+    for name, value in headers.items():
+        name_bytes = name.encode('utf-8')
+        value_bytes = value.encode('utf-8')
+        encoded += struct.pack('>B', len(name_bytes)) + name_bytes
+        encoded += struct.pack('>BH', 7, len(value_bytes)) + value_bytes
+    return bytes(encoded)
+
+
+def encode_message(headers, payload):
+    # string headers only; enough to produce service-shaped frames for
+    # tests and local stubs
+    header_bytes = _encode_headers(headers)
+    total_length = PRELUDE_LENGTH + len(header_bytes) + len(payload) + TRAILER_LENGTH
+    prelude = struct.pack('>II', total_length, len(header_bytes))
+    prelude += struct.pack('>I', zlib.crc32(prelude))
+    message = prelude + header_bytes + payload
+    return message + struct.pack('>I', zlib.crc32(message))
+
+
+def encode_agent_event(event_type, payload):
+    headers = {
+        ':event-type': event_type,
+        ':content-type': 'application/json',
+        ':message-type': 'event',
+    }
+    return encode_message(headers, json.dumps(payload).encode('utf-8'))
@@ -0,0 +1,365 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+
+import answer_cache
+import instrumentation
+
+# Local BM25 index over curated question/answer pairs, so that frequent
+# questions are answered in milliseconds without an agent turn.
+#
+# The index is built offline from JSONL pairs: either curated rows
+# {"question", "answer", "sources"} or the results file of batch_runner.py,
+# whose rows carry the agent's answer and the documents it cited. Index
+# answers are served to every user, so only batch rows that the answer cache
+# would share are used: the first turn of a session, answered from the
+# knowledge base with cited sources, without an action group (password
+# reset), returnControl or failure.
+#
+#   python faq_index.py build results.jsonl faq_index.json [--knowledge-base-id KB --data-source-id DS]
+#   python faq_index.py query faq_index.json "How do I access my grades?"
+#   python faq_index.py status faq_index.json [--knowledge-base-id KB --data-source-id DS]
+#
+# A question is answered from the index only when its best match clears
+# BR_AGENT_FAQ_MIN_CONFIDENCE. Confidence is the BM25 score relative to the
+# score of a perfect match, measured both ways (how much of the question the
+# entry covers and how much of the entry the question covers), so 1.0 means
+# the same content words and extra or missing words pull it down.
+#
+# Answers go stale when the knowledge base changes. The index records when
+# it was built and, given the knowledge base and data source ids, the
+# knowledge base's last ingestion. `status` reports entries whose cited S3
+# documents changed since the build and any newer ingestion, and exits 1
+# when the index is stale. The app refuses indexes older than
+# BR_AGENT_FAQ_MAX_AGE_DAYS.
+#
+#   BR_AGENT_FAQ_INDEX           index file to answer from (default: none, disabled)
+#   BR_AGENT_FAQ_MIN_CONFIDENCE  lowest confidence answered locally (default 0.9)
+#   BR_AGENT_FAQ_MAX_AGE_DAYS    days before the index is ignored (default 30, 0: never)
+
+FAQ_INDEX = os.environ.get("BR_AGENT_FAQ_INDEX")
+MIN_CONFIDENCE = float(os.environ.get("BR_AGENT_FAQ_MIN_CONFIDENCE", "0.9"))
+MAX_AGE_DAYS = float(os.environ.get("BR_AGENT_FAQ_MAX_AGE_DAYS", "30"))
+
+INDEX_VERSION = 1
+K1 = 1.2
+B = 0.75
+
+_token = re.compile(r"[a-z0-9]+")
+# words that say nothing about which document answers the question
+STOPWORDS = frozenset("""
+a an and are as at be by can could do does for from how i if in is it me my of on or our should so
+that the their there this to was we what when where which who why will with would you your
+""".split())
+
+FaqEntry = namedtuple('FaqEntry', ['question', 'answer', 'sources', 'harvested_at'])
+FaqMatch = namedtuple('FaqMatch', ['entry', 'confidence'])
+
+
+def tokenize(text):
+    return [token for token in _token.findall(text.lower()) if token not in STOPWORDS]
+
+
+class FaqIndex:
+
+    def __init__(self, entries, built_at=None, knowledge_base=None, min_confidence=MIN_CONFIDENCE):
+        self.entries = list(entries)
+        self.built_at = built_at if built_at is not None else time.time()
+        # {"knowledgeBaseId", "dataSourceId", "ingestedAt"} when known at build time
+        self.knowledge_base = knowledge_base
+        self.min_confidence = min_confidence
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        documents = [Counter(tokenize(entry.question)) for entry in self.entries]
+        self._lengths = [sum(terms.values()) for terms in documents]
+        self._average_length = (sum(self._lengths) / len(documents)) if documents else 1.0
+        self._postings = {}
+        for doc, terms in enumerate(documents):
+            for term, count in terms.items():
+                self._postings.setdefault(term, []).append((doc, count))
+        total = len(documents)
+        self._idf = {term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                     for term, postings in self._postings.items()}
+        # a word no entry contains counts as the rarest word there is
+        self._unseen_idf = math.log(1 + (total + 0.5) / 0.5)
+        self._self_scores = [self._perfect_score(terms) for terms in documents]
+
+    def _term_score(self, idf, count, length):
+        return idf * count * (K1 + 1) / (count + K1 * (1 - B + B * length / self._average_length))
+
+    def _perfect_score(self, terms):
+        # score of a document with exactly these words
+        length = sum(terms.values())
+        return sum(self._term_score(self._idf.get(term, self._unseen_idf), count, length)
+                   for term, count in terms.items())
+
+    def search(self, question, limit=3):
+        # best matches first, as FaqMatch(entry, confidence)
+        terms = Counter(tokenize(question))
+        if not terms:
+            return []
+        scores = {}
+        for term in terms:
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for doc, count in self._postings[term]:
+                scores[doc] = scores.get(doc, 0.0) + self._term_score(idf, count, self._lengths[doc])
+        query_score = self._perfect_score(terms)
+        matches = []
+        for doc, score in scores.items():
+            confidence = math.sqrt(min(1.0, score / query_score) * min(1.0, score / self._self_scores[doc]))
+            matches.append(FaqMatch(self.entries[doc], round(confidence, 4)))
+        matches.sort(key=lambda match: match.confidence, reverse=True)
+        return matches[:limit]
+
+    def lookup(self, question):
+        # the confident match for the question, or None to ask the agent
+        started = time.perf_counter()
+        matches = self.search(question, limit=1)
+        match = matches[0] if matches and matches[0].confidence >= self.min_confidence else None
+        instrumentation.registry.observe("faq_lookup", time.perf_counter() - started)
+        # confidence in tenths, so the distribution shows how close misses were
+        band = f"{math.floor(matches[0].confidence * 10) / 10:.1f}" if matches else "none"
+        instrumentation.registry.increment(
+            "faq_lookups", labels={"result": "hit" if match else "miss", "confidence": band})
+        with self._lock:
+            if match:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return match
+
+    def age_days(self, now=None):
+        return ((now if now is not None else time.time()) - self.built_at) / 86400
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "age_days": round(self.age_days(), 2),
+            }
+
+    def to_dict(self):
+        return {
+            "version": INDEX_VERSION,
+            "built_at": self.built_at,
+            "knowledge_base": self.knowledge_base,
+            "entries": [entry._asdict() for entry in self.entries],
+        }
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, min_confidence=MIN_CONFIDENCE):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"{path} is FAQ index version {data.get('version')}, expected {INDEX_VERSION}")
+        return cls([FaqEntry(**entry) for entry in data["entries"]], data["built_at"],
+                   data.get("knowledge_base"), min_confidence)
+
+
+# trace steps (agent_trace.parse_steps kinds) of turns that used or changed
+# the asker's session, for results written before rows had "cacheable"
+STATEFUL_STEPS = ("actionGroupInvocationInput", "actionGroupInvocationOutput", "failure")
+
+
+def is_shareable(row):
+    # curated rows (no status) are taken as they are
+    if "status" not in row:
+        return True
+    if row["status"] != "ok" or row.get("turn", 0) > 0 or not row.get("sources"):
+        return False
+    if "cacheable" in row:
+        return row["cacheable"]
+    return not any(step.get("kind") in STATEFUL_STEPS for step in row.get("steps") or [])
+
+
+def read_pairs(path):
+    # curated pairs or batch_runner results; empty answers and batch rows
+    # that are not safe to share (see is_shareable) are skipped
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if not row.get("question") or not row.get("answer") or not is_shareable(row):
+                continue
+            pairs.append(row)
+    return pairs
+
+
+def build(pairs, knowledge_base=None, built_at=None):
+    # one entry per normalized question; a later pair replaces an earlier one
+    built_at = built_at if built_at is not None else time.time()
+    entries = {}
+    for pair in pairs:
+        entries[answer_cache.normalize_question(pair["question"])] = FaqEntry(
+            pair["question"].strip(), pair["answer"], list(pair.get("sources") or []),
+            pair.get("harvested_at", built_at))
+    return FaqIndex(entries.values(), built_at, knowledge_base)
+
+
+def latest_ingestion(knowledge_base_id, data_source_id, client=None):
+    # when the data source last finished ingesting, as a timestamp, or None
+    if client is None:
+        import boto3
+        client = boto3.client('bedrock-agent')
+    response = client.list_ingestion_jobs(
+        knowledgeBaseId=knowledge_base_id, dataSourceId=data_source_id,
+        filters=[{"attribute": "STATUS", "operator": "EQ", "values": ["COMPLETE"]}],
+        sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"}, maxResults=1)
+    jobs = response.get("ingestionJobSummaries", [])
+    return jobs[0]["updatedAt"].timestamp() if jobs else None
+
+
+def changed_sources(index, s3_client=None):
+    # cited S3 documents modified (or deleted) since the index was built,
+    # as {uri: entry questions}
+    if s3_client is None:
+        import boto3
+        s3_client = boto3.client('s3')
+    by_uri = {}
+    for entry in index.entries:
+        for uri in entry.sources:
+            if uri.startswith("s3://"):
+                by_uri.setdefault(uri, []).append(entry.question)
+    changed = {}
+    for uri, questions in by_uri.items():
+        bucket, _, key = uri[len("s3://"):].partition("/")
+        try:
+            modified = s3_client.head_object(Bucket=bucket, Key=key)["LastModified"].timestamp()
+        except s3_client.exceptions.ClientError:
+            modified = None
+        if modified is None or modified > index.built_at:
+            changed[uri] = questions
+    return changed
+
+
+def staleness(index, knowledge_base_id=None, data_source_id=None, agent_client=None, s3_client=None):
+    report = {"built_at": index.built_at, "age_days": round(index.age_days(), 2), "stale": False}
+    if knowledge_base_id and data_source_id:
+        ingested_at = latest_ingestion(knowledge_base_id, data_source_id, agent_client)
+        recorded = (index.knowledge_base or {}).get("ingestedAt")
+        report["ingested_at"] = ingested_at
+        if ingested_at is not None and ingested_at > (recorded or index.built_at):
+            report["stale"] = True
+    changed = changed_sources(index, s3_client)
+    report["changed_sources"] = changed
+    report["stale_entries"] = len({q for questions in changed.values() for q in questions})
+    if changed:
+        report["stale"] = True
+    if MAX_AGE_DAYS and index.age_days() > MAX_AGE_DAYS:
+        report["stale"] = True
+    return report
+
+
+_index = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_index():
+    # the index named by BR_AGENT_FAQ_INDEX, or None when there is none or it
+    # is too old to trust
+    global _index, _index_loaded
+    if not _index_loaded:
+        with _index_lock:
+            if not _index_loaded:
+                _index = _load_configured()
+                _index_loaded = True
+    return _index
+
+
+def _load_configured():
+    if not FAQ_INDEX:
+        return None
+    try:
+        index = FaqIndex.load(FAQ_INDEX)
+    except (OSError, ValueError) as e:
+        print(f"FAQ index {FAQ_INDEX} not loaded: {e}")
+        return None
+    if MAX_AGE_DAYS and index.age_days() > MAX_AGE_DAYS:
+        print(f"FAQ index {FAQ_INDEX} is {index.age_days():.0f} days old, rebuild it; answering from the agent")
+        return None
+    print(f"FAQ index {FAQ_INDEX}: {len(index.entries)} entries, built {index.age_days():.1f} days ago")
+    return index
+
+
+def _format_time(timestamp):
+    if timestamp is None:
+        return "unknown"
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat(timespec="seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect the local FAQ index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="build an index from question/answer JSONL")
+    build_parser.add_argument("pairs", nargs="+", help="curated pairs or batch_runner results (JSONL)")
+    build_parser.add_argument("output")
+    query_parser = commands.add_parser("query", help="show the best matches for a question")
+    query_parser.add_argument("index")
+    query_parser.add_argument("question")
+    status_parser = commands.add_parser("status", help="report staleness; exits 1 when stale")
+    status_parser.add_argument("index")
+    for command in (build_parser, status_parser):
+        command.add_argument("--knowledge-base-id")
+        command.add_argument("--data-source-id")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        knowledge_base = None
+        if args.knowledge_base_id and args.data_source_id:
+            knowledge_base = {
+                "knowledgeBaseId": args.knowledge_base_id,
+                "dataSourceId": args.data_source_id,
+                "ingestedAt": latest_ingestion(args.knowledge_base_id, args.data_source_id),
+            }
+        pairs = [pair for path in args.pairs for pair in read_pairs(path)]
+        index = build(pairs, knowledge_base)
+        index.save(args.output)
+        print(f"Indexed {len(index.entries)} questions from {len(pairs)} pairs into {args.output}")
+    elif args.command == "query":
+        index = FaqIndex.load(args.index)
+        started = time.perf_counter()
+        matches = index.search(args.question)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for match in matches:
+            verdict = "answer" if match.confidence >= index.min_confidence else "ask agent"
+            print(f"{match.confidence:.3f} ({verdict}) {match.entry.question}")
+        print(f"{len(matches)} matches in {elapsed_ms:.2f} ms, threshold {index.min_confidence}")
+    else:
+        index = FaqIndex.load(args.index)
+        report = staleness(index, args.knowledge_base_id, args.data_source_id)
+        print(f"built:        {_format_time(report['built_at'])} ({report['age_days']} days ago)")
+        if "ingested_at" in report:
+            print(f"kb ingested:  {_format_time(report['ingested_at'])}")
+        print(f"stale entries: {report['stale_entries']} of {len(index.entries)}")
+        for uri, questions in report["changed_sources"].items():
+            print(f"  changed {uri}: {len(questions)} entries")
+        print("STALE, rebuild the index" if report["stale"] else "up to date")
+        sys.exit(1 if report["stale"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Timing and counters for the agent invoke path.
+#
+# Every agent turn gets a Turn (owned by its TraceCollector) that accumulates
+# the time spent signing, opening connections, waiting for the first byte,
+# streaming, decoding and rendering, plus byte counters. Code deep in the
+# request path (signing, connection setup) records into whichever turn is
+# active in the current context, so nothing has to be threaded through
+# sigv4_request. Finished turns update the process-wide registry and are
+# handed to the configured exporters.
+#
+#   BR_AGENT_METRICS       comma separated exporters: prometheus, jsonlog, otel
+#   BR_AGENT_METRICS_PORT  port of the Prometheus text endpoint (default 9464)
+#   BR_AGENT_METRICS_LOG   file for the JSON log exporter (default agent-metrics.jsonl)
+
+METRIC_PREFIX = "br_agent"
+# name of the turns that answer a user question; turns with any other name
+# (the Goodbye sent by end_session) are recorded under metrics of their own
+TURN = "agent_turn"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_turn = contextvars.ContextVar("br_agent_turn", default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, value=1, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{METRIC_PREFIX}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.total}")
+                lines.append(f"{metric}_count {histogram.count}")
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{METRIC_PREFIX}_{name}_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = Registry()
+
+
+class Turn:
+
+    def __init__(self, name=TURN):
+        self.name = name
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self.request_started = None
+        self.first_byte_at = None
+        self.ended = None
+        self.durations = {}
+        self.counters = {}
+        self.error = None
+
+    @contextlib.contextmanager
+    def active(self):
+        # make this the turn that record() writes to, for the enclosed block
+        if self.request_started is None:
+            self.request_started = time.perf_counter()
+        token = _current_turn.set(self)
+        try:
+            yield self
+        finally:
+            _current_turn.reset(token)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def first_byte(self):
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+            self.durations["ttfb"] = self.first_byte_at - (self.request_started or self.started)
+
+    def finish(self, error=None):
+        if self.ended is not None:
+            return
+        self.ended = time.perf_counter()
+        self.error = error
+        if self.first_byte_at is not None:
+            self.durations["stream"] = self.ended - self.first_byte_at
+        self.durations["turn"] = self.ended - self.started
+
+        prefix = "" if self.name == TURN else f"{self.name}_"
+        registry.increment(prefix + "turns")
+        if error is not None:
+            registry.increment(prefix + "errors", labels={"type": type(error).__name__})
+        for name, seconds in self.durations.items():
+            registry.observe(prefix + name, seconds)
+        for name, value in self.counters.items():
+            registry.increment(prefix + name, value)
+        for exporter in get_exporters():
+            try:
+                exporter.export_turn(self)
+            except Exception as e:
+                print(f"Metrics exporter {type(exporter).__name__} failed: {e}")
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "start_time": self.start_time,
+            "durations": {k: round(v, 6) for k, v in self.durations.items()},
+            "counters": dict(self.counters),
+            "error": None if self.error is None else f"{type(self.error).__name__}: {self.error}",
+        }
+
+
+def current_turn():
+    return _current_turn.get()
+
+
+def record(name, seconds):
+    # for code that does not know which turn it is working for
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.add(name, seconds)
+    else:
+        registry.observe(name, seconds)
+
+
+def count(name, value=1):
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.count(name, value)
+    else:
+        registry.increment(name, value)
+
+
+@contextlib.contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+# Exporters
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PrometheusExporter:
+    # serves the registry at http://<host>:<port>/metrics
+
+    def __init__(self, port=None, host="0.0.0.0"):
+        port = int(port or os.environ.get("BR_AGENT_METRICS_PORT", "9464"))
+        self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+
+    def export_turn(self, turn):
+        # the registry already holds everything the endpoint serves
+        pass
+
+
+class JsonLogExporter:
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("BR_AGENT_METRICS_LOG", "agent-metrics.jsonl")
+        self._lock = threading.Lock()
+
+    def export_turn(self, turn):
+        line = json.dumps(turn.as_dict())
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+
+class OpenTelemetryExporter:
+    # one span per turn with request/stream child spans; needs the
+    # opentelemetry-api package and an SDK configured by the host process
+
+    def __init__(self):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer("invoke_br_agent")
+
+    def export_turn(self, turn):
+        def ns(perf):
+            return int((turn.start_time + (perf - turn.started)) * 1e9)
+
+        attributes = {f"agent.{k}_seconds": v for k, v in turn.durations.items()}
+        attributes.update({f"agent.{k}": v for k, v in turn.counters.items()})
+        span = self._tracer.start_span(turn.name, start_time=ns(turn.started), attributes=attributes)
+        if turn.error is not None:
+            span.record_exception(turn.error)
+        request_started = turn.request_started or turn.started
+        first_byte_at = turn.first_byte_at or turn.ended
+        context = self._trace.set_span_in_context(span)
+        self._tracer.start_span("request", context=context, start_time=ns(request_started)).end(end_time=ns(first_byte_at))
+        if turn.first_byte_at is not None:
+            self._tracer.start_span("stream", context=context, start_time=ns(first_byte_at)).end(end_time=ns(turn.ended))
+        span.end(end_time=ns(turn.ended))
+
+
+EXPORTERS = {
+    "prometheus": PrometheusExporter,
+    "jsonlog": JsonLogExporter,
+    "otel": OpenTelemetryExporter,
+}
+
+_exporters = None
+_exporters_lock = threading.Lock()
+
+
+def get_exporters():
+    global _exporters
+    if _exporters is None:
+        with _exporters_lock:
+            if _exporters is None:
+                exporters = []
+                for name in os.environ.get("BR_AGENT_METRICS", "").split(","):
+                    name = name.strip()
+                    if not name:
+                        continue
+                    try:
+                        exporters.append(EXPORTERS[name]())
+                    except Exception as e:
+                        print(f"Could not start metrics exporter {name}: {e}")
+                _exporters = exporters
+    return _exporters
+
+
+def set_exporters(exporters):
+    global _exporters
+    with _exporters_lock:
+        _exporters = list(exporters)
@@ -1,13 +1,15 @@
-from boto3.session import Session
-from botocore.auth import SigV4Auth
-from botocore.awsrequest import AWSRequest
-from botocore.credentials import Credentials
+import agent_router
+import aws_auth
+import deadlines
 import json
 import os
-from requests import request
-import base64
-import io
-import sys
+import time
+import requests
+import eventstream
+import instrumentation
+import rate_limit
+import transport
+from trace_collector import TraceCollector
 
 #For this to run on a local machine in VScode, you need to set the AWS_PROFILE environment variable to the name of the profile/credentials you want to use. 
 #You also need to input your model ID near the bottom of this file.
@@ -23,6 +25,33 @@ os.environ["AWS_REGION"] = theRegion
 region = os.environ.get("AWS_REGION")
 llm_response = ""
 
+# Get this information from the console/CLI for the launched instances.
+agentId = "ZMHWKMTGK6" #INPUT YOUR AGENT ID HERE
+agentAliasId = "G0DBFFYXDH" # Hits draft alias, set to a specific alias id for a deployed version
+# BR_AGENT_ENDPOINT points the client somewhere else, e.g. the local stub in bench/
+endpoint = os.environ.get("BR_AGENT_ENDPOINT", f"https://bedrock-agent-runtime.{theRegion}.amazonaws.com")
+# BR_AGENT_TRANSPORT=boto3 sends questions through botocore's client instead
+# of the hand-signed requests below, see boto_transport
+TRANSPORT = os.environ.get("BR_AGENT_TRANSPORT", "http")
+# BR_AGENT_LOG_TURNS=false stops the handlers printing every question and URL
+LOG_TURNS = os.environ.get("BR_AGENT_LOG_TURNS", "true").lower() == "true"
+
+# Failures that mean the agent never started on the question, so asking it
+# again cannot run anything twice. Anything after the first event has been
+# read is never retried.
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+RETRYABLE_STREAM_ERRORS = ("throttlingException", "internalServerException",
+                           "serviceUnavailableException", "dependencyFailedException")
+
+
+class AgentRequestError(Exception):
+    # non-200 answer to InvokeAgent, before any event was streamed
+    def __init__(self, status_code, error_type, text):
+        super().__init__(f"Agent request failed ({status_code}): {text}")
+        self.status_code = status_code
+        self.error_type = error_type
+
+
 def sigv4_request(
     url,
     method='GET',
@@ -31,133 +60,299 @@ def sigv4_request(
     headers=None,
     service='execute-api',
     region=os.environ['AWS_REGION'],
-    credentials=Session().get_credentials().get_frozen_credentials()
+    credentials=None,
+    stream=False,
+    timeout=None
 ):    
+    # resolve per request so expiring temporary credentials get refreshed
+    if credentials is None:
+        credentials = aws_auth.get_credential_provider().get_credentials()
+
     # sign request
-    req = AWSRequest(
-        method=method,
-        url=url,
-        data=body,
-        params=params,
-        headers=headers
-    )
-    SigV4Auth(credentials, service, region).add_auth(req)
-    req = req.prepare()
+    with instrumentation.timed("sign"):
+        req = aws_auth.sign_request(url, method, body, params, headers, service, region, credentials)
 
-    # send request
-    return request(
+    # send request over the shared keep-alive connection pool
+    return transport.get_session().request(
         method=req.method,
         url=req.url,
         headers=req.headers,
-        data=req.body
+        data=req.body,
+        stream=stream,
+        timeout=timeout or transport.default_timeout()
     )
     
     
 
-def askQuestion(question, url, endSession=True):
+def question_body(question, endSession=True, streamFinalResponse=False):
     myobj = {
         "inputText": question,   
         "enableTrace": True,
         "endSession": endSession
     }
+    if streamFinalResponse:
+        # ask the agent to emit the final answer as it is generated
+        myobj["streamingConfigurations"] = {"streamFinalResponse": True}
+    return json.dumps(myobj)
+
+
+def send_question(question, url, endSession=True, streamFinalResponse=False, collector=None, timeout=None):
+    # signing and connection setup are timed into the collector's turn
+    turn = collector.turn if collector is not None else instrumentation.Turn()
+    with turn.active():
+        # send request
+        response = sigv4_request(
+            url,
+            method='POST',
+            service='bedrock',
+            headers={
+                'content-type': 'application/json', 
+                'accept': 'application/json',
+            },
+            region=region_for(url),
+            body=question_body(question, endSession, streamFinalResponse),
+            stream=True,
+            timeout=timeout
+        )
     
-    # send request
-    response = sigv4_request(
-        url,
-        method='POST',
-        service='bedrock',
-        headers={
-            'content-type': 'application/json', 
-            'accept': 'application/json',
-        },
-        region=theRegion,
-        body=json.dumps(myobj)
-    )
-    
-    return decode_response(response)
+    if response.status_code != 200:
+        with response:
+            error_type = response.headers.get("x-amzn-ErrorType", "").split(":")[0]
+            raise AgentRequestError(response.status_code, error_type, response.text)
+    return response
+
 
+def is_throttle(error):
+    if isinstance(error, AgentRequestError):
+        return error.status_code == 429 or error.error_type == "ThrottlingException"
+    return isinstance(error, eventstream.AgentStreamError) and error.error_type == "throttlingException"
 
 
+def retry_wait(error, attempt, turn):
+    # Called with a failure that happened before any event was read. Returns
+    # the backoff before the next attempt, or None to give up.
+    if attempt >= rate_limit.MAX_ATTEMPTS:
+        return None
+    if isinstance(error, AgentRequestError):
+        retryable = error.status_code in RETRYABLE_STATUS
+    elif isinstance(error, eventstream.AgentStreamError):
+        retryable = error.error_type in RETRYABLE_STREAM_ERRORS
+    else:
+        # connection could not be opened or was dropped before the response
+        retryable = isinstance(error, requests.ConnectionError)
+    if not retryable:
+        return None
+    if is_throttle(error):
+        rate_limit.get_limiter().on_throttle()
+        turn.count("throttled")
+    turn.count("retries")
+    return rate_limit.backoff_delay(attempt)
 
-def decode_response(response):
-    # Create a StringIO object to capture print statements
-    captured_output = io.StringIO()
-    sys.stdout = captured_output
 
-    # Your existing logic
-    string = ""
-    for line in response.iter_content():
+def iter_question_events(question, url, endSession=True, streamFinalResponse=False, collector=None, deadline=None):
+    # Asks the question and yields its events. Requests are paced by the
+    # process-wide rate limiter, and failures are retried with jittered
+    # backoff as long as no event has reached the caller yet and the turn's
+    # deadline leaves room for another attempt. When the deadline passes (or
+    # the turn is cancelled) the connection is shut down under the reader and
+    # DeadlineExceeded / TurnCancelled is raised.
+    turn = collector.turn
+    if deadline is None:
+        deadline = deadlines.Deadline()
+    send, read_events = transport_functions()
+    limiter = rate_limit.get_limiter()
+    attempt = 0
+    while True:
+        attempt += 1
+        wait = limiter.reserve()
+        if wait > 0:
+            if not deadline.allows(wait):
+                raise deadlines.DeadlineExceeded("total", deadline.total)
+            with turn.timer("rate_limit_wait"):
+                time.sleep(wait)
         try:
-            string += line.decode(encoding='utf-8')
-        except:
-            continue
-
-    print("Decoded response", string)
-    split_response = string.split(":message-type")
-    print(f"Split Response: {split_response}")
-    print(f"length of split: {len(split_response)}")
-
-    for idx in range(len(split_response)):
-        if "bytes" in split_response[idx]:
-            #print(f"Bytes found index {idx}")
-            encoded_last_response = split_response[idx].split("\"")[3]
-            decoded = base64.b64decode(encoded_last_response)
-            final_response = decoded.decode('utf-8')
-            print(final_response)
+            timeout = deadline.request_timeout(transport.CONNECT_TIMEOUT, transport.READ_TIMEOUT)
+            response = send(question, url, endSession, streamFinalResponse, collector, timeout)
+        except (deadlines.DeadlineExceeded, deadlines.TurnCancelled):
+            raise
+        except Exception as e:
+            deadline.check()
+            backoff = retry_wait(e, attempt, turn)
+            if backoff is None or not deadline.allows(backoff):
+                raise
         else:
-            print(f"no bytes at index {idx}")
-            print(split_response[idx])
-            
-    last_response = split_response[-1]
-    print(f"Lst Response: {last_response}")
-    if "bytes" in last_response:
-        print("Bytes in last response")
-        encoded_last_response = last_response.split("\"")[3]
-        decoded = base64.b64decode(encoded_last_response)
-        final_response = decoded.decode('utf-8')
-    else:
-        print("no bytes in last response")
-        part1 = string[string.find('finalResponse')+len('finalResponse":'):] 
-        part2 = part1[:part1.find('"}')+2]
-        final_response = json.loads(part2)['text']
+            with response:
+                remove = deadline.on_expire(lambda: transport.abort_response(response))
+                try:
+                    yield from read_events(response, collector, deadline)
+                    # a shut down socket can look like the end of the body
+                    deadline.check()
+                    limiter.on_success()
+                    return
+                except eventstream.AgentStreamError as e:
+                    deadline.check()
+                    backoff = None if collector.records else retry_wait(e, attempt, turn)
+                    if backoff is None or not deadline.allows(backoff):
+                        raise
+                except (deadlines.DeadlineExceeded, deadlines.TurnCancelled):
+                    raise
+                except Exception:
+                    # socket errors caused by the abort report the deadline
+                    deadline.check()
+                    raise
+                finally:
+                    remove()
+        with turn.timer("backoff"):
+            time.sleep(backoff)
+
+
+def transport_functions():
+    # (send_question, iter_response_events) of the configured transport
+    if TRANSPORT == "boto3":
+        import boto_transport
+        return boto_transport.send_question, boto_transport.iter_response_events
+    return send_question, iter_response_events
+
+
+def iter_response_events(response, collector, deadline=None):
+    # Decode the body frame by frame into the collector, timing the decode
+    # work separately from the time spent waiting on the socket.
+    turn = collector.turn
+    decoder = eventstream.EventStreamDecoder()
+    for data in response.iter_content(chunk_size=eventstream.READ_CHUNK_SIZE):
+        turn.first_byte()
+        if deadline is not None:
+            deadline.first_byte_received()
+        turn.count("bytes_received", len(data))
+        started = time.perf_counter()
+        messages = decoder.feed(data)
+        turn.add("decode", time.perf_counter() - started)
+        for message in messages:
+            started = time.perf_counter()
+            event = eventstream.to_agent_event(message)
+            turn.add("decode", time.perf_counter() - started)
+            if event.event_type == 'trace':
+                turn.count("trace_bytes", len(message.payload))
+            collector.add(event)
+            yield event
+    decoder.close()
 
+
+def askQuestion(question, url, endSession=True, collector=None, deadline=None):
+    if collector is None:
+        collector = TraceCollector()
+    try:
+        for event in iter_question_events(question, url, endSession, collector=collector, deadline=deadline):
+            pass
+    except Exception as e:
+        collector.turn.finish(e)
+        raise
+    collector.turn.finish()
+    return collector.text(), clean_response(collector.answer())
+
+
+def askQuestionStream(question, url, endSession=True, collector=None, deadline=None):
+    # Generator variant of askQuestion: yields answer text as each chunk frame
+    # arrives instead of returning once the whole stream has been read.
+    if collector is None:
+        collector = TraceCollector()
+    error = None
+    try:
+        streamed = False
+        for event in iter_question_events(question, url, endSession, True, collector, deadline):
+            if event.event_type == 'chunk':
+                streamed = True
+                yield clean_response(event.text)
+        if not streamed:
+            final_response = collector.answer()
+            if final_response:
+                yield clean_response(final_response)
+    except GeneratorExit:
+        # the consumer stopped reading (rerun, navigation)
+        collector.turn.count("cancelled")
+        raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        collector.turn.finish(error)
+
+
+def clean_response(final_response):
     final_response = final_response.replace("\"", "")
     final_response = final_response.replace("{input:{value:", "")
     final_response = final_response.replace(",source:null}}", "")
-    llm_response = final_response
+    return final_response
 
-    # Restore original stdout
-    sys.stdout = sys.__stdout__
 
-    # Get the string from captured output
-    captured_string = captured_output.getvalue()
+def decode_response(response, collector=None):
+    # Events go into a per-request collector; nothing here touches global
+    # state, so concurrent turns can decode side by side.
+    if collector is None:
+        collector = TraceCollector()
 
-    # Return both the captured output and the final response
-    return captured_string, llm_response
+    # Frames are decoded as they complete, reading the body in large chunks
+    for event in iter_response_events(response, collector):
+        pass
 
+    llm_response = clean_response(collector.answer())
 
-def lambda_handler(event):
-    
-    # Get this information from the console/CLI for the launched instances.
-    agentId = "ZMHWKMTGK6" #INPUT YOUR AGENT ID HERE
-    agentAliasId = "G0DBFFYXDH" # Hits draft alias, set to a specific alias id for a deployed version
+    # Return both the trace text and the final response
+    return collector.text(), llm_response
+
+
+def default_endpoint():
+    # the single endpoint above, used when BR_AGENT_ENDPOINTS is not set
+    return agent_router.AgentEndpoint(theRegion, theRegion, agentId, agentAliasId, endpoint)
+
+
+def get_router():
+    return agent_router.get_router(default_endpoint)
+
+
+def region_for(url):
+    # requests are signed for the region of the endpoint they go to
+    for target in get_router().endpoints:
+        if url.startswith(target.base_url + "/"):
+            return target.region
+    return theRegion
+
+
+def agent_url(sessionId):
+    # the endpoint the session is pinned to, or the best one for a new session
+    router = get_router()
+    target = router.pinned(sessionId) or router.route(sessionId)
+    return agent_router.session_url(target, sessionId)
+
+
+def parse_event(event):
     sessionId = event["sessionId"]
     question = event["question"]
     endSession = False
     
-    print(f"Session: {sessionId} asked question: {question}")
+    if LOG_TURNS:
+        print(f"Session: {sessionId} asked question: {question}")
     
     try:
         if (event["endSession"] == "true"):
             endSession = True
     except:
         endSession = False
-    
-    url = f'https://bedrock-agent-runtime.{theRegion}.amazonaws.com/agents/{agentId}/agentAliases/{agentAliasId}/sessions/{sessionId}/text'
+    return sessionId, question, endSession
 
-    print(url)
+
+def lambda_handler(event, collector=None):
+    sessionId, question, endSession = parse_event(event)
+    router = get_router()
+    target = router.route(sessionId)
+    url = agent_router.session_url(target, sessionId)
+    if collector is None:
+        collector = TraceCollector()
+
+    if LOG_TURNS:
+        print(url)
     try: 
-        response, trace_data = askQuestion(question, url, endSession)
+        response, trace_data = askQuestion(question, url, endSession, collector)
         return {
             "status_code": 200,
             "body": json.dumps({"response": response, "trace_data": trace_data})
@@ -167,5 +362,57 @@ def lambda_handler(event):
             "status_code": 500,
             "body": json.dumps({"error": str(e)})
         }
+    finally:
+        # every turn feeds the router's picture of the endpoint's health
+        router.record_turn(target, collector.turn)
+        if endSession:
+            router.forget(sessionId)
+
 
+def stream_handler(event, collector=None, deadline=None):
+    # Same event shape as lambda_handler; yields the answer chunk by chunk.
+    # Errors propagate to the caller, which is already rendering the stream.
+    # Pass a TraceCollector to keep the decoded trace events of the turn, and
+    # a deadlines.Deadline to bound or cancel it.
+    sessionId, question, endSession = parse_event(event)
+    router = get_router()
+    target = router.route(sessionId)
+    url = agent_router.session_url(target, sessionId)
+    if collector is None:
+        collector = TraceCollector()
 
+    if LOG_TURNS:
+        print(url)
+    try:
+        yield from askQuestionStream(question, url, endSession, collector, deadline)
+    finally:
+        router.record_turn(target, collector.turn)
+        if endSession:
+            router.forget(sessionId)
+
+
+def end_session(sessionId):
+    # InvokeAgent needs an input even when closing the session, so this is a
+    # real agent turn: the model answers "Goodbye" and it costs the tokens
+    # and latency of a short question. The reply is read and discarded so the
+    # connection goes back to the pool, and the turn is recorded as
+    # end_session, apart from the metrics of user turns.
+    router = get_router()
+    target = router.pinned(sessionId)
+    router.forget(sessionId)
+    if target is None:
+        # never asked anything, or the router already let go of it
+        return
+    send, read_events = transport_functions()
+    collector = TraceCollector(turn_name="end_session")
+    error = None
+    try:
+        with send("Goodbye", agent_router.session_url(target, sessionId), endSession=True,
+                  collector=collector) as response:
+            for _ in read_events(response, collector):
+                pass
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        collector.turn.finish(error)
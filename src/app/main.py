@@ -1,14 +1,60 @@
-import invoke_br_agent as agenthelper
+import agent_trace
+import answer_cache
+import chat_history
+import deadlines
+import faq_index
+import session_manager
+from trace_collector import TraceCollector
 import streamlit as st
 import datetime
 import json
-import pandas as pd
-from annotated_text import annotated_text
+import os
+import threading
+import uuid
+
+
+_agenthelper = None
+_agenthelper_lock = threading.Lock()
+
+
+def get_agenthelper():
+    # invoke_br_agent is imported on first use, so botocore, requests and
+    # credential resolution stay off the startup path until the first
+    # question. Streamlit runs each session in its own thread; the lock makes
+    # the first sessions wait for one complete import.
+    global _agenthelper
+    if _agenthelper is None:
+        with _agenthelper_lock:
+            if _agenthelper is None:
+                import invoke_br_agent
+                _agenthelper = invoke_br_agent
+    return _agenthelper
+
+# set BR_AGENT_EAGER_INIT=true to load the agent client and resolve
+# credentials when the app starts instead of on the first question
+eager_init = os.environ.get("BR_AGENT_EAGER_INIT", "false").lower() == "true"
+
+
+# set BR_AGENT_SHOW_LATENCY=true to show a per-turn latency breakdown
+show_latency = os.environ.get("BR_AGENT_SHOW_LATENCY", "false").lower() == "true"
+
+def show_earlier_messages():
+    st.session_state["history_pages"] = st.session_state.get("history_pages", 0) + 1
+
 
 def display_existing_messages():
     if "messages" not in st.session_state:
-        st.session_state["messages"] = []
-    for message in st.session_state["messages"]:
+        st.session_state["messages"] = chat_history.ChatHistory()
+    history = st.session_state["messages"]
+
+    # Only a bounded window is rendered per rerun; older pages on request
+    shown = chat_history.HISTORY_WINDOW + st.session_state.get("history_pages", 0) * chat_history.HISTORY_PAGE
+    hidden = history.hidden_count(shown)
+    if hidden:
+        st.button(f"Show earlier messages ({hidden} more)", on_click=show_earlier_messages)
+    elif history.dropped:
+        st.caption(f"{history.dropped} earlier messages are no longer kept in this conversation.")
+    for message in history.window(shown):
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
@@ -19,34 +65,131 @@ def add_user_message_to_session(prompt):
         with st.chat_message("user"):
             st.markdown(prompt)
 
-#@st.cache_data(ttl=3600, show_spinner=False) 
+@st.cache_resource
+def get_answer_cache():
+    # one cache for every browser session in this process
+    return answer_cache.AnswerCache()
+
+
+@st.cache_resource
+def get_faq_index():
+    # None unless BR_AGENT_FAQ_INDEX names a current index
+    return faq_index.get_index()
+
+
+@st.cache_resource
+def get_session_manager():
+    # one manager for every browser session in this process
+    return session_manager.SessionManager(end_session=get_agenthelper().end_session)
+
+
+def current_session_id():
+    if "browser_session_key" not in st.session_state:
+        st.session_state["browser_session_key"] = uuid.uuid4().hex
+    return get_session_manager().session_for(st.session_state["browser_session_key"])
+
+
 def generate_assistant_response(augmented_query):
     primer = f"""
 You are a virtual support assistant that is designed to answer user questions based on the information given above each question.It is crucial to cite sources accurately by using the [[number](URL)] notation after the reference. Say "I don't know" if the information is missing and be as detailed as possible. End each sentence with a period is to answer user questions based on the information given above each question.It is crucial to cite sources accurately by using the [[number](URL)] notation after the reference. Say "I don't know" if the information is missing and be as detailed as possible. End each sentence with a period. Please begin.
              """
         
+    session_id = current_session_id()
     event = {
-        "sessionId": "SESSION5",
+        "sessionId": session_id,
         "question": augmented_query,
         "endSession": "false"        
     }
-    response = agenthelper.lambda_handler(event)
-    message_placeholder = st.empty()
+    # Repeated knowledge base questions are served from the shared cache.
+    # Only the first agent turn of a session is looked up and stored: later
+    # answers can build on the conversation so far ("what about for graduate
+    # students?") or on session state (the password reset flow), so once the
+    # agent has answered, the rest of the session always goes to the agent.
+    agenthelper = get_agenthelper()
+    router = agenthelper.get_router()
+    cache = get_answer_cache()
+    stateful = st.session_state.get("stateful_session") == session_id
+    if not stateful:
+        # answers are kept per agent and alias, i.e. per routed endpoint
+        target = router.peek(session_id)
+        cached = cache.get(augmented_query, target.agent_id, target.alias_id)
+        if cached is not None:
+            with st.chat_message("assistant"):
+                st.markdown(cached)
+            return cached
+        # then curated answers to frequent questions, when one matches closely
+        faq = get_faq_index()
+        match = faq.lookup(augmented_query) if faq is not None else None
+        if match is not None:
+            print(f"FAQ answer ({match.confidence:.2f}): {match.entry.question}")
+            with st.chat_message("assistant"):
+                st.markdown(match.entry.answer)
+            return match.entry.answer
+
     full_response = ""
-    
-    
-    response_data = json.loads(response['body'])
-    print(response_data)
-    # Extract the response and trace data
-    all_data = format_response(response_data['response'])
-    the_response = response_data['trace_data']
-    
+    collector = TraceCollector()
+    deadline = deadlines.Deadline()
+    completed = False
 
-    #print(all_data)
+    # Render the answer into the placeholder as chunks arrive
     with st.chat_message("assistant"):
-        st.markdown(the_response)
+        message_placeholder = st.empty()
+        message_placeholder.markdown("Thinking...")
+        # Any click reruns the script, which interrupts the loop below at
+        # the next chunk; the stream is then closed along with its connection.
+        stop_placeholder = st.empty()
+        stop_placeholder.button("Stop", key="stop_turn")
+        stream = agenthelper.stream_handler(event, collector, deadline)
+        try:
+            for chunk in stream:
+                full_response += chunk
+                with collector.turn.timer("render"):
+                    message_placeholder.markdown(full_response + "▌")
+            completed = True
+        except deadlines.DeadlineExceeded as e:
+            print(f"Agent response timed out: {e}")
+            full_response += "\n\n*The answer took too long and was stopped. Please try again.*"
+        except Exception as e:
+            print(f"Error while streaming agent response: {e}")
+            if not full_response:
+                full_response = "Sorry, something went wrong while answering your question. Please try again."
+        except BaseException:
+            # rerun or stop: keep what was shown so far in the conversation
+            st.session_state["messages"].append(
+                {"role": "assistant", "content": (full_response + "\n\n*(stopped)*").strip()})
+            st.session_state["stateful_session"] = session_id
+            raise
+        finally:
+            stream.close()
+        stop_placeholder.empty()
+        message_placeholder.markdown(full_response)
+        if show_latency:
+            display_latency_breakdown(agent_trace.turn_latency(collector.records))
+
+    # the endpoint that answered; the session stays pinned to it
+    target = router.pinned(session_id)
+    if not stateful and completed and target is not None and answer_cache.is_cacheable(collector.records):
+        cache.put(augmented_query, target.agent_id, target.alias_id, full_response)
+    st.session_state["stateful_session"] = session_id
     
-    return the_response
+    return full_response
+
+
+def display_latency_breakdown(latency):
+    with st.expander(f"Latency breakdown ({latency.total:.2f} s)"):
+        by_category = latency.by_category
+        first_chunk = f"{latency.first_chunk:.2f} s" if latency.first_chunk is not None else "n/a"
+        st.markdown(
+            f"Retrieval **{by_category['retrieval']:.2f} s** · "
+            f"Model **{by_category['model']:.2f} s** · "
+            f"Action group **{by_category['action_group']:.2f} s** · "
+            f"Other **{by_category['other']:.2f} s** · "
+            f"First chunk **{first_chunk}** · "
+            f"Tokens **{latency.input_tokens} in / {latency.output_tokens} out**"
+        )
+        rows = agent_trace.waterfall_rows(latency)
+        if rows:
+            st.table(rows)
 
 # Function to parse and format response
 def format_response(response_body):
@@ -55,6 +198,8 @@ def format_response(response_body):
         data = json.loads(response_body)
         # If it's a list, convert it to a DataFrame for better visualization
         if isinstance(data, list):
+            # pandas is slow to import and rarely needed, so load it here
+            import pandas as pd
             return pd.DataFrame(data)
         else:
             return response_body
@@ -74,12 +219,26 @@ def hide_streamlit_header_footer():
     st.markdown(hide_st_style, unsafe_allow_html=True)
 
 
+@st.cache_resource
+def warm_up():
+    # once per process: import the client, resolve credentials and open the
+    # connection pool ahead of the first question
+    try:
+        agenthelper = get_agenthelper()
+        agenthelper.aws_auth.get_credential_provider().get_credentials()
+        agenthelper.transport.get_session()
+    except Exception as e:
+        print(f"Warm-up failed, continuing lazily: {e}")
+    return True
+
+
 def main():
     st.set_page_config(
         page_title="Virtual Support Assistant",
         page_icon="👋",
         layout="centered")
     st.title("Virtual Support Assistant")
+    from annotated_text import annotated_text
     annotated_text(("", "powered by Amazon Bedrock"))
     
     hide_streamlit_header_footer()
@@ -87,12 +246,17 @@ def main():
 
     query = st.chat_input("Please enter your query?")
     if query:
+        # a new turn collapses any earlier pages the user expanded
+        st.session_state["history_pages"] = 0
         add_user_message_to_session(query)        
-        with st.spinner("Thinking..."):                      
-            response = generate_assistant_response(query)
-            st.session_state["messages"].append(
-                {"role": "assistant", "content": response}
-    )
+        response = generate_assistant_response(query)
+        st.session_state["messages"].append(
+            {"role": "assistant", "content": response}
+        )
+
+    # after the page is drawn, so warming up never delays the first render
+    if eager_init:
+        warm_up()
     
 
 
@@ -0,0 +1,118 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# Client-side pacing and retry timing for agent requests, shared by every
+# thread and session in the process.
+#
+# The limiter starts out unlimited (or at BR_AGENT_MAX_RPS). The first
+# throttling response turns on a token bucket at a fraction of the rate we
+# were sending at; every further throttle cuts the rate again, and each
+# successful request raises it a little, so a busy process settles just under
+# what the service accepts instead of bursting into 429s. Callers reserve a
+# slot and sleep for the returned delay, which works from threads and from
+# the event loop alike.
+#
+#   BR_AGENT_MAX_RPS       ceiling on requests per second (default 0, none)
+#   BR_AGENT_MIN_RPS       floor the adaptive rate never drops below (default 0.5)
+#   BR_AGENT_MAX_ATTEMPTS  attempts per question, first one included (default 4)
+#   BR_AGENT_RETRY_BASE    first backoff step in seconds (default 0.2)
+#   BR_AGENT_RETRY_CAP     longest backoff in seconds (default 10)
+
+MAX_RPS = float(os.environ.get("BR_AGENT_MAX_RPS", "0"))
+MIN_RPS = float(os.environ.get("BR_AGENT_MIN_RPS", "0.5"))
+MAX_ATTEMPTS = int(os.environ.get("BR_AGENT_MAX_ATTEMPTS", "4"))
+RETRY_BASE = float(os.environ.get("BR_AGENT_RETRY_BASE", "0.2"))
+RETRY_CAP = float(os.environ.get("BR_AGENT_RETRY_CAP", "10"))
+
+# multiplicative decrease on throttling
+THROTTLE_FACTOR = 0.7
+# window used to measure the send rate before the first throttle
+MEASURE_WINDOW = 2.0
+# throttles arriving together count once: requests already in flight were
+# sent at the old rate
+THROTTLE_COOLDOWN = 1.0
+
+
+class AdaptiveRateLimiter:
+
+    def __init__(self, max_rate=MAX_RPS, min_rate=MIN_RPS, clock=time.monotonic):
+        self.max_rate = max_rate or None
+        self.min_rate = min_rate
+        self._clock = clock
+        self._lock = threading.Lock()
+        # None means no bucket: requests go out unpaced
+        self.rate = self.max_rate
+        self._tokens = 1.0
+        self._updated = clock()
+        self._sent = deque()
+        self._last_throttle = None
+
+    def reserve(self):
+        # takes a slot and returns the seconds to wait before sending
+        with self._lock:
+            now = self._clock()
+            if self.rate is None:
+                # remember recent sends so the first throttle knows our rate
+                self._sent.append(now)
+                while self._sent and self._sent[0] < now - MEASURE_WINDOW:
+                    self._sent.popleft()
+                return 0.0
+            self._refill(now)
+            # tokens may go negative: later callers queue behind earlier ones
+            self._tokens -= 1.0
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def _refill(self, now):
+        # burst capacity is one second worth of requests
+        capacity = max(1.0, self.rate)
+        self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def on_throttle(self):
+        with self._lock:
+            now = self._clock()
+            if self._last_throttle is not None and now - self._last_throttle < THROTTLE_COOLDOWN:
+                return
+            self._last_throttle = now
+            if self.rate is None:
+                measured = len(self._sent) / MEASURE_WINDOW
+                rate = max(measured, self.min_rate) * THROTTLE_FACTOR
+                self._sent.clear()
+                self._tokens = 0.0
+            else:
+                self._refill(now)
+                rate = self.rate * THROTTLE_FACTOR
+            self._updated = now
+            self.rate = max(self.min_rate, rate)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate is None:
+                return
+            self._refill(self._clock())
+            # additive increase: about +1 request/s per second at full rate
+            rate = self.rate + 1.0 / self.rate
+            if self.max_rate is not None:
+                rate = min(rate, self.max_rate)
+            self.rate = rate
+
+
+def backoff_delay(attempt, base=RETRY_BASE, cap=RETRY_CAP, rng=random.random):
+    # full jitter: uniform in [0, min(cap, base * 2^(attempt-1))]
+    return rng() * min(cap, base * (2 ** (attempt - 1)))
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = AdaptiveRateLimiter()
+    return _limiter
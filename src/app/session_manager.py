@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Maps each browser session to its own agent session id.
+#
+# Sessions expire after the agent's idleSessionTTLInSeconds (1800 s in
+# create_agent), at which point the service has already dropped them and we
+# simply forget the id. When the number of live sessions exceeds the cap, the
+# least recently used one is evicted and an endSession request is sent for
+# it in the background so the agent can release it early.
+#
+#   BR_AGENT_SESSION_TTL    idle seconds before a session expires (default 1800)
+#   BR_AGENT_MAX_SESSIONS   max live sessions per process (default 1000)
+
+SESSION_TTL = float(os.environ.get("BR_AGENT_SESSION_TTL", "1800"))
+MAX_SESSIONS = int(os.environ.get("BR_AGENT_MAX_SESSIONS", "1000"))
+
+
+class SessionManager:
+
+    def __init__(self, end_session=None, idle_ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, clock=time.time):
+        self._end_session = end_session
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self._clock = clock
+        # browser key -> (agent session id, last used), least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="end-session")
+
+    def session_for(self, browser_key):
+        now = self._clock()
+        evicted = []
+        with self._lock:
+            self._purge_expired(now)
+            entry = self._sessions.get(browser_key)
+            session_id = entry[0] if entry else uuid.uuid4().hex
+            self._sessions[browser_key] = (session_id, now)
+            self._sessions.move_to_end(browser_key)
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1][0])
+        for evicted_id in evicted:
+            self._schedule_end(evicted_id)
+        return session_id
+
+    def end(self, browser_key):
+        # explicit end, e.g. the user starts a new conversation
+        with self._lock:
+            entry = self._sessions.pop(browser_key, None)
+        if entry:
+            self._schedule_end(entry[0])
+
+    def live_sessions(self):
+        with self._lock:
+            self._purge_expired(self._clock())
+            return len(self._sessions)
+
+    def _purge_expired(self, now):
+        # ordered by last use, so expired sessions are all at the front;
+        # the agent has already timed them out, nothing to send
+        while self._sessions:
+            key, (session_id, last_used) = next(iter(self._sessions.items()))
+            if now - last_used < self.idle_ttl:
+                break
+            del self._sessions[key]
+
+    def _schedule_end(self, session_id):
+        if self._end_session is not None:
+            self._executor.submit(self._end_quietly, session_id)
+
+    def _end_quietly(self, session_id):
+        try:
+            self._end_session(session_id)
+        except Exception as e:
+            print(f"Failed to end agent session {session_id}: {e}")
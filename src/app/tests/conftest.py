@@ -0,0 +1,5 @@
+import os
+import sys
+
+# app modules import each other by plain module name, as under `streamlit run`
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,119 @@
+import json
+import unittest
+
+import agent_router
+import deadlines
+import instrumentation
+
+
+def endpoint(name):
+  return agent_router.AgentEndpoint(name, name, 'AGENT', 'ALIAS', f'https://{name}.example')
+
+
+class TestAgentRouter(unittest.TestCase):
+
+  def setUp(self):
+    self.now = 1000.0
+    self.east, self.west = endpoint('us-east-1'), endpoint('us-west-2')
+    self.router = agent_router.AgentRouter([self.east, self.west], clock=lambda: self.now)
+    # both measured: east answers in 2 s, west in 1 s
+    self.router.record(self.east, True, 2.0)
+    self.router.record(self.west, True, 1.0)
+
+  def test_new_sessions_go_to_the_fastest_endpoint(self):
+    self.assertEqual(self.router.route('s1'), self.west)
+
+  def test_sessions_stay_pinned_when_another_endpoint_gets_faster(self):
+    self.router.route('s1')
+    for _ in range(20):
+      self.router.record(self.east, True, 0.1)
+    self.assertEqual(self.router.route('s1'), self.west)
+    self.assertEqual(self.router.route('s2'), self.east)
+
+  def test_errors_push_traffic_away(self):
+    for _ in range(2):
+      self.router.record(self.west, False)
+    # 2 of 3 west turns failed: score 1.0 * (1 + 4 * 2/3) > 2.0
+    self.assertEqual(self.router.route('s1'), self.east)
+
+  def test_failing_endpoint_is_taken_out_and_pinned_sessions_fail_over(self):
+    failovers = dict(instrumentation.registry.counters)
+    self.assertEqual(self.router.route('s1'), self.west)
+    for _ in range(agent_router.FAILURE_THRESHOLD):
+      self.router.record(self.west, False)
+    self.assertEqual(self.router.route('s1'), self.east)
+    self.assertEqual(self.router.pinned('s1'), self.east)
+    key = ('failovers', (('from', 'us-west-2'), ('to', 'us-east-1')))
+    self.assertEqual(instrumentation.registry.counters[key], failovers.get(key, 0) + 1)
+
+  def test_one_probe_after_cooldown_then_back_in_rotation(self):
+    for _ in range(agent_router.FAILURE_THRESHOLD):
+      self.router.record(self.west, False)
+    self.now += agent_router.COOLDOWN
+    self.router.record(self.east, True, 2.0)
+    self.assertEqual(self.router.route('probe'), self.west)
+    self.assertEqual(self.router.route('other'), self.east)
+    self.router.record(self.west, True, 1.0)
+    self.assertTrue(self.router.snapshot()[1]["available"])
+    # preferred again once its recent failures are outweighed
+    for _ in range(20):
+      self.router.record(self.west, True, 1.0)
+    self.assertEqual(self.router.route('s3'), self.west)
+
+  def test_failed_probe_reopens_the_circuit(self):
+    for _ in range(agent_router.FAILURE_THRESHOLD):
+      self.router.record(self.west, False)
+    self.now += agent_router.COOLDOWN
+    self.router.route('probe')
+    self.router.record(self.west, False)
+    self.assertEqual(self.router.route('s1'), self.east)
+
+  def test_everything_down_still_routes(self):
+    for target in (self.east, self.west):
+      for _ in range(agent_router.FAILURE_THRESHOLD):
+        self.router.record(target, False)
+    self.assertIn(self.router.route('s1'), (self.east, self.west))
+
+  def test_stale_endpoint_gets_one_session_to_remeasure(self):
+    self.now += agent_router.STALE_AFTER + 1
+    self.router.record(self.west, True, 1.0)
+    self.assertEqual(self.router.route('explore'), self.east)
+    self.assertEqual(self.router.route('s2'), self.west)
+
+  def test_user_cancellation_and_bad_requests_do_not_count(self):
+    turn = instrumentation.Turn()
+    turn.error = deadlines.TurnCancelled()
+    for _ in range(agent_router.FAILURE_THRESHOLD):
+      self.router.record_turn(self.west, turn)
+    self.assertEqual(self.router.route('s1'), self.west)
+
+  def test_forget_releases_the_pin(self):
+    self.router.route('s1')
+    self.router.forget('s1')
+    self.assertIsNone(self.router.pinned('s1'))
+
+  def test_peek_picks_like_route_without_pinning(self):
+    self.assertEqual(self.router.peek('s1'), self.west)
+    self.assertIsNone(self.router.pinned('s1'))
+    self.router.route('s1')
+    for _ in range(20):
+      self.router.record(self.east, True, 0.1)
+    self.assertEqual(self.router.peek('s1'), self.west)
+    self.assertEqual(self.router.peek('s2'), self.east)
+
+  def test_load_endpoints(self):
+    endpoints = agent_router.load_endpoints(json.dumps([
+      {"region": "us-east-1", "agentId": "A", "agentAliasId": "B"},
+      {"name": "stub", "region": "us-west-2", "agentId": "C", "agentAliasId": "D", "endpoint": "http://127.0.0.1:8900"},
+    ]))
+    self.assertEqual(endpoints[0].base_url, "https://bedrock-agent-runtime.us-east-1.amazonaws.com")
+    self.assertEqual(endpoints[1].name, "stub")
+    self.assertEqual(agent_router.session_url(endpoints[1], "s1"),
+                     "http://127.0.0.1:8900/agents/C/agentAliases/D/sessions/s1/text")
+    with self.assertRaises(ValueError):
+      agent_router.load_endpoints('[{"region": "a", "agentId": "A", "agentAliasId": "B"},'
+                                  ' {"region": "a", "agentId": "C", "agentAliasId": "D"}]')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+import agent_trace
+from trace_collector import TraceRecord
+
+
+def trace(elapsed, phase, body):
+  return TraceRecord(elapsed, 'trace', {'trace': {phase: body}}, None)
+
+
+def usage(input_tokens, output_tokens):
+  return {'metadata': {'usage': {'inputTokens': input_tokens, 'outputTokens': output_tokens}}}
+
+
+RECORDS = [
+  trace(0.5, 'preProcessingTrace', {'modelInvocationInput': {'traceId': 't-0', 'type': 'PRE_PROCESSING'}}),
+  trace(1.0, 'preProcessingTrace', {'modelInvocationOutput': dict(traceId='t-0', **usage(100, 10))}),
+  trace(1.1, 'orchestrationTrace', {'modelInvocationInput': {'traceId': 't-1', 'type': 'ORCHESTRATION'}}),
+  trace(2.0, 'orchestrationTrace', {'modelInvocationOutput': dict(traceId='t-1', **usage(500, 50))}),
+  trace(2.1, 'orchestrationTrace', {'invocationInput': {
+    'traceId': 't-1', 'invocationType': 'KNOWLEDGE_BASE',
+    'knowledgeBaseLookupInput': {'knowledgeBaseId': 'KB1', 'text': 'grades'}}}),
+  trace(2.9, 'orchestrationTrace', {'observation': {
+    'traceId': 't-1', 'type': 'KNOWLEDGE_BASE', 'knowledgeBaseLookupOutput': {'retrievedReferences': [{}, {}]}}}),
+  trace(3.0, 'orchestrationTrace', {'invocationInput': {
+    'traceId': 't-2', 'invocationType': 'ACTION_GROUP',
+    'actionGroupInvocationInput': {'actionGroupName': 'PasswordResetActionGroup', 'apiPath': '/reset', 'verb': 'post'}}}),
+  trace(3.4, 'orchestrationTrace', {'observation': {
+    'traceId': 't-2', 'type': 'ACTION_GROUP', 'actionGroupInvocationOutput': {'text': 'ok'}}}),
+  TraceRecord(4.0, 'chunk', {}, 'done'),
+]
+
+
+class TestTurnLatency(unittest.TestCase):
+
+  def test_parse_steps(self):
+    kinds = [step.kind for step in agent_trace.parse_steps(RECORDS)]
+    self.assertEqual(kinds, [
+      'modelInvocationInput', 'modelInvocationOutput', 'modelInvocationInput', 'modelInvocationOutput',
+      'knowledgeBaseLookupInput', 'knowledgeBaseLookupOutput',
+      'actionGroupInvocationInput', 'actionGroupInvocationOutput'])
+
+  def test_waterfall(self):
+    latency = agent_trace.turn_latency(RECORDS)
+    self.assertEqual([span.name for span in latency.spans], [
+      'preProcessing model', 'orchestration model', 'knowledge base lookup',
+      'action group PasswordResetActionGroup POST /reset'])
+    self.assertAlmostEqual(latency.by_category['model'], 1.4)
+    self.assertAlmostEqual(latency.by_category['retrieval'], 0.8)
+    self.assertAlmostEqual(latency.by_category['action_group'], 0.4)
+    self.assertAlmostEqual(latency.total, 4.0)
+    self.assertEqual(latency.first_chunk, 4.0)
+    self.assertEqual((latency.input_tokens, latency.output_tokens), (600, 60))
+
+  def test_service_reported_duration_wins(self):
+    records = [trace(5.0, 'orchestrationTrace', {'observation': {
+      'knowledgeBaseLookupOutput': {'retrievedReferences': [], 'metadata': {'totalTimeMs': 1500}}}})]
+    span = agent_trace.turn_latency(records).spans[0]
+    self.assertAlmostEqual(span.end - span.start, 1.5)
+
+  def test_cited_sources_prefer_citations_over_retrieved_documents(self):
+    def reference(uri):
+      return {'location': {'type': 'S3', 's3Location': {'uri': uri}}}
+    lookup = trace(1.0, 'orchestrationTrace', {'observation': {'knowledgeBaseLookupOutput': {
+      'retrievedReferences': [reference('s3://kb/a.pdf'), reference('s3://kb/b.pdf')]}}})
+    chunk = TraceRecord(2.0, 'chunk', {'attribution': {'citations': [
+      {'retrievedReferences': [reference('s3://kb/b.pdf')]},
+      {'retrievedReferences': [reference('s3://kb/b.pdf')]}]}}, 'answer')
+    self.assertEqual(agent_trace.cited_sources([lookup, chunk]), ['s3://kb/b.pdf'])
+    self.assertEqual(agent_trace.cited_sources([lookup]), ['s3://kb/a.pdf', 's3://kb/b.pdf'])
+
+
+if __name__ == '__main__':
+  unittest.main()
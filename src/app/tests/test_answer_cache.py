@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+import answer_cache
+from trace_collector import TraceRecord
+
+
+def observation(body):
+  return TraceRecord(0.0, 'trace', {'trace': {'orchestrationTrace': {'observation': body}}}, None)
+
+
+class TestAnswerCache(unittest.TestCase):
+
+  def setUp(self):
+    self.now = 1000.0
+    self.clock = lambda: self.now
+
+  def test_normalized_hit_and_ttl(self):
+    cache = answer_cache.AnswerCache(max_entries=10, ttl=60, clock=self.clock)
+    cache.put('How do I access my grades?', 'A', 'B', 'From the portal.')
+    self.assertEqual(cache.get('  how do I   access my grades ', 'A', 'B'), 'From the portal.')
+    self.assertIsNone(cache.get('how do I access my grades', 'A', 'OTHER'))
+    self.now += 61
+    self.assertIsNone(cache.get('how do I access my grades', 'A', 'B'))
+
+  def test_lru_eviction(self):
+    cache = answer_cache.AnswerCache(max_entries=2, ttl=60, clock=self.clock)
+    cache.put('q1', 'A', 'B', 'a1')
+    cache.put('q2', 'A', 'B', 'a2')
+    cache.get('q1', 'A', 'B')
+    cache.put('q3', 'A', 'B', 'a3')
+    self.assertIsNone(cache.get('q2', 'A', 'B'))
+    self.assertEqual(cache.get('q1', 'A', 'B'), 'a1')
+
+  def test_sqlite_tier_survives_restart(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'answers.db')
+      answer_cache.AnswerCache(ttl=60, sqlite_path=path, clock=self.clock).put('q', 'A', 'B', 'a')
+      self.assertEqual(answer_cache.AnswerCache(ttl=60, sqlite_path=path, clock=self.clock).get('q', 'A', 'B'), 'a')
+
+  def test_is_cacheable(self):
+    kb = observation({'knowledgeBaseLookupOutput': {'retrievedReferences': []}})
+    action = observation({'actionGroupInvocationOutput': {'text': 'Temp password is x'}})
+    self.assertTrue(answer_cache.is_cacheable([kb]))
+    self.assertFalse(answer_cache.is_cacheable([kb, action]))
+    self.assertFalse(answer_cache.is_cacheable([TraceRecord(0.0, 'returnControl', {}, None)]))
+    self.assertFalse(answer_cache.is_cacheable([]))
+
+  def test_only_action_groups_and_failures_are_stateful(self):
+    kb = observation({'knowledgeBaseLookupOutput': {'retrievedReferences': []}})
+    action = observation({'actionGroupInvocationOutput': {'text': 'Temp password is x'}})
+    failure = TraceRecord(0.0, 'trace', {'trace': {'failureTrace': {'failureReason': 'x'}}}, None)
+    # small talk is not cached, but must not turn the cache off for the session
+    self.assertFalse(answer_cache.is_stateful([]))
+    self.assertFalse(answer_cache.is_stateful([kb]))
+    self.assertTrue(answer_cache.is_stateful([kb, action]))
+    self.assertTrue(answer_cache.is_stateful([failure]))
+    self.assertTrue(answer_cache.is_stateful([TraceRecord(0.0, 'returnControl', {}, None)]))
+
+  def test_sqlite_tier_is_bounded_and_purged_on_write(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'answers.db')
+      cache = answer_cache.AnswerCache(ttl=60, sqlite_path=path, clock=self.clock)
+      cache._disk.max_rows = 3
+      cache.put('old', 'A', 'B', 'a')
+      self.now += 61
+      for i in range(5):
+        self.now += 1
+        cache.put(f'q{i}', 'A', 'B', f'a{i}')
+      keys = [row[0] for row in cache._disk._connection().execute("SELECT key FROM answers ORDER BY expires")]
+      self.assertEqual(keys, ['A/B/q2', 'A/B/q3', 'A/B/q4'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import unittest
+import uuid
+from unittest import mock
+
+import agent_router
+import api_server
+import async_agent
+import invoke_br_agent
+
+
+def endpoint(name):
+  return agent_router.AgentEndpoint(name, name, 'AGENT', 'ALIAS', f'https://{name}.example')
+
+
+async def call(app, method, path, body):
+  # one HTTP request through the ASGI app; returns (status, headers, body)
+  scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+           "method": method, "path": path, "raw_path": path.encode(), "query_string": b"",
+           "headers": [(b"content-type", b"application/json")], "scheme": "http",
+           "server": ("test", 80), "client": ("test", 1234), "root_path": "", "app": app}
+  request = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+  messages = []
+
+  async def receive():
+    if request:
+      return request.pop()
+    await asyncio.Event().wait()
+
+  async def send(message):
+    messages.append(message)
+
+  await app(scope, receive, send)
+  start = messages[0]
+  headers = {k.decode(): v.decode() for k, v in start["headers"]}
+  return start["status"], headers, b"".join(m.get("body", b"") for m in messages[1:]).decode()
+
+
+def parse_sse(text):
+  events = []
+  for block in text.strip().split("\n\n"):
+    name, data = block.split("\n")
+    events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+  return events
+
+
+class TestApiServer(unittest.TestCase):
+
+  def setUp(self):
+    self.app = api_server.create_app()
+    self.app.state.slots = api_server.TurnSlots(max_turns=1, max_queued=0, queue_timeout=0.05)
+    self.router = agent_router.AgentRouter([endpoint('us-east-1'), endpoint('us-west-2')])
+    self.release = None
+    patches = [
+      mock.patch.object(invoke_br_agent, 'get_router', return_value=self.router),
+      mock.patch.object(async_agent, 'event_handler_async', self.fake_events),
+    ]
+    for patch in patches:
+      patch.start()
+      self.addCleanup(patch.stop)
+
+  async def fake_events(self, event, collector, deadline):
+    self.router.route(event["sessionId"])
+    if self.release is not None:
+      await self.release.wait()
+    yield 'trace', {'trace': {}}
+    if event["question"] == "fail":
+      raise invoke_br_agent.AgentRequestError(500, "internalServerException", "boom")
+    yield 'chunk', 'Hello '
+    yield 'chunk', 'there'
+
+  def run_async(self, coroutine):
+    return asyncio.run(coroutine)
+
+  def test_streams_session_chunks_and_done(self):
+    session_id = api_server.issue_session_id()
+    status, headers, body = self.run_async(
+      call(self.app, "POST", "/v1/chat", {"question": "hi", "sessionId": session_id, "endpoint": "us-west-2"}))
+    self.assertEqual(status, 200)
+    self.assertTrue(headers["content-type"].startswith("text/event-stream"))
+    events = parse_sse(body)
+    self.assertEqual(events[0], ("session", {"sessionId": session_id, "endpoint": "us-west-2"}))
+    self.assertEqual([data["text"] for name, data in events if name == "chunk"], ["Hello ", "there"])
+    self.assertEqual(events[-1][0], "done")
+    self.assertNotIn("trace", [name for name, _ in events])
+    self.assertEqual(self.app.state.slots.running, 0)
+
+  def test_errors_after_the_stream_starts_are_sent_in_band(self):
+    status, _, body = self.run_async(
+      call(self.app, "POST", "/v1/chat", {"question": "fail", "traces": True}))
+    self.assertEqual(status, 200)
+    names = [name for name, _ in parse_sse(body)]
+    self.assertEqual(names, ["session", "trace", "error"])
+
+  def test_non_streaming_returns_the_whole_answer(self):
+    status, _, body = self.run_async(
+      call(self.app, "POST", "/v1/chat", {"question": "hi", "stream": False}))
+    self.assertEqual(status, 200)
+    self.assertEqual(json.loads(body)["answer"], "Hello there")
+
+  def test_invalid_requests_are_rejected(self):
+    status, _, _ = self.run_async(call(self.app, "POST", "/v1/chat", {"sessionId": api_server.issue_session_id()}))
+    self.assertEqual(status, 400)
+    status, _, _ = self.run_async(call(self.app, "POST", "/v1/chat", {"question": "hi", "sessionId": "a/b"}))
+    self.assertEqual(status, 400)
+
+  def test_only_issued_sessions_can_be_continued_or_pinned(self):
+    status, _, body = self.run_async(
+      call(self.app, "POST", "/v1/chat", {"question": "hi", "endpoint": "us-west-2", "stream": False}))
+    self.assertEqual(status, 200)
+    session_id = json.loads(body)["sessionId"]
+    self.assertTrue(api_server.is_issued_session_id(session_id))
+    # a new session is routed, not pinned where the caller asked
+    self.assertEqual(self.router.pinned(session_id).name, 'us-east-1')
+    random_part = session_id.split(".")[0]
+    for forged in ("s1", random_part, random_part + ".0" * 16, uuid.uuid4().hex + session_id[32:]):
+      status, _, _ = self.run_async(call(self.app, "POST", "/v1/chat", {"question": "hi", "sessionId": forged}))
+      self.assertEqual(status, 400, forged)
+
+  def test_overload_and_concurrent_turns_on_a_session(self):
+    async def scenario():
+      self.release = asyncio.Event()
+      session_id = api_server.issue_session_id()
+      first = asyncio.ensure_future(call(self.app, "POST", "/v1/chat", {"question": "hi", "sessionId": session_id}))
+      await asyncio.sleep(0.01)
+      same_session = await call(self.app, "POST", "/v1/chat", {"question": "hi", "sessionId": session_id})
+      no_capacity = await call(self.app, "POST", "/v1/chat", {"question": "hi"})
+      self.release.set()
+      return same_session, no_capacity, await first
+
+    same_session, no_capacity, first = self.run_async(scenario())
+    self.assertEqual(same_session[0], 409)
+    self.assertEqual(no_capacity[0], 503)
+    self.assertEqual(no_capacity[1]["retry-after"], "1")
+    self.assertEqual(first[0], 200)
+    self.assertEqual(self.app.state.slots.running, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+from botocore.credentials import Credentials
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bench')))
+import agent_stub
+import async_agent
+import aws_auth
+import deadlines
+import invoke_br_agent
+import rate_limit
+from trace_collector import TraceCollector
+
+STUB_PATH = "/agents/AGENT/agentAliases/ALIAS/sessions/s1/text"
+
+
+class FakeCredentialProvider:
+
+  def get_credentials_nowait(self):
+    return Credentials("AKIDEXAMPLE", "secret").get_frozen_credentials()
+
+
+class TestAsyncAgentClient(unittest.TestCase):
+  # the same rules as the requests transport, against the local agent stub
+
+  def setUp(self):
+    patches = [
+      mock.patch.object(aws_auth, 'get_credential_provider', return_value=FakeCredentialProvider()),
+      mock.patch.object(rate_limit, 'get_limiter', return_value=rate_limit.AdaptiveRateLimiter(max_rate=0, min_rate=1000)),
+      mock.patch.object(rate_limit, 'backoff_delay', return_value=0),
+      mock.patch.object(rate_limit, 'MAX_ATTEMPTS', 3),
+      mock.patch.dict(async_agent._clients, clear=True),
+    ]
+    for patch in patches:
+      patch.start()
+      self.addCleanup(patch.stop)
+
+  def stub(self, **config):
+    server, base_url = agent_stub.start_stub(config)
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    return base_url + STUB_PATH
+
+  def ask(self, url, deadline=None):
+    collector = TraceCollector()
+
+    async def ask():
+      return await async_agent.askQuestion_async("q", url, collector=collector, deadline=deadline)
+
+    try:
+      return asyncio.run(ask()), collector
+    finally:
+      self.collector = collector
+
+  def test_answers_from_the_stub(self):
+    (_, answer), collector = self.ask(self.stub(chunks=2, chunk_size=20))
+    self.assertTrue(answer.startswith("[0] answer"))
+    self.assertNotIn("retries", collector.turn.counters)
+
+  def test_throttling_and_server_errors_are_retried(self):
+    for config in ({"throttle_rate": 1.0}, {"error_rate": 1.0}):
+      with self.assertRaises(invoke_br_agent.AgentRequestError):
+        self.ask(self.stub(**config))
+      self.assertEqual(self.collector.turn.counters["retries"], rate_limit.MAX_ATTEMPTS - 1)
+
+  def test_client_errors_are_not_retried(self):
+    url = self.stub().replace("/text", "/unknown")
+    with self.assertRaises(invoke_br_agent.AgentRequestError) as raised:
+      self.ask(url)
+    self.assertEqual(raised.exception.status_code, 404)
+    self.assertNotIn("retries", self.collector.turn.counters)
+
+  def test_deadline_aborts_a_stalled_stream(self):
+    # no first byte: the read timeout is clipped to the first byte budget
+    started = time.monotonic()
+    with self.assertRaises(deadlines.DeadlineExceeded) as raised:
+      self.ask(self.stub(first_byte_delay=3), deadline=deadlines.Deadline(total=5, first_byte=0.3))
+    self.assertEqual(raised.exception.stage, "first byte")
+    # streaming: the watchdog closes the response mid-stream
+    with self.assertRaises(deadlines.DeadlineExceeded) as raised:
+      self.ask(self.stub(chunk_delay=1), deadline=deadlines.Deadline(total=0.5, first_byte=0.5))
+    self.assertEqual(raised.exception.stage, "total")
+    self.assertLess(time.monotonic() - started, 2.5)
+
+  def test_one_client_per_event_loop_closed_with_the_loop(self):
+    url = self.stub(chunks=1)
+
+    async def ask_twice():
+      client = async_agent.get_client()
+      await asyncio.gather(async_agent.askQuestion_async("a", url), async_agent.askQuestion_async("b", url))
+      self.assertIs(async_agent.get_client(), client)
+      self.assertFalse(client._session.closed)
+      return client, client._session
+
+    first, first_session = asyncio.run(ask_twice())
+    second, _ = asyncio.run(ask_twice())
+    self.assertIsNot(first, second)
+    self.assertTrue(first_session.closed)
+    self.assertIsNone(second._session)
+    self.assertEqual(list(async_agent._clients.values()), [second])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,83 @@
+import datetime
+import threading
+import unittest
+
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials, RefreshableCredentials
+
+import aws_auth
+
+
+def signed_headers(auth_class, credentials):
+  req = AWSRequest(method='POST', url='https://bedrock-agent-runtime.us-east-1.amazonaws.com/x',
+                   data='{}', headers={'content-type': 'application/json'})
+  req.context['timestamp'] = '20240101T000000Z'
+  auth = auth_class(credentials, 'bedrock', 'us-east-1')
+  canonical = auth.canonical_request(req)
+  return auth.signature(auth.string_to_sign(req, canonical), req)
+
+
+class FakeSession:
+  # counts how often the credential chain is resolved
+
+  def __init__(self, credentials):
+    self.credentials = credentials
+    self.resolved = 0
+
+  def __call__(self):
+    return self
+
+  def get_credentials(self):
+    self.resolved += 1
+    return self.credentials
+
+
+def metadata(name, expires_in):
+  expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=expires_in)
+  return {'access_key': name, 'secret_key': 'secret-' + name, 'token': None, 'expiry_time': expiry.isoformat()}
+
+
+class TestSigning(unittest.TestCase):
+
+  def test_cached_signature_matches_botocore(self):
+    credentials = Credentials('AKID', 'secret').get_frozen_credentials()
+    expected = signed_headers(SigV4Auth, credentials)
+    self.assertEqual(signed_headers(aws_auth.CachedSigV4Auth, credentials), expected)
+    # second call is served from the key cache
+    self.assertIn(('AKID', '20240101', 'us-east-1', 'bedrock'), aws_auth._signing_keys)
+    self.assertEqual(signed_headers(aws_auth.CachedSigV4Auth, credentials), expected)
+
+
+class TestCredentialProvider(unittest.TestCase):
+
+  def test_resolves_the_chain_once(self):
+    session = FakeSession(Credentials('AKID', 'secret'))
+    provider = aws_auth.CredentialProvider(session_factory=session)
+    self.assertIsNone(provider.get_credentials_nowait())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(provider.get_credentials())) for _ in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual({c.access_key for c in results}, {'AKID'})
+    self.assertEqual(provider.get_credentials_nowait().access_key, 'AKID')
+    self.assertEqual(session.resolved, 1)
+
+  def test_expiring_credentials_are_refreshed_by_botocore(self):
+    loads = [metadata('second', 3600)]
+    refreshable = RefreshableCredentials.create_from_metadata(
+      metadata('first', 60), refresh_using=lambda: loads.pop(0), method='test')
+    session = FakeSession(refreshable)
+    provider = aws_auth.CredentialProvider(session_factory=session)
+    provider._resolve()
+    # about to expire: async callers refresh off the event loop
+    self.assertIsNone(provider.get_credentials_nowait())
+    self.assertEqual(provider.get_credentials().access_key, 'second')
+    self.assertEqual(provider.get_credentials_nowait().access_key, 'second')
+    self.assertEqual(session.resolved, 1)
+    self.assertEqual(loads, [])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,124 @@
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import batch_runner
+import eventstream
+
+
+def fake_handler(calls, fail=(), delay=0.0):
+  lock = threading.Lock()
+
+  def handler(event, collector):
+    with lock:
+      calls.append(dict(event))
+    if delay:
+      time.sleep(delay)
+    if event["question"] in fail:
+      return {"status_code": 500, "body": json.dumps({"error": "boom"})}
+    answer = "answer to " + event["question"]
+    collector.add(eventstream.AgentEvent('trace', {'trace': {'orchestrationTrace': {
+      'rationale': {'traceId': 't1', 'text': 'thinking'}}}}, None))
+    collector.add(eventstream.AgentEvent('chunk', {'bytes': base64.b64encode(answer.encode()).decode()}, answer))
+    return {"status_code": 200, "body": json.dumps({"response": collector.text(), "trace_data": answer})}
+
+  return handler
+
+
+class TestBatchRunner(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.output = os.path.join(self.dir.name, 'results.jsonl')
+
+  def tearDown(self):
+    self.dir.cleanup()
+
+  def write(self, name, text):
+    path = os.path.join(self.dir.name, name)
+    with open(path, 'w') as f:
+      f.write(text)
+    return path
+
+  def rows(self):
+    with open(self.output) as f:
+      return [json.loads(line) for line in f]
+
+  def test_load_jsonl_and_csv(self):
+    jsonl = self.write('q.jsonl', '{"id": "a", "question": "one", "session": "s1"}\n\n{"question": "two"}\n')
+    csv_path = self.write('q.csv', 'id,question,session\na,one,s1\nb,two,\n')
+    self.assertEqual(batch_runner.load_questions(jsonl), [
+      {"id": "a", "question": "one", "session": "s1"},
+      {"id": "2", "question": "two", "session": None}])
+    self.assertEqual(batch_runner.load_questions(csv_path), [
+      {"id": "a", "question": "one", "session": "s1"},
+      {"id": "b", "question": "two", "session": None}])
+
+  def test_duplicate_ids_rejected(self):
+    path = self.write('q.jsonl', '{"id": 1, "question": "one"}\n{"id": 1, "question": "two"}\n')
+    with self.assertRaises(ValueError):
+      batch_runner.load_questions(path)
+
+  def test_sessions_run_in_order_and_end_on_last_question(self):
+    questions = [
+      {"id": "1", "question": "s1 first", "session": "s1"},
+      {"id": "2", "question": "alone", "session": None},
+      {"id": "3", "question": "s1 second", "session": "s1"},
+    ]
+    calls = []
+    summary = batch_runner.run_batch(questions, self.output, fake_handler(calls), concurrency=4)
+    self.assertEqual(summary["ok"], 3)
+    s1 = [c for c in calls if c["question"].startswith("s1")]
+    self.assertEqual([c["question"] for c in s1], ["s1 first", "s1 second"])
+    self.assertEqual([c["endSession"] for c in s1], ["false", "true"])
+    self.assertEqual(s1[0]["sessionId"], s1[1]["sessionId"])
+    alone = next(c for c in calls if c["question"] == "alone")
+    self.assertNotEqual(alone["sessionId"], s1[0]["sessionId"])
+
+    rows = {row["id"]: row for row in self.rows()}
+    self.assertEqual(rows["3"]["answer"], "answer to s1 second")
+    self.assertEqual(rows["3"]["turn"], 1)
+    self.assertEqual([step["kind"] for step in rows["1"]["steps"]], ["rationale"])
+    self.assertIsNotNone(rows["1"]["trace_latency"]["first_chunk"])
+
+  def test_independent_sessions_run_concurrently(self):
+    questions = [{"id": str(i), "question": f"q{i}", "session": None} for i in range(8)]
+    started = time.perf_counter()
+    batch_runner.run_batch(questions, self.output, fake_handler([], delay=0.1), concurrency=8)
+    self.assertLess(time.perf_counter() - started, 0.5)
+
+  def test_resume_skips_finished_sessions_and_reruns_broken_ones(self):
+    questions = [
+      {"id": "1", "question": "a1", "session": "a"},
+      {"id": "2", "question": "a2", "session": "a"},
+      {"id": "3", "question": "b1", "session": "b"},
+      {"id": "4", "question": "b2", "session": "b"},
+    ]
+    summary = batch_runner.run_batch(questions, self.output, fake_handler([], fail={"b2"}))
+    self.assertEqual(summary["errors"], 1)
+    # an interrupted write leaves half a line behind
+    with open(self.output, 'a') as f:
+      f.write('{"id": "4", "sta')
+
+    calls = []
+    summary = batch_runner.run_batch(questions, self.output, fake_handler(calls))
+    self.assertEqual(summary["skipped"], 2)
+    self.assertEqual([c["question"] for c in calls], ["b1", "b2"])
+    self.assertEqual(sorted(row["id"] for row in self.rows()), ["1", "2", "3", "4"])
+    self.assertTrue(all(row["status"] == "ok" for row in self.rows()))
+
+  def test_restart_discards_previous_results(self):
+    questions = [{"id": "1", "question": "q", "session": None}]
+    batch_runner.run_batch(questions, self.output, fake_handler([]))
+    calls = []
+    batch_runner.run_batch(questions, self.output, fake_handler(calls), resume=False)
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(len(self.rows()), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
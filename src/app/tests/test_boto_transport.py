@@ -0,0 +1,109 @@
+import datetime
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError, EventStreamError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bench')))
+import agent_stub
+import boto_transport
+import deadlines
+import eventstream
+import invoke_br_agent
+import rate_limit
+from trace_collector import TraceCollector
+
+URL = "https://bedrock-agent-runtime.us-east-1.amazonaws.com/agents/AGENT/agentAliases/ALIAS/sessions/s1/text"
+
+
+class FakeCompletion:
+
+  def __init__(self, events, error=None):
+    self.events = events
+    self.error = error
+    self._raw_stream = None
+    self.closed = False
+
+  def __iter__(self):
+    yield from self.events
+    if self.error is not None:
+      raise self.error
+
+  def close(self):
+    self.closed = True
+
+
+class TestBotoTransport(unittest.TestCase):
+
+  def test_events_match_the_http_transport(self):
+    trace = {'agentId': 'A', 'trace': {'orchestrationTrace': {}},
+             'eventTime': datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc)}
+    completion = FakeCompletion([{'trace': trace}, {'chunk': {'bytes': b'Hello'}}])
+    collector = TraceCollector()
+    events = list(boto_transport.iter_response_events(boto_transport.AgentStream(completion), collector))
+    self.assertEqual(events[0], eventstream.AgentEvent(
+      'trace', {'agentId': 'A', 'trace': {'orchestrationTrace': {}}, 'eventTime': '2024-05-01T00:00:00+00:00'}, None))
+    self.assertEqual(events[1], eventstream.AgentEvent('chunk', {'bytes': 'SGVsbG8='}, 'Hello'))
+    self.assertEqual(collector.answer(), 'Hello')
+    self.assertIn('ttfb', collector.turn.durations)
+
+  def test_exception_frames_become_agent_stream_errors(self):
+    error = EventStreamError({'Error': {'Code': 'throttlingException', 'Message': 'slow down'}}, 'InvokeAgent')
+    collector = TraceCollector()
+    with self.assertRaises(eventstream.AgentStreamError) as raised:
+      list(boto_transport.iter_response_events(
+        boto_transport.AgentStream(FakeCompletion([], error)), collector))
+    self.assertEqual(raised.exception.error_type, 'throttlingException')
+
+  def test_request_errors_are_left_to_the_retry_loop(self):
+    self.assertEqual(boto_transport.create_client('us-east-1').meta.config.retries['total_max_attempts'], 1)
+    client = mock.Mock()
+    client.invoke_agent.side_effect = ClientError({
+      'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'},
+      'ResponseMetadata': {'HTTPStatusCode': 429}}, 'InvokeAgent')
+    collector = TraceCollector()
+    with mock.patch.object(boto_transport, 'get_client', return_value=client):
+      with self.assertRaises(invoke_br_agent.AgentRequestError) as raised:
+        boto_transport.send_question("hi", URL, collector=collector)
+    self.assertEqual(raised.exception.status_code, 429)
+    self.assertIsNotNone(invoke_br_agent.retry_wait(raised.exception, 1, collector.turn))
+
+  def test_read_timeout_follows_the_deadline(self):
+    server, base_url = agent_stub.start_stub({"header_delay": 3})
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    patches = [
+      mock.patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'AKIDEXAMPLE', 'AWS_SECRET_ACCESS_KEY': 'secret'}),
+      mock.patch.dict(boto_transport._clients, clear=True),
+      mock.patch.object(invoke_br_agent, 'TRANSPORT', 'boto3'),
+      mock.patch.object(rate_limit, 'get_limiter', return_value=rate_limit.AdaptiveRateLimiter(max_rate=0, min_rate=1000)),
+    ]
+    for patch in patches:
+      patch.start()
+      self.addCleanup(patch.stop)
+    url = base_url + "/agents/AGENT/agentAliases/ALIAS/sessions/s1/text"
+    # invoke_agent itself waits for the headers, before the stream can be aborted
+    started = time.monotonic()
+    with self.assertRaises(deadlines.DeadlineExceeded) as raised:
+      invoke_br_agent.askQuestion("q", url, deadline=deadlines.Deadline(total=5, first_byte=0.3))
+    self.assertEqual(raised.exception.stage, "first byte")
+    self.assertLess(time.monotonic() - started, 2)
+
+  def test_send_question_maps_the_url_to_parameters(self):
+    client = mock.Mock()
+    client.invoke_agent.return_value = {'completion': FakeCompletion([]), 'ResponseMetadata': {}}
+    with mock.patch.object(boto_transport, 'get_client', return_value=client) as get_client:
+      with boto_transport.send_question("hi", URL, endSession=False, streamFinalResponse=True) as stream:
+        pass
+    self.assertTrue(stream.completion.closed)
+    get_client.assert_called_once_with('us-east-1', 'https://bedrock-agent-runtime.us-east-1.amazonaws.com')
+    client.invoke_agent.assert_called_once_with(
+      agentId='AGENT', agentAliasId='ALIAS', sessionId='s1', inputText='hi', enableTrace=True,
+      endSession=False, streamingConfigurations={'streamFinalResponse': True})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from chat_history import ChatHistory
+
+
+def message(i, size=10):
+  return {"role": "user" if i % 2 == 0 else "assistant", "content": str(i).rjust(size, "x")}
+
+
+class TestChatHistory(unittest.TestCase):
+
+  def test_window_returns_latest_in_order(self):
+    history = ChatHistory(max_messages=100, max_bytes=10_000)
+    for i in range(30):
+      history.append(message(i))
+    self.assertEqual([m["content"][-2:] for m in history.window(3)], ["27", "28", "29"])
+    self.assertEqual(history.hidden_count(20), 10)
+    self.assertEqual(len(history.window(100)), 30)
+
+  def test_message_cap_drops_oldest(self):
+    history = ChatHistory(max_messages=5, max_bytes=10_000)
+    for i in range(8):
+      history.append(message(i))
+    self.assertEqual(len(history), 5)
+    self.assertEqual(history.dropped, 3)
+    self.assertTrue(history.window(5)[0]["content"].endswith("3"))
+
+  def test_byte_cap(self):
+    history = ChatHistory(max_messages=100, max_bytes=35)
+    for i in range(5):
+      history.append(message(i))
+    self.assertEqual(len(history), 3)
+    self.assertLessEqual(history.size(), 35)
+    # a single oversized message is still kept
+    history.append(message(9, size=100))
+    self.assertEqual(len(history), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,133 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import deadlines
+import invoke_br_agent
+import rate_limit
+import transport
+from trace_collector import TraceCollector
+
+
+class TestDeadline(unittest.TestCase):
+
+  def setUp(self):
+    self.now = 0.0
+    self.deadline = deadlines.Deadline(total=10, first_byte=2, clock=lambda: self.now)
+
+  def test_first_byte_deadline_until_first_byte(self):
+    self.assertEqual(self.deadline.remaining(), 2)
+    self.now = 2
+    with self.assertRaises(deadlines.DeadlineExceeded) as raised:
+      self.deadline.check()
+    self.assertEqual(raised.exception.stage, "first byte")
+
+  def test_total_deadline_after_first_byte(self):
+    self.deadline.first_byte_received()
+    self.now = 5
+    self.deadline.check()
+    self.assertEqual(self.deadline.remaining(), 5)
+    self.now = 10
+    with self.assertRaises(deadlines.DeadlineExceeded) as raised:
+      self.deadline.check()
+    self.assertEqual(raised.exception.stage, "total")
+
+  def test_request_timeouts_are_clipped_to_the_budget(self):
+    self.now = 1.5
+    self.assertEqual(self.deadline.request_timeout(3.05, 120), (0.5, 0.5))
+    self.deadline.first_byte_received()
+    self.assertEqual(self.deadline.request_timeout(3.05, 120), (3.05, 8.5))
+
+  def test_allows_only_waits_that_fit(self):
+    self.assertTrue(self.deadline.allows(1.9))
+    self.assertFalse(self.deadline.allows(2.1))
+
+  def test_cancel_fires_callbacks_once(self):
+    fired = []
+    self.deadline.on_expire(lambda: fired.append(1))
+    self.deadline.cancel()
+    self.deadline.cancel()
+    self.assertEqual(fired, [1])
+    with self.assertRaises(deadlines.TurnCancelled):
+      self.deadline.check()
+    # registering after the turn was cancelled fires straight away
+    self.deadline.on_expire(lambda: fired.append(2))
+    self.assertEqual(fired, [1, 2])
+
+  def test_removed_callbacks_do_not_fire(self):
+    fired = []
+    remove = self.deadline.on_expire(lambda: fired.append(1))
+    remove()
+    self.deadline.cancel()
+    self.assertEqual(fired, [])
+
+
+class TestWatchdog(unittest.TestCase):
+
+  def test_watchdog_fires_on_expiry(self):
+    fired = threading.Event()
+    deadline = deadlines.Deadline(total=0.1, first_byte=0.05)
+    deadline.on_expire(fired.set)
+    self.assertTrue(fired.wait(1))
+    self.assertEqual(deadline.exceeded()[0], "first byte")
+
+  def test_first_byte_in_time_waits_for_total(self):
+    fired = threading.Event()
+    deadline = deadlines.Deadline(total=0.3, first_byte=0.1)
+    deadline.on_expire(fired.set)
+    deadline.first_byte_received()
+    self.assertFalse(fired.wait(0.2))
+    self.assertTrue(fired.wait(1))
+
+  def test_finished_turns_leave_the_heap(self):
+    watchdog = deadlines._watchdog()
+    before = len(watchdog._heap)
+    for _ in range(50):
+      deadline = deadlines.Deadline(total=300, first_byte=60)
+      # a retried request registers again after removing its first callback
+      deadline.on_expire(lambda: None)()
+      remove = deadline.on_expire(lambda: None)
+      self.assertEqual(len(watchdog._heap), before + 1)
+      remove()
+    cancelled = deadlines.Deadline(total=300, first_byte=60)
+    cancelled.on_expire(lambda: None)
+    cancelled.cancel()
+    self.assertEqual(len(watchdog._heap), before)
+
+
+class StalledResponse:
+  # a body that never sends a byte until the connection is aborted
+
+  def __init__(self):
+    self.aborted = threading.Event()
+
+  def iter_content(self, chunk_size):
+    self.aborted.wait(5)
+    raise ConnectionError("connection shut down")
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    pass
+
+
+class TestTurnDeadline(unittest.TestCase):
+
+  def test_stalled_stream_is_aborted_at_the_deadline(self):
+    response = StalledResponse()
+    collector = TraceCollector()
+    started = time.perf_counter()
+    with mock.patch.object(invoke_br_agent, 'send_question', return_value=response), \
+         mock.patch.object(transport, 'abort_response', lambda r: r.aborted.set()), \
+         mock.patch.object(rate_limit, 'get_limiter', return_value=rate_limit.AdaptiveRateLimiter(max_rate=0)):
+      with self.assertRaises(deadlines.DeadlineExceeded):
+        invoke_br_agent.askQuestion("q", "http://agent", collector=collector,
+                                    deadline=deadlines.Deadline(total=5, first_byte=0.2))
+    self.assertLess(time.perf_counter() - started, 2)
+    self.assertEqual(collector.turn.error.stage, "first byte")
+
+
+if __name__ == '__main__':
+  unittest.main()
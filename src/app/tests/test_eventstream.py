@@ -0,0 +1,80 @@
+import base64
+import struct
+import unittest
+import zlib
+
+import eventstream
+
+
+def chunk_frame(text):
+  return eventstream.encode_agent_event('chunk', {'bytes': base64.b64encode(text.encode()).decode()})
+
+
+def final_trace_frame(text):
+  return eventstream.encode_agent_event('trace', {
+    'trace': {'orchestrationTrace': {'observation': {'finalResponse': {'text': text}}}}
+  })
+
+
+def raw_frame(header_block, payload=b''):
+  # a frame with valid checksums around whatever header bytes it is given
+  prelude = struct.pack('>II', 16 + len(header_block) + len(payload), len(header_block))
+  message = prelude + struct.pack('>I', zlib.crc32(prelude)) + header_block + payload
+  return message + struct.pack('>I', zlib.crc32(message))
+
+
+class TestEventStreamDecoder(unittest.TestCase):
+
+  def test_decodes_frames_split_across_reads(self):
+    body = final_trace_frame('ignored') + chunk_frame('Hello ') + chunk_frame('world')
+    # one byte at a time is the worst case for frame boundaries
+    events = list(eventstream.iter_agent_events(body[i:i + 1] for i in range(len(body))))
+    self.assertEqual([e.event_type for e in events], ['trace', 'chunk', 'chunk'])
+    self.assertEqual(''.join(e.text for e in events if e.text), 'Hello world')
+    self.assertEqual(eventstream.final_response_text(events[0]), 'ignored')
+
+  def test_many_frames_in_one_read(self):
+    body = b''.join(chunk_frame(str(i)) for i in range(100))
+    events = list(eventstream.iter_agent_events([body]))
+    self.assertEqual(''.join(e.text for e in events), ''.join(str(i) for i in range(100)))
+
+  def test_decoder_keeps_only_partial_frame(self):
+    frame = chunk_frame('x' * 1000)
+    decoder = eventstream.EventStreamDecoder()
+    self.assertEqual(len(decoder.feed(frame + frame[:10])), 1)
+    self.assertEqual(len(decoder._buffer), 10)
+
+  def test_corrupt_message_crc(self):
+    frame = bytearray(chunk_frame('hello'))
+    frame[-6] ^= 0xFF
+    with self.assertRaises(eventstream.EventStreamError):
+      list(eventstream.iter_agent_events([bytes(frame)]))
+
+  def test_bad_headers_leave_the_buffer_usable(self):
+    decoder = eventstream.EventStreamDecoder()
+    # kept, traceback and all, the way a caller that logs it later would
+    # (assertRaises would clear the frames)
+    try:
+      decoder.feed(raw_frame(b'\x04name\x0a'))
+    except eventstream.EventStreamError as e:
+      first = e
+    self.assertIn('Unknown header value type', str(first))
+    with self.assertRaises(eventstream.EventStreamError):
+      decoder.feed(chunk_frame('more'))
+
+  def test_truncated_stream(self):
+    frame = chunk_frame('hello')
+    with self.assertRaises(eventstream.EventStreamError):
+      list(eventstream.iter_agent_events([frame[:-3]]))
+
+  def test_exception_frame(self):
+    frame = eventstream.encode_message(
+      {':message-type': 'exception', ':exception-type': 'throttlingException'},
+      b'{"message": "Rate exceeded"}')
+    with self.assertRaises(eventstream.AgentStreamError) as ctx:
+      list(eventstream.iter_agent_events([frame]))
+    self.assertEqual(ctx.exception.error_type, 'throttlingException')
+
+
+if __name__ == '__main__':
+  unittest.main()
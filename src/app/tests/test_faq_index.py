@@ -0,0 +1,102 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import faq_index
+
+QUESTIONS = [
+  "How do I access my grades?",
+  "How do I reset my password?",
+  "What is the late assignment policy?",
+  "How do I submit an assignment in Canvas?",
+  "When is the tuition payment deadline?",
+  "How do I enroll in a course?",
+  "How do I drop a course?",
+]
+
+
+def pairs():
+  return [{"question": q, "answer": "Answer: " + q, "sources": [f"s3://kb/doc{i}.pdf"]}
+          for i, q in enumerate(QUESTIONS)]
+
+
+class TestFaqIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.index = faq_index.build(pairs(), built_at=1000.0)
+    self.index.min_confidence = 0.9
+
+  def test_rephrased_question_is_answered(self):
+    match = self.index.lookup("how can I reset my password")
+    self.assertEqual(match.entry.question, "How do I reset my password?")
+    self.assertEqual(match.confidence, 1.0)
+    self.assertEqual(self.index.stats()["hits"], 1)
+
+  def test_partial_or_unrelated_questions_go_to_the_agent(self):
+    self.assertIsNone(self.index.lookup("How do I access my grades for last semester?"))
+    self.assertIsNone(self.index.lookup("grades"))
+    self.assertIsNone(self.index.lookup("What is the weather today?"))
+    self.assertEqual(self.index.search("What is the weather today?"), [])
+    # the closest entry is still reported, with its confidence
+    match = self.index.search("How do I drop a class?")[0]
+    self.assertEqual(match.entry.question, "How do I drop a course?")
+    self.assertLess(match.confidence, 0.9)
+    self.assertEqual(self.index.stats()["hit_rate"], 0.0)
+
+  def test_build_from_batch_results_and_reload(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      results = os.path.join(tmp, "results.jsonl")
+      with open(results, "w") as f:
+        for row in pairs()[:2]:
+          f.write(json.dumps(dict(row, status="ok")) + "\n")
+        f.write(json.dumps({"question": "Failed?", "answer": None, "status": "error"}) + "\n")
+        # a newer answer to the same question replaces the older one
+        f.write(json.dumps({"question": "how do I access my grades", "answer": "New answer", "status": "ok",
+                            "turn": 0, "sources": ["s3://kb/doc0.pdf"], "cacheable": True}) + "\n")
+      index = faq_index.build(faq_index.read_pairs(results))
+      path = os.path.join(tmp, "faq.json")
+      index.save(path)
+      loaded = faq_index.FaqIndex.load(path)
+    self.assertEqual(len(loaded.entries), 2)
+    self.assertEqual(loaded.lookup("How do I access my grades?").entry.answer, "New answer")
+
+  def test_only_shareable_batch_rows_are_indexed(self):
+    row = {"question": "How do I enroll in a course?", "answer": "From the portal.", "status": "ok",
+           "turn": 0, "sources": ["s3://kb/doc0.pdf"], "cacheable": True}
+    action = {"kind": "actionGroupInvocationOutput"}
+    rows = [
+      row,
+      dict(row, question="How do I reset my password?", answer="Your temporary password is x", cacheable=False),
+      dict(row, question="What about graduate students?", turn=1),
+      dict(row, question="Hello", sources=[]),
+      # results written before rows had "cacheable" are judged by their steps
+      {"question": "Reset it please", "answer": "Done.", "status": "ok", "sources": ["s3://kb/doc0.pdf"],
+       "steps": [action]},
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+      results = os.path.join(tmp, "results.jsonl")
+      with open(results, "w") as f:
+        f.writelines(json.dumps(r) + "\n" for r in rows)
+      self.assertEqual([p["question"] for p in faq_index.read_pairs(results)], ["How do I enroll in a course?"])
+
+  def test_staleness_from_changed_documents_and_new_ingestion(self):
+    s3 = mock.Mock()
+    s3.exceptions.ClientError = Exception
+    s3.head_object.side_effect = lambda Bucket, Key: {"LastModified": datetime.datetime.fromtimestamp(
+      2000.0 if Key == "doc1.pdf" else 500.0, datetime.timezone.utc)}
+    agent = mock.Mock()
+    agent.list_ingestion_jobs.return_value = {"ingestionJobSummaries": [
+      {"updatedAt": datetime.datetime.fromtimestamp(900.0, datetime.timezone.utc)}]}
+    with mock.patch.object(faq_index, "MAX_AGE_DAYS", 0):
+      report = faq_index.staleness(self.index, "KB", "DS", agent_client=agent, s3_client=s3)
+    self.assertTrue(report["stale"])
+    self.assertEqual(report["stale_entries"], 1)
+    self.assertEqual(list(report["changed_sources"]), ["s3://kb/doc1.pdf"])
+    self.assertEqual(report["ingested_at"], 900.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import unittest
+
+import instrumentation
+
+
+class TestInstrumentation(unittest.TestCase):
+
+  def setUp(self):
+    self.saved_registry = instrumentation.registry
+    self.registry = instrumentation.registry = instrumentation.Registry()
+
+  def tearDown(self):
+    instrumentation.registry = self.saved_registry
+    instrumentation.set_exporters([])
+
+  def test_record_goes_to_active_turn(self):
+    turn = instrumentation.Turn()
+    with turn.active():
+      instrumentation.record('sign', 0.25)
+      instrumentation.count('connections_opened')
+    instrumentation.record('sign', 1.0)
+    self.assertEqual(turn.durations, {'sign': 0.25})
+    self.assertEqual(turn.counters, {'connections_opened': 1})
+    self.assertEqual(self.registry.histograms['sign'].count, 1)
+
+  def test_finish_updates_registry_and_exporters(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'metrics.jsonl')
+      instrumentation.set_exporters([instrumentation.JsonLogExporter(path)])
+      turn = instrumentation.Turn()
+      turn.add('decode', 0.002)
+      turn.count('bytes_received', 512)
+      turn.finish(ValueError('boom'))
+      turn.finish()
+      with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    self.assertEqual(len(lines), 1)
+    self.assertEqual(lines[0]['counters'], {'bytes_received': 512})
+    self.assertEqual(lines[0]['error'], 'ValueError: boom')
+
+    text = self.registry.render_prometheus()
+    self.assertIn('br_agent_decode_seconds_bucket{le="0.005"} 1', text)
+    self.assertIn('br_agent_bytes_received_total 512', text)
+    self.assertIn('br_agent_errors_total{type="ValueError"} 1', text)
+    self.assertIn('br_agent_turns_total 1', text)
+
+  def test_other_turns_stay_out_of_turn_metrics(self):
+    turn = instrumentation.Turn('end_session')
+    turn.count('bytes_received', 64)
+    turn.finish()
+    text = self.registry.render_prometheus()
+    self.assertIn('br_agent_end_session_turns_total 1', text)
+    self.assertIn('br_agent_end_session_bytes_received_total 64', text)
+    self.assertNotIn('br_agent_turns_total', text)
+    self.assertNotIn('br_agent_turn_seconds', text)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,69 @@
+import base64
+import os
+import unittest
+from unittest import mock
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import agent_router
+import eventstream
+import invoke_br_agent
+
+MAIN = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'main.py'))
+
+
+def kb_answer(collector, text):
+  collector.add(eventstream.AgentEvent('trace', {'trace': {'orchestrationTrace': {'observation': {
+    'knowledgeBaseLookupOutput': {'retrievedReferences': []}}}}}, None))
+  collector.add(eventstream.AgentEvent('chunk', {'bytes': base64.b64encode(text.encode()).decode()}, text))
+
+
+class TestChatAnswerCache(unittest.TestCase):
+
+  def setUp(self):
+    self.questions = []
+    self.router = agent_router.AgentRouter([agent_router.AgentEndpoint(
+      'us-east-1', 'us-east-1', 'AGENT', 'ALIAS', 'https://agent.example')])
+
+    def stream_handler(event, collector=None, deadline=None):
+      self.questions.append(event["question"])
+      self.router.route(event["sessionId"])
+      answer = f"answer {len(self.questions)}"
+      kb_answer(collector, answer)
+      yield answer
+
+    patches = [
+      mock.patch.object(invoke_br_agent, 'stream_handler', stream_handler),
+      mock.patch.object(invoke_br_agent, 'get_router', return_value=self.router),
+    ]
+    for patch in patches:
+      patch.start()
+      self.addCleanup(patch.stop)
+    st.cache_resource.clear()
+    self.addCleanup(st.cache_resource.clear)
+
+  def ask(self, app, question):
+    app.chat_input[0].set_value(question).run()
+    self.assertFalse(app.exception)
+    return app.session_state["messages"].window(100)[-1]["content"]
+
+  def new_session(self):
+    app = AppTest.from_file(MAIN, default_timeout=30)
+    app.run()
+    return app
+
+  def test_only_the_first_turn_of_a_session_is_shared(self):
+    first = self.new_session()
+    self.assertEqual(self.ask(first, "How do I access my grades?"), "answer 1")
+    # a follow-up is answered in the context of the conversation so far
+    self.assertEqual(self.ask(first, "What about for graduate students?"), "answer 2")
+
+    # another user gets the first answer from the cache, but never the follow-up
+    self.assertEqual(self.ask(self.new_session(), "How do I access my grades?"), "answer 1")
+    self.assertEqual(self.ask(self.new_session(), "What about for graduate students?"), "answer 3")
+    self.assertEqual(len(self.questions), 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,162 @@
+import base64
+import unittest
+from unittest import mock
+
+import eventstream
+import invoke_br_agent
+import rate_limit
+from trace_collector import TraceCollector
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+
+  def setUp(self):
+    self.now = 0.0
+    self.limiter = rate_limit.AdaptiveRateLimiter(max_rate=0, min_rate=0.5, clock=lambda: self.now)
+
+  def test_unlimited_until_throttled(self):
+    self.assertEqual([self.limiter.reserve() for _ in range(50)], [0.0] * 50)
+    self.assertIsNone(self.limiter.rate)
+
+  def test_throttle_paces_below_measured_rate(self):
+    for i in range(40):
+      self.now = i * 0.05
+      self.limiter.reserve()
+    # 40 sends in the last 2 s: 20/s, cut to 14/s
+    self.limiter.on_throttle()
+    self.assertAlmostEqual(self.limiter.rate, 14.0)
+    waits = [self.limiter.reserve() for _ in range(3)]
+    self.assertAlmostEqual(waits[0], 1 / 14.0)
+    self.assertAlmostEqual(waits[2], 3 / 14.0)
+
+  def test_throttles_in_one_burst_count_once(self):
+    limiter = rate_limit.AdaptiveRateLimiter(max_rate=10, clock=lambda: self.now)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    self.assertAlmostEqual(limiter.rate, 7.0)
+    self.now += 1.0
+    limiter.on_throttle()
+    self.assertAlmostEqual(limiter.rate, 4.9)
+
+  def test_success_recovers_up_to_ceiling(self):
+    limiter = rate_limit.AdaptiveRateLimiter(max_rate=10, clock=lambda: self.now)
+    limiter.on_throttle()
+    for _ in range(100):
+      limiter.on_success()
+    self.assertEqual(limiter.rate, 10)
+
+  def test_rate_never_below_floor(self):
+    limiter = rate_limit.AdaptiveRateLimiter(max_rate=1, min_rate=0.5, clock=lambda: self.now)
+    for _ in range(5):
+      self.now += 1.0
+      limiter.on_throttle()
+    self.assertEqual(limiter.rate, 0.5)
+
+  def test_backoff_is_jittered_and_capped(self):
+    self.assertEqual(rate_limit.backoff_delay(1, base=0.2, cap=10, rng=lambda: 1.0), 0.2)
+    self.assertEqual(rate_limit.backoff_delay(3, base=0.2, cap=10, rng=lambda: 1.0), 0.8)
+    self.assertEqual(rate_limit.backoff_delay(20, base=0.2, cap=10, rng=lambda: 1.0), 10)
+    self.assertEqual(rate_limit.backoff_delay(3, base=0.2, cap=10, rng=lambda: 0.0), 0.0)
+
+
+class FakeResponse:
+
+  def __init__(self, body):
+    self.body = body
+    self.closed = False
+
+  def iter_content(self, chunk_size):
+    yield self.body
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.closed = True
+
+
+def chunk(text):
+  return eventstream.encode_agent_event('chunk', {'bytes': base64.b64encode(text.encode()).decode()})
+
+
+def exception_frame(error_type):
+  return eventstream.encode_message(
+    {':message-type': 'exception', ':exception-type': error_type}, b'{"message": "x"}')
+
+
+class TestRetries(unittest.TestCase):
+
+  def setUp(self):
+    self.limiter = rate_limit.AdaptiveRateLimiter(max_rate=0, min_rate=1000)
+    patches = [
+      mock.patch.object(rate_limit, 'get_limiter', return_value=self.limiter),
+      mock.patch.object(rate_limit, 'backoff_delay', return_value=0),
+      mock.patch.object(rate_limit, 'MAX_ATTEMPTS', 3),
+    ]
+    for patch in patches:
+      patch.start()
+      self.addCleanup(patch.stop)
+
+  def ask(self, outcomes):
+    calls = []
+
+    def send_question(*args):
+      calls.append(args)
+      outcome = outcomes.pop(0)
+      if isinstance(outcome, Exception):
+        raise outcome
+      return outcome
+
+    collector = TraceCollector()
+    with mock.patch.object(invoke_br_agent, 'send_question', send_question):
+      result = invoke_br_agent.askQuestion("q", "http://agent", collector=collector)
+    return result, calls, collector
+
+  def test_throttled_request_is_retried_and_slows_the_limiter(self):
+    (_, answer), calls, collector = self.ask([
+      invoke_br_agent.AgentRequestError(429, "ThrottlingException", "Rate exceeded"),
+      FakeResponse(chunk("hello")),
+    ])
+    self.assertEqual(answer, "hello")
+    self.assertEqual(len(calls), 2)
+    self.assertEqual(collector.turn.counters["retries"], 1)
+    self.assertEqual(collector.turn.counters["throttled"], 1)
+    self.assertIsNotNone(self.limiter.rate)
+
+  def test_exception_frame_before_any_event_is_retried(self):
+    (_, answer), calls, _ = self.ask([
+      FakeResponse(exception_frame("throttlingException")),
+      FakeResponse(chunk("hello")),
+    ])
+    self.assertEqual(answer, "hello")
+    self.assertEqual(len(calls), 2)
+
+  def test_failure_after_first_event_is_not_retried(self):
+    outcomes = [FakeResponse(chunk("partial") + exception_frame("internalServerException")),
+                FakeResponse(chunk("hello"))]
+    with self.assertRaises(eventstream.AgentStreamError):
+      self.ask(outcomes)
+    self.assertEqual(len(outcomes), 1)
+
+  def test_client_errors_are_not_retried(self):
+    outcomes = [invoke_br_agent.AgentRequestError(400, "ValidationException", "bad"), FakeResponse(chunk("x"))]
+    with self.assertRaises(invoke_br_agent.AgentRequestError):
+      self.ask(outcomes)
+    self.assertEqual(len(outcomes), 1)
+
+  def test_gives_up_after_max_attempts(self):
+    error = invoke_br_agent.AgentRequestError(503, "ServiceUnavailableException", "down")
+    outcomes = [error, error, error, FakeResponse(chunk("x"))]
+    with self.assertRaises(invoke_br_agent.AgentRequestError):
+      self.ask(outcomes)
+    self.assertEqual(len(outcomes), 1)
+
+  def test_lambda_handler_reports_failures(self):
+    with mock.patch.object(invoke_br_agent, 'send_question',
+                           side_effect=invoke_br_agent.AgentRequestError(400, "ValidationException", "bad")):
+      result = invoke_br_agent.lambda_handler({"sessionId": "s", "question": "q"})
+    self.assertEqual(result["status_code"], 500)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,46 @@
+import threading
+import unittest
+
+import session_manager
+
+
+class TestSessionManager(unittest.TestCase):
+
+  def setUp(self):
+    self.now = 0.0
+    self.ended = []
+    self.done = threading.Event()
+
+    def end_session(session_id):
+      self.ended.append(session_id)
+      self.done.set()
+
+    self.manager = session_manager.SessionManager(
+      end_session=end_session, idle_ttl=1800, max_sessions=2, clock=lambda: self.now)
+
+  def test_one_session_per_browser(self):
+    a = self.manager.session_for('browser-a')
+    b = self.manager.session_for('browser-b')
+    self.assertNotEqual(a, b)
+    self.assertEqual(self.manager.session_for('browser-a'), a)
+
+  def test_idle_sessions_expire_without_end_call(self):
+    a = self.manager.session_for('browser-a')
+    self.now += 1800
+    self.assertNotEqual(self.manager.session_for('browser-a'), a)
+    self.assertEqual(self.ended, [])
+
+  def test_cap_evicts_least_recently_used(self):
+    a = self.manager.session_for('browser-a')
+    self.manager.session_for('browser-b')
+    self.now += 1
+    self.manager.session_for('browser-a')
+    self.manager.session_for('browser-c')
+    self.assertTrue(self.done.wait(5))
+    self.assertEqual(len(self.ended), 1)
+    self.assertNotEqual(self.ended[0], a)
+    self.assertEqual(self.manager.live_sessions(), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,45 @@
+import base64
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import eventstream
+import invoke_br_agent
+from trace_collector import TraceCollector
+
+
+class FakeResponse:
+
+  def __init__(self, body):
+    self.body = body
+
+  def iter_content(self, chunk_size):
+    for i in range(0, len(self.body), 5):
+      yield self.body[i:i + 5]
+
+
+def agent_body(answer):
+  return (eventstream.encode_agent_event('trace', {'trace': {'orchestrationTrace': {'rationale': {'text': answer}}}})
+          + eventstream.encode_agent_event('chunk', {'bytes': base64.b64encode(answer.encode()).decode()}))
+
+
+class TestDecodeResponse(unittest.TestCase):
+
+  def test_concurrent_decodes_do_not_mix(self):
+    answers = [f"answer {i}" for i in range(32)]
+    with ThreadPoolExecutor(8) as pool:
+      results = list(pool.map(lambda a: invoke_br_agent.decode_response(FakeResponse(agent_body(a))), answers))
+    for answer, (trace_text, llm_response) in zip(answers, results):
+      self.assertEqual(llm_response, answer)
+      self.assertIn(f'"text": "{answer}"', trace_text)
+      self.assertEqual(trace_text.count('trace:'), 1)
+
+  def test_collector_keeps_events_once(self):
+    collector = TraceCollector()
+    invoke_br_agent.decode_response(FakeResponse(agent_body('hi')), collector)
+    self.assertEqual([r.event_type for r in collector.records], ['trace', 'chunk'])
+    self.assertEqual(collector.answer(), 'hi')
+    self.assertLessEqual(collector.records[0].elapsed, collector.records[1].elapsed)
+
+
+if __name__ == '__main__':
+  unittest.main()
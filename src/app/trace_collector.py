@@ -0,0 +1,56 @@
+import json
+import time
+from collections import namedtuple
+
+import eventstream
+import instrumentation
+
+# Per-request record of the decoded agent stream. decode functions write the
+# events they see into a collector owned by the caller, so concurrent turns
+# never share state and nothing touches sys.stdout. Each event is kept once,
+# as decoded; the text form is only rendered when asked for.
+
+# elapsed is seconds since the collector was created (the turn started)
+TraceRecord = namedtuple('TraceRecord', ['elapsed', 'event_type', 'payload', 'text'])
+
+
+class TraceCollector:
+
+    def __init__(self, turn_name=instrumentation.TURN):
+        self.started = time.perf_counter()
+        self.records = []
+        # timings and counters for this turn, see instrumentation
+        self.turn = instrumentation.Turn(turn_name)
+
+    def add(self, event):
+        self.records.append(TraceRecord(
+            time.perf_counter() - self.started, event.event_type, event.payload, event.text))
+
+    def chunks(self):
+        return [record.text for record in self.records
+                if record.event_type == 'chunk' and record.text is not None]
+
+    def traces(self):
+        return [record for record in self.records if record.event_type == 'trace']
+
+    def answer(self):
+        # streamed chunks when there are any, else the orchestration trace's
+        # final response
+        chunks = self.chunks()
+        if chunks:
+            return "".join(chunks)
+        for record in self.records:
+            text = eventstream.final_response_text(record)
+            if text:
+                return text
+        return ""
+
+    def text(self):
+        lines = []
+        for record in self.records:
+            if record.event_type == 'chunk':
+                lines.append(record.text or "")
+            else:
+                lines.append(f"{record.event_type}: {json.dumps(record.payload)}")
+        lines.append("")
+        return "\n".join(lines)
@@ -0,0 +1,114 @@
+import os
+import socket
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import instrumentation
+
+# One long-lived HTTP session per process. Module state survives Streamlit
+# reruns, so every turn and every browser session reuses the same pool of
+# keep-alive connections instead of paying DNS/TCP/TLS setup per question.
+#
+# Tunables (environment):
+#   BR_AGENT_POOL_SIZE        max connections kept per host (default 20)
+#   BR_AGENT_POOL_BLOCK       "true" makes callers wait for a free connection
+#                             instead of opening throwaway extras (default true)
+#   BR_AGENT_CONNECT_TIMEOUT  seconds to establish a connection (default 3.05)
+#   BR_AGENT_READ_TIMEOUT     max seconds between bytes on the socket (default 120)
+
+POOL_SIZE = int(os.environ.get("BR_AGENT_POOL_SIZE", "20"))
+POOL_BLOCK = os.environ.get("BR_AGENT_POOL_BLOCK", "true").lower() == "true"
+CONNECT_TIMEOUT = float(os.environ.get("BR_AGENT_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.environ.get("BR_AGENT_READ_TIMEOUT", "120"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# Connection classes that time their own setup (DNS, TCP and TLS handshake).
+# With keep-alive working this only fires for the first request on each
+# pooled connection.
+
+class TimedHTTPConnection(HTTPConnection):
+
+    def connect(self):
+        with instrumentation.timed("connect"):
+            super().connect()
+        instrumentation.count("connections_opened")
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+
+    def connect(self):
+        with instrumentation.timed("connect"):
+            super().connect()
+        instrumentation.count("connections_opened")
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def create_session(pool_size=POOL_SIZE, pool_block=POOL_BLOCK):
+    session = requests.Session()
+    # retries are handled (or not) by the caller; a silent urllib3 retry
+    # would re-send a question the agent may already be answering
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_size,
+        pool_block=pool_block,
+        max_retries=0
+    )
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': TimedHTTPConnectionPool,
+        'https': TimedHTTPSConnectionPool,
+    }
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # the session is shared between users, so never carry cookies across
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def default_timeout():
+    return (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+
+def abort_response(response):
+    # Called from another thread to stop a turn: shutting the socket down
+    # wakes up a reader blocked in recv, and the connection is discarded
+    # rather than handed back to the pool.
+    connection = getattr(response.raw, "_connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
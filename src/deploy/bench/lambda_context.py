@@ -0,0 +1,19 @@
+import time
+import uuid
+
+# The context object lambda_emulator passes to the handler, in its own module
+# so the subprocess workers can import it without the emulator.
+
+class LambdaContext:
+    # the attributes of the Lambda context object handlers commonly read
+
+    def __init__(self, function_name="virtual-assistant-agent", memory_limit_in_mb=128, timeout=180):
+        self.function_name = function_name
+        self.function_version = "$LATEST"
+        self.memory_limit_in_mb = memory_limit_in_mb
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = f"/aws/lambda/{function_name}"
+        self._deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
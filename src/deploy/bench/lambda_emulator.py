@@ -0,0 +1,303 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+
+BENCH_DIR = os.path.abspath(os.path.dirname(__file__))
+DEPLOY_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, DEPLOY_DIR)
+sys.path.insert(0, BENCH_DIR)
+from lambda_context import LambdaContext
+
+# Local stand-in for the Lambda service in front of the action group
+# handler, so lambda_function.py can be exercised and timed without
+# deploying it and going through the agent.
+#
+# Events are generated from the OpenAPI schema the agent gets: one per
+# operation, shaped like Bedrock's action group input (actionGroup, apiPath,
+# httpMethod, parameters, requestBody, sessionAttributes,
+# promptSessionAttributes) with values that fit the declared types.
+#
+#   python bench/lambda_emulator.py --environments 10 --invokes 2000
+#   python bench/lambda_emulator.py --mode inprocess --invokes 20000
+#   python bench/lambda_emulator.py --print-events
+#
+# subprocess (default) mimics the Lambda lifecycle: every execution
+# environment is a fresh interpreter that imports the handler module (cold
+# start) and then serves a stream of invocations (warm). inprocess re-imports
+# the module per environment and skips the process overhead, for quick
+# profiling. Both pass the handler a new LambdaContext per invoke. The report
+# has cold start (init and first invoke) and warm latency percentiles,
+# throughput, status codes, malformed responses and memory (peak RSS of an
+# environment, or the peak Python heap of one invoke).
+
+SCHEMA_FILE = os.path.join(DEPLOY_DIR, "..", "documents", "virtual-assistant-agent-schema.json")
+ACTION_GROUP = "PasswordResetActionGroup"
+
+WORKER_SCRIPT = """
+import contextlib, io, json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+sys.path.insert(0, sys.argv[3])
+from lambda_context import LambdaContext
+module_name, function_name = sys.argv[2].rsplit(".", 1)
+out = sys.stdout
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import importlib
+    handler = getattr(importlib.import_module(module_name), function_name)
+out.write(json.dumps({"init_ms": (time.perf_counter() - started) * 1000}) + "\\n")
+out.flush()
+for line in sys.stdin:
+    request = json.loads(line)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            result, error = handler(request["event"], LambdaContext()), None
+        except Exception as e:
+            result, error = None, repr(e)
+    elapsed = (time.perf_counter() - started) * 1e6
+    out.write(json.dumps({"us": elapsed, "result": result, "error": error,
+                          "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}) + "\\n")
+    out.flush()
+"""
+
+
+def _resolve(schema, node):
+    while isinstance(node, dict) and "$ref" in node:
+        target = schema
+        for part in node["$ref"].lstrip("#/").split("/"):
+            target = target[part]
+        node = target
+    return node
+
+
+def sample_value(name, spec, rng):
+    # a string value of the declared type, as the agent would send it
+    if "example" in spec:
+        return str(spec["example"])
+    if "enum" in spec:
+        return str(rng.choice(spec["enum"]))
+    kind = spec.get("type", "string")
+    if kind == "integer":
+        return str(rng.randint(spec.get("minimum", 1), spec.get("maximum", 100000)))
+    if kind == "number":
+        return f"{rng.uniform(spec.get('minimum', 0), spec.get('maximum', 100)):.2f}"
+    if kind == "boolean":
+        return rng.choice(["true", "false"])
+    if kind == "array":
+        return json.dumps([sample_value(name, spec.get("items", {}), rng) for _ in range(rng.randint(1, 3))])
+    if spec.get("format") == "email" or "email" in name.lower():
+        return f"student{rng.randint(1, 99999)}@example.edu"
+    if spec.get("format") == "date":
+        return f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    return f"{name}-{rng.randint(1, 99999)}"
+
+
+def _properties(schema, specs, required, rng):
+    # required values always, optional ones half of the time
+    properties = []
+    for name, spec in specs.items():
+        spec = _resolve(schema, spec)
+        if name in required or rng.random() < 0.5:
+            properties.append({"name": name, "type": spec.get("type", "string"),
+                               "value": sample_value(name, spec, rng)})
+    return properties
+
+
+def events_from_schema(schema, action_group=ACTION_GROUP, rng=None, session_id=None):
+    # one Bedrock action group event per operation in the schema
+    rng = rng or random.Random()
+    session_id = session_id or uuid.uuid4().hex
+    events = []
+    for api_path, path_item in schema.get("paths", {}).items():
+        for method, operation in path_item.items():
+            if method == "parameters":
+                continue
+            declared = [_resolve(schema, p) for p in path_item.get("parameters", []) + operation.get("parameters", [])]
+            parameters = _properties(
+                schema, {p["name"]: p.get("schema", {}) for p in declared},
+                {p["name"] for p in declared if p.get("required")}, rng)
+            event = {
+                "messageVersion": "1.0",
+                "agent": {"name": "virtual-assistant-agent", "id": "AGENTID123", "alias": "TSTALIASID",
+                          "version": "DRAFT"},
+                "inputText": operation.get("summary", f"{method} {api_path}"),
+                "sessionId": session_id,
+                "actionGroup": action_group,
+                "apiPath": api_path,
+                "httpMethod": method.upper(),
+                "parameters": parameters,
+                "sessionAttributes": {},
+                "promptSessionAttributes": {},
+            }
+            request_body = _resolve(schema, operation.get("requestBody"))
+            if request_body:
+                body_schema = _resolve(schema, request_body.get("content", {})
+                                       .get("application/json", {}).get("schema", {}))
+                event["requestBody"] = {"content": {"application/json": {"properties": _properties(
+                    schema, body_schema.get("properties", {}), set(body_schema.get("required", ())), rng)}}}
+            events.append(event)
+    return events
+
+
+def response_problem(event, result):
+    # what is wrong with a handler result, or None when Bedrock would accept it
+    if not isinstance(result, dict) or result.get("messageVersion") != "1.0":
+        return "missing messageVersion 1.0"
+    response = result.get("response")
+    if not isinstance(response, dict):
+        return "missing response"
+    for key in ("actionGroup", "apiPath", "httpMethod"):
+        if response.get(key) != event.get(key):
+            return f"response {key} does not match the event"
+    if not isinstance(response.get("httpStatusCode"), int):
+        return "missing httpStatusCode"
+    if "body" not in response.get("responseBody", {}).get("application/json", {}):
+        return "missing responseBody application/json body"
+    return None
+
+
+class Stats:
+
+    def __init__(self):
+        self.init_ms = []
+        self.first_invoke_us = []
+        self.warm_us = []
+        self.status_codes = {}
+        self.problems = {}
+        self.peak_memory_kib = 0
+        self.wall_time = 0.0
+
+    def record(self, event, result, error, us, first):
+        (self.first_invoke_us if first else self.warm_us).append(us)
+        if error is not None:
+            status = "exception"
+            problem = error
+        else:
+            problem = response_problem(event, result)
+            status = result["response"]["httpStatusCode"] if problem is None else "malformed"
+        self.status_codes[str(status)] = self.status_codes.get(str(status), 0) + 1
+        if problem:
+            self.problems[problem] = self.problems.get(problem, 0) + 1
+
+
+def run_subprocess(handler, events, environments, invokes, stats):
+    for _ in range(environments):
+        started = time.perf_counter()
+        worker = subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT, DEPLOY_DIR, handler, BENCH_DIR], cwd=DEPLOY_DIR,
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        try:
+            worker.stdout.readline()  # ready once the module is imported
+            for i in range(invokes):
+                event = events[i % len(events)]
+                worker.stdin.write(json.dumps({"event": event}) + "\n")
+                worker.stdin.flush()
+                reply = json.loads(worker.stdout.readline())
+                if i == 0:
+                    # process start, interpreter and module init, first event
+                    stats.init_ms.append((time.perf_counter() - started) * 1000 - reply["us"] / 1000)
+                stats.record(event, reply["result"], reply["error"], reply["us"], i == 0)
+                stats.peak_memory_kib = max(stats.peak_memory_kib, reply["max_rss_kib"])
+        finally:
+            worker.stdin.close()
+            worker.wait()
+        stats.wall_time += time.perf_counter() - started
+
+
+def run_inprocess(handler, events, environments, invokes, stats):
+    module_name, function_name = handler.rsplit(".", 1)
+    for _ in range(environments):
+        sys.modules.pop(module_name, None)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function = getattr(importlib.import_module(module_name), function_name)
+            stats.init_ms.append((time.perf_counter() - started) * 1000)
+            for i in range(invokes):
+                event = events[i % len(events)]
+                invoke_started = time.perf_counter()
+                try:
+                    result, error = function(event, LambdaContext()), None
+                except Exception as e:
+                    result, error = None, repr(e)
+                stats.record(event, result, error, (time.perf_counter() - invoke_started) * 1e6, i == 0)
+            # the Python heap one more invoke needs, traced separately
+            tracemalloc.start()
+            function(events[0], LambdaContext())
+            stats.peak_memory_kib = max(stats.peak_memory_kib, tracemalloc.get_traced_memory()[1] // 1024)
+            tracemalloc.stop()
+        stats.wall_time += time.perf_counter() - started
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))] if values else None
+
+
+def summarize(stats, mode):
+    invokes = len(stats.first_invoke_us) + len(stats.warm_us)
+    summary = {
+        "mode": mode,
+        "environments": len(stats.init_ms),
+        "invokes": invokes,
+        "cold_init_ms_p50": round(statistics.median(stats.init_ms), 3),
+        "cold_init_ms_max": round(max(stats.init_ms), 3),
+        "first_invoke_us_p50": round(statistics.median(stats.first_invoke_us), 1),
+    }
+    for pct in (50, 95, 99):
+        value = percentile(stats.warm_us, pct)
+        summary[f"warm_us_p{pct}"] = round(value, 1) if value is not None else None
+    summary["throughput_per_s"] = round(invokes / stats.wall_time, 1) if stats.wall_time else None
+    summary["peak_rss_kib" if mode == "subprocess" else "invoke_heap_peak_kib"] = stats.peak_memory_kib
+    summary["status_codes"] = stats.status_codes
+    summary["problems"] = stats.problems
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the action group Lambda handler locally")
+    parser.add_argument("--handler", default="lambda_function.lambda_handler", help="module.function")
+    parser.add_argument("--schema", default=SCHEMA_FILE, help="OpenAPI schema to generate events from")
+    parser.add_argument("--action-group", default=ACTION_GROUP)
+    parser.add_argument("--mode", choices=("subprocess", "inprocess"), default="subprocess")
+    parser.add_argument("--environments", type=int, default=5, help="cold starts")
+    parser.add_argument("--invokes", type=int, default=1000, help="invocations per environment")
+    parser.add_argument("--events", help="JSON list of events to send instead of generated ones")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--print-events", action="store_true", help="print the generated events and exit")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    if args.events:
+        with open(args.events) as f:
+            events = json.load(f)
+    else:
+        with open(args.schema) as f:
+            events = events_from_schema(json.load(f), args.action_group, random.Random(args.seed))
+    if args.print_events:
+        print(json.dumps(events, indent=2))
+        return
+
+    stats = Stats()
+    run = run_subprocess if args.mode == "subprocess" else run_inprocess
+    run(args.handler, events, args.environments, args.invokes, stats)
+    summary = summarize(stats, args.mode)
+    for key, value in summary.items():
+        print(f"{key:>22}: {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if stats.problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import boto3
+import os
+import provision
 
 sts_client = boto3.client('sts')
 iam_client = boto3.client('iam')
@@ -19,6 +21,10 @@ def main():
     if delete_agent_kb(region, account_id):
         delete_lambda_function(region, account_id)
         delete_s3_bucket(region, account_id)
+        # the next deploy starts from scratch
+        state_file = provision.state_path(region, account_id)
+        if os.path.exists(state_file):
+            os.remove(state_file)
 
 # delete agent by name
 def delete_agent_kb(region, account_id):
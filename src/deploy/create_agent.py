@@ -1,8 +1,10 @@
 import boto3
-import time
 import zipfile
 from io import BytesIO
-import json 
+from botocore.exceptions import ClientError
+from create_kb import attach_policies, create_policy, create_role, find_by_name, file_digest
+from provision import Step
+from waiters import error_code, until_propagated, wait_for_agent, wait_for_agent_alias, wait_for_function
 
 
 # getting boto3 clients for required AWS services
@@ -13,126 +15,255 @@ lambda_client = boto3.client('lambda')
 bedrock_agent_client = boto3.client('bedrock-agent')
 bedrock_agent_runtime_client = boto3.client('bedrock-agent-runtime')
 agent_name = "virtual-assistant-agent"
+agent_role_name = f'AmazonBedrockExecutionRoleForAgents_va'
+lambda_code_path = "lambda_function.py"
+agent_model = "anthropic.claude-3-haiku-20240307-v1:0"
+agent_instruction = """You are an expert customer service agent helping faculty and students to resolve their queries like accessing the grades, eligibility, login issues, powerschool access issues. You can also guide users with navigation and other assistance on their portal. If the user request for a password reset, ask for email address, name and ID which are required information before fulfilling the <user-request>, once you have all the required information, you can reset the password and provide temporary password to the user"""
+
+
+def agent_steps(region, account_id):
+    # The agent as provisioning steps (see provision.py). Requires the
+    # "knowledge_base" and "kb_bucket" results of create_kb.knowledge_base_steps.
+    # The agent role and its policies, the Lambda role and the Lambda package
+    # are independent; everything is attached to the agent before it is
+    # prepared, and the alias is created last. Like the knowledge base steps,
+    # each one creates its resource or updates the existing one.
+    suffix = f"{region}-{account_id}"
+    bucket_name = f'{agent_name}-{suffix}'
+    schema_key = f'{agent_name}-schema.json'
+    schema_arn = f'arn:aws:s3:::{bucket_name}/{schema_key}'
+    lambda_role_name = f'{agent_name}-lambda-role-{suffix}'
+    lambda_name = f'{agent_name}-{suffix}'
 
+    va_agent_bedrock_allow_policy_statement = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Sid": "AmazonBedrockAgentBedrockFoundationModelPolicy",
+                "Effect": "Allow",
+                "Action": "bedrock:InvokeModel",
+                "Resource": [
+                    f"arn:aws:bedrock:{region}::foundation-model/*"
+                ]
+            }
+        ]
+    }
+    bedrock_agent_s3_allow_policy_statement = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Sid": "AllowAgentAccessOpenAPISchema",
+                "Effect": "Allow",
+                "Action": ["s3:GetObject"],
+                "Resource": [
+                    schema_arn
+                ]
+            }
+        ]
+    }
 
-def create_agent(region, account_id, kb_arn, kb_id):
-
-    #create all the required policies and roles
-    va_agent_role_arn = create_agent_role(region, account_id, kb_arn)
-    #va_agent_role_arn = 'arn:aws:iam::722665529886:role/AmazonBedrockExecutionRoleForAgents_va'
-    #print(va_agent_role_arn)
-
-    # Create Agent
-    agent_instruction = """You are an expert customer service agent helping faculty and students to resolve their queries like accessing the grades, eligibility, login issues, powerschool access issues. You can also guide users with navigation and other assistance on their portal. If the user request for a password reset, ask for email address, name and ID which are required information before fulfilling the <user-request>, once you have all the required information, you can reset the password and provide temporary password to the user"""
-
-    va_agent_obj = bedrock_agent_client.create_agent(
+    def kb_retrieval_policy_statement(knowledge_base_arn):
+        return {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Action": [
+                        "bedrock:Retrieve"
+                    ],
+                    "Resource": [
+                        knowledge_base_arn
+                    ]
+                }
+            ]
+        }
+    agent_policies = ("agent_bedrock_policy", "agent_s3_policy", "agent_kb_policy")
+    agent_bedrock_policy_name = f"va-bedrock-allow-{suffix}"
+    agent_s3_policy_name = f"va-s3-allow-{suffix}"
+    agent_kb_policy_name = f"va-kb-allow-{suffix}"
+
+    return [
+        Step("agent_bedrock_policy", lambda r: create_policy(
+            agent_bedrock_policy_name, va_agent_bedrock_allow_policy_statement, account_id),
+             (), config=[agent_bedrock_policy_name, va_agent_bedrock_allow_policy_statement]),
+        Step("agent_s3_policy", lambda r: create_policy(
+            agent_s3_policy_name, bedrock_agent_s3_allow_policy_statement, account_id,
+            description=f"Policy to allow invoke Lambda that was provisioned for it."),
+             (), config=[agent_s3_policy_name, bedrock_agent_s3_allow_policy_statement]),
+        Step("agent_kb_policy", lambda r: create_policy(
+            agent_kb_policy_name, kb_retrieval_policy_statement(r["knowledge_base"]["knowledgeBaseArn"]), account_id,
+            description=f"Policy to allow agent to retrieve documents from knowledge base."),
+             ("knowledge_base",), config=[agent_kb_policy_name]),
+        Step("agent_role", lambda r: create_agent_role(), (), config=[agent_role_name]),
+        Step("agent_role_policies", lambda r: attach_policies(agent_role_name, [r[p] for p in agent_policies]),
+             ("agent_role",) + agent_policies),
+        Step("agent", lambda r: create_agent(r["agent_role"]), ("agent_role",),
+             config=[agent_name, agent_model, agent_instruction]),
+        Step("lambda_role", lambda r: create_lambda_role(lambda_role_name), (), config=[lambda_role_name]),
+        Step("lambda_package", lambda r: package_lambda(schema_key), (), config=None),
+        Step("lambda_function", lambda r: create_lambda_function(
+            lambda_name, r["lambda_role"], r["lambda_package"]), ("lambda_role", "lambda_package"),
+             config=[lambda_name]),
+        Step("lambda_permission", lambda r: allow_agent_invoke(
+            region, account_id, lambda_name, r["agent"]), ("agent", "lambda_function")),
+        Step("action_group", lambda r: create_action_group(
+            r["agent"], r["lambda_function"], bucket_name, schema_key), ("agent", "lambda_function", "kb_bucket"),
+             config=[bucket_name, schema_key, file_digest(f'../documents/{schema_key}')]),
+        Step("agent_knowledge_base", lambda r: associate_knowledge_base(
+            r["agent"], r["knowledge_base"]["knowledgeBaseId"]), ("agent", "knowledge_base")),
+        Step("agent_prepared", lambda r: prepare_agent(r["agent"]),
+             ("agent_role_policies", "lambda_permission", "action_group", "agent_knowledge_base")),
+        Step("agent_alias", lambda r: create_alias(r["agent"]), ("agent_prepared",)),
+    ]
+
+
+def create_agent(va_agent_role_arn):
+    agent_args = dict(
         agentName=agent_name,
         agentResourceRoleArn=va_agent_role_arn,
         description="Virtual assistant agent with ability to reset the password.",
         idleSessionTTLInSeconds=1800,
-        foundationModel="anthropic.claude-3-haiku-20240307-v1:0",
+        foundationModel=agent_model,
         instruction=agent_instruction,
     )
-    print("Agent created successfully")
-    #print(va_agent_obj)
+    existing = find_by_name(bedrock_agent_client, "list_agents", "agentSummaries", "agentName", agent_name)
+    if existing:
+        va_agent_obj = until_propagated("Agent", lambda: bedrock_agent_client.update_agent(
+            agentId=existing["agentId"], **agent_args), va_agent_role_arn)
+    else:
+        # Create Agent
+        va_agent_obj = until_propagated("Agent", lambda: bedrock_agent_client.create_agent(**agent_args),
+                                        va_agent_role_arn)
     va_agent_id = va_agent_obj['agent']['agentId']
-    create_action_group(region, account_id, va_agent_id, kb_id)
+    # make sure the agent is created & in available state
+    wait_for_agent(bedrock_agent_client, va_agent_id)
+    print("Agent created successfully")
+    return va_agent_id
+
 
+def prepare_agent(va_agent_id):
     #prepare agent
     bedrock_agent_client.prepare_agent(
         agentId=va_agent_id
     )
-    # nosemgrep
-    time.sleep(25)
-    #create alias once agent is prepared
-    create_alias(va_agent_id)
+    return wait_for_agent(bedrock_agent_client, va_agent_id, ready=("PREPARED",))
 
-    print("Agent prepared and new alias created")
-    return va_agent_id
 
 def create_alias(va_agent_id):
-    #create alias
+    #create alias once agent is prepared
     alias_name = "latest"
     alias_description = "Alias for latest version of the agent"
-    alias_arn = bedrock_agent_client.create_agent_alias(
-        agentId=va_agent_id,
-        agentAliasName=alias_name,
-        description=alias_description
-    )
+    existing = find_by_name(bedrock_agent_client, "list_agent_aliases", "agentAliasSummaries", "agentAliasName",
+                            alias_name, agentId=va_agent_id)
+    if existing:
+        # points the alias at a new version of the prepared draft
+        alias_arn = bedrock_agent_client.update_agent_alias(
+            agentId=va_agent_id,
+            agentAliasId=existing["agentAliasId"],
+            agentAliasName=alias_name,
+            description=alias_description
+        )
+    else:
+        alias_arn = bedrock_agent_client.create_agent_alias(
+            agentId=va_agent_id,
+            agentAliasName=alias_name,
+            description=alias_description
+        )
     #print(alias_arn)
-    return alias_arn
-    
-
-
-
-
-def create_action_group(region, account_id, va_agent_id, kb_id):
-    suffix = f"{region}-{account_id}"
-    lambda_role_name = f'{agent_name}-lambda-role-{suffix}'
-    lambda_code_path = "lambda_function.py"
-    lambda_name = f'{agent_name}-{suffix}'
-    bucket_name = f'{agent_name}-{suffix}'
-    schema_key = f'{agent_name}-schema.json'
-
-    try:
-        print("Creating Agent action group")
-        # Pause to make sure agent is created & in available state
-        # nosemgrep
-        time.sleep(15)
-        assume_role_policy_document = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Action": "bedrock:InvokeModel",
-                    "Principal": {
-                        "Service": "lambda.amazonaws.com"
-                    },
-                    "Action": "sts:AssumeRole"
-                }
-            ]
-        }
+    wait_for_agent_alias(bedrock_agent_client, va_agent_id, alias_arn['agentAlias']['agentAliasId'])
+    print("Agent prepared and new alias created")
+    return alias_arn['agentAlias']['agentAliasId']
 
-        assume_role_policy_document_json = json.dumps(assume_role_policy_document)
 
-        lambda_iam_role = iam_client.create_role(
-            RoleName=lambda_role_name,
-            AssumeRolePolicyDocument=assume_role_policy_document_json
-        )
-
-        # Pause to make sure role is created
-        # nosemgrep
-        time.sleep(10)
-    except:
-        lambda_iam_role = iam_client.get_role(RoleName=lambda_role_name)
+def create_lambda_role(lambda_role_name):
+    print("Creating Lambda role for the action group")
+    assume_role_policy_document = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Action": "bedrock:InvokeModel",
+                "Principal": {
+                    "Service": "lambda.amazonaws.com"
+                },
+                "Action": "sts:AssumeRole"
+            }
+        ]
+    }
 
+    lambda_role_arn = create_role(lambda_role_name, assume_role_policy_document)
     iam_client.attach_role_policy(
         RoleName=lambda_role_name,
         PolicyArn='arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'
     )
+    return lambda_role_arn
+
+
+def package_lambda(schema_key):
     # package lambda function for the agent action group
     # Package up the lambda function code
     s = BytesIO()
     z = zipfile.ZipFile(s, 'w')
     z.write(lambda_code_path)
+    # the function routes and validates calls with the same API schema the agent gets
+    z.write(f'../documents/{schema_key}', schema_key)
     z.close()
-    zip_content = s.getvalue()
+    return s.getvalue()
 
-    # Create Lambda Function
-    lambda_function = lambda_client.create_function(
+
+# how Lambda reports a role it cannot assume (yet), without naming it
+LAMBDA_ROLE_MESSAGES = ("role defined for the function cannot be assumed",)
+
+
+def create_lambda_function(lambda_name, lambda_role_arn, zip_content):
+    function_config = dict(
         FunctionName=lambda_name,
         Runtime='python3.12',
         Timeout=180,
-        Role=lambda_iam_role['Role']['Arn'],
-        Code={'ZipFile': zip_content},
+        Role=lambda_role_arn,
         Handler='lambda_function.lambda_handler'
     )
+    try:
+        # Create Lambda Function, once Lambda can assume the new role
+        lambda_function = until_propagated("Lambda function", lambda: lambda_client.create_function(
+            Code={'ZipFile': zip_content}, **function_config), lambda_role_arn, LAMBDA_ROLE_MESSAGES)
+    except ClientError as e:
+        if error_code(e) != "ResourceConflictException":
+            raise
+        print("Updating Lambda function")
+        lambda_client.update_function_code(FunctionName=lambda_name, ZipFile=zip_content)
+        wait_for_function(lambda_client, lambda_name)
+        lambda_function = until_propagated("Lambda function", lambda: lambda_client.update_function_configuration(
+            **function_config), lambda_role_arn, LAMBDA_ROLE_MESSAGES)
+    wait_for_function(lambda_client, lambda_name)
+    return lambda_function['FunctionArn']
+
+
+def allow_agent_invoke(region, account_id, lambda_name, va_agent_id):
+    # Add required permissions to Lambda, replacing the statement of an earlier deploy
+    permission = dict(
+        FunctionName=lambda_name,
+        StatementId='allow_bedrock',
+        Action='lambda:InvokeFunction',
+        Principal='bedrock.amazonaws.com',
+        SourceArn=f"arn:aws:bedrock:{region}:{account_id}:agent/{va_agent_id}",
+    )
+    try:
+        lambda_client.add_permission(**permission)
+    except ClientError as e:
+        if error_code(e) != "ResourceConflictException":
+            raise
+        lambda_client.remove_permission(FunctionName=lambda_name, StatementId='allow_bedrock')
+        lambda_client.add_permission(**permission)
+    return permission['SourceArn']
 
-    agent_action_group_response = bedrock_agent_client.create_agent_action_group(
+
+def create_action_group(va_agent_id, lambda_function_arn, bucket_name, schema_key):
+    action_group_args = dict(
         agentId=va_agent_id,
         agentVersion='DRAFT',
         actionGroupExecutor={
-            'lambda': lambda_function['FunctionArn']
+            'lambda': lambda_function_arn
         },
         actionGroupName='PasswordResetActionGroup',
         apiSchema={
@@ -143,106 +274,37 @@ def create_action_group(region, account_id, va_agent_id, kb_id):
         },
         description='Actions for password reset'
     )
-
-    # Add required permissions to Lambda
-    lm_response = lambda_client.add_permission(
-        FunctionName=lambda_name,
-        StatementId='allow_bedrock',
-        Action='lambda:InvokeFunction',
-        Principal='bedrock.amazonaws.com',
-        SourceArn=f"arn:aws:bedrock:{region}:{account_id}:agent/{va_agent_id}",
-    )
-
+    existing = find_by_name(bedrock_agent_client, "list_agent_action_groups", "actionGroupSummaries",
+                            "actionGroupName", action_group_args['actionGroupName'],
+                            agentId=va_agent_id, agentVersion='DRAFT')
+    if existing:
+        agent_action_group_response = bedrock_agent_client.update_agent_action_group(
+            actionGroupId=existing['actionGroupId'], **action_group_args)
+    else:
+        agent_action_group_response = bedrock_agent_client.create_agent_action_group(**action_group_args)
+    return agent_action_group_response['agentActionGroup']['actionGroupId']
+
+
+def associate_knowledge_base(va_agent_id, kb_id):
     # Add KB to agent
-    agent_kb_description = bedrock_agent_client.associate_agent_knowledge_base(
+    association = dict(
         agentId=va_agent_id,
         agentVersion='DRAFT',
         description=f'Answer queries from prompts. Double check each source you reference from the CMS help guide to provide a good response. Ask if anything else is needed.',
-        knowledgeBaseId=kb_id 
+        knowledgeBaseId=kb_id
     )
+    try:
+        bedrock_agent_client.associate_agent_knowledge_base(**association)
+    except ClientError as e:
+        if error_code(e) != "ConflictException":
+            raise
+        bedrock_agent_client.update_agent_knowledge_base(**association)
+    return kb_id
 
 
-def create_agent_role(region, account_id,knowledge_base_arn ):
-
-    suffix = f"{region}-{account_id}"
-    agent_name = "virtual-assistant-agent"
-    bucket_name = f'{agent_name}-{suffix}'
-    bucket_name = f'{agent_name}-{suffix}'
-    schema_key = f'{agent_name}-schema.json'
-    schema_arn = f'arn:aws:s3:::{bucket_name}/{schema_key}'
-    
-    va_agent_bedrock_allow_policy_name = f"va-bedrock-allow-{suffix}"
-    va_agent_s3_allow_policy_name = f"va-s3-allow-{suffix}"
-    va_agent_kb_allow_policy_name = f"va-kb-allow-{suffix}"
-    
-    agent_role_name = f'AmazonBedrockExecutionRoleForAgents_va'
-   
-    va_agent_bedrock_allow_policy_statement = {
-        "Version": "2012-10-17",
-        "Statement": [
-            {
-                "Sid": "AmazonBedrockAgentBedrockFoundationModelPolicy",
-                "Effect": "Allow",
-                "Action": "bedrock:InvokeModel",
-                "Resource": [
-                    f"arn:aws:bedrock:{region}::foundation-model/*"
-                ]
-            }
-        ]
-    }
-
-    bedrock_policy_json = json.dumps(va_agent_bedrock_allow_policy_statement)
-
-    va_agent_bedrock_policy = iam_client.create_policy(
-        PolicyName=va_agent_bedrock_allow_policy_name,
-        PolicyDocument=bedrock_policy_json
-    )
-
-    bedrock_agent_s3_allow_policy_statement = {
-        "Version": "2012-10-17",
-        "Statement": [
-            {
-                "Sid": "AllowAgentAccessOpenAPISchema",
-                "Effect": "Allow",
-                "Action": ["s3:GetObject"],
-                "Resource": [
-                    schema_arn
-                ]
-            }
-        ]
-    }
-
-
-    bedrock_agent_s3_json = json.dumps(bedrock_agent_s3_allow_policy_statement)
-    va_agent_s3_schema_policy = iam_client.create_policy(
-        PolicyName=va_agent_s3_allow_policy_name,
-        Description=f"Policy to allow invoke Lambda that was provisioned for it.",
-        PolicyDocument=bedrock_agent_s3_json
-    )
-
-    va_agent_kb_retrival_policy_statement = {
-        "Version": "2012-10-17",
-        "Statement": [
-            {
-                "Effect": "Allow",
-                "Action": [
-                    "bedrock:Retrieve"
-                ],
-                "Resource": [
-                    knowledge_base_arn
-                ]
-            }
-        ]
-    }
-    va_bedrock_agent_kb_json = json.dumps(va_agent_kb_retrival_policy_statement)
-
-    va_agent_kb_schema_policy = iam_client.create_policy(
-        PolicyName=va_agent_kb_allow_policy_name,
-        Description=f"Policy to allow agent to retrieve documents from knowledge base.",
-        PolicyDocument=va_bedrock_agent_kb_json
-    )
-
-    # Create IAM Role for the agent and attach IAM policies
+def create_agent_role():
+    # Create IAM Role for the agent; its policies are attached by the
+    # agent_role_policies step
     assume_role_policy_document = {
         "Version": "2012-10-17",
         "Statement": [{
@@ -254,29 +316,4 @@ def create_agent_role(region, account_id,knowledge_base_arn ):
         }]
     }
 
-    assume_role_policy_document_json = json.dumps(assume_role_policy_document)
-    va_agent_role = iam_client.create_role(
-        RoleName=agent_role_name,
-        AssumeRolePolicyDocument=assume_role_policy_document_json
-    )
-    # nosemgrep
-    time.sleep(15)
-
-    iam_client.attach_role_policy(
-        RoleName=agent_role_name,
-        PolicyArn=va_agent_bedrock_policy['Policy']['Arn']
-    )
-
-    iam_client.attach_role_policy(
-        RoleName=agent_role_name,
-        PolicyArn=va_agent_s3_schema_policy['Policy']['Arn']
-    )
-
-    iam_client.attach_role_policy(
-        RoleName=agent_role_name,
-        PolicyArn=va_agent_kb_schema_policy['Policy']['Arn']
-    )
-
-    
-
-    return va_agent_role['Role']['Arn']
\ No newline at end of file
+    return create_role(agent_role_name, assume_role_policy_document)
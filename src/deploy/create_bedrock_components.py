@@ -9,9 +9,9 @@ import uuid
 import pprint
 import os
 #from requests_aws4auth import AWS4Auth
-from create_kb import create_knowledgebase
-from create_agent import create_agent
-
+from create_kb import knowledge_base_steps
+from create_agent import agent_steps
+import provision
 
 # getting boto3 clients for required AWS services
 sts_client = boto3.client('sts')
@@ -37,17 +37,15 @@ def main():
     account_id = sts_client.get_caller_identity()["Account"]
     
     
-    # Create Knowledge base
-    print("Creating Knowledge base...")
-    kb_arn = create_knowledgebase(region, account_id)
-    #fetch the string after / in knowledge_base_arn and assign it to knowledge_base_id variable.
-    kb_id = kb_arn.split('/')[-1]
-    
-    
-    # If you want to stop here and start using the KB for other purposes you can do so. 
-    # We will create Agent in the next step and will use the KB created
-    print("Creating Agent...")
-    va_agent_id = create_agent(region, account_id, kb_arn, kb_id)
+    # Knowledge base and agent as one graph of steps: independent roles,
+    # policies and packages are created in parallel, and each step starts as
+    # soon as the ones it needs are done (see provision.py). Steps that
+    # finished in an earlier run with the same config are skipped.
+    print("Creating Knowledge base and Agent...")
+    state = provision.StateManifest(provision.state_path(region, account_id))
+    results = provision.run(knowledge_base_steps(region, account_id) + agent_steps(region, account_id), state=state)
+    print(f"Knowledge base: {results['knowledge_base']['knowledgeBaseId']}")
+    print(f"Agent: {results['agent']}, alias: {results['agent_alias']}")
     print("Setup Complete!")
 
 if __name__ == "__main__":
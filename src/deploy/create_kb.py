@@ -1,9 +1,12 @@
 import boto3
-import time
+import hashlib
 from io import BytesIO
 import json
 import os
 import requests
+from botocore.exceptions import ClientError
+from provision import Step
+from waiters import error_code, until_propagated, wait_for_data_source, wait_for_ingestion_job, wait_for_knowledge_base, wait_for_policy, wait_for_role
 
 # getting boto3 clients for required AWS services
 sts_client = boto3.client('sts')
@@ -15,9 +18,28 @@ bedrock_agent_client = boto3.client('bedrock-agent')
 bedrock_agent_runtime_client = boto3.client('bedrock-agent-runtime')
 kb_key = f'bedrock-ug.pdf'
 upload_file_url = f'https://docs.aws.amazon.com/pdfs/bedrock/latest/userguide/bedrock-ug.pdf'
-
-def create_knowledgebase(region, account_id ):
-    
+kb_textField = 'textfield'
+kb_pinecone_conn='https://datafield-wwgx1at.svc.aped-4627-b74a.pinecone.io'
+pinecone_key_sm_name = 'pinekey-6j3iCT'
+kb_files_path = '../documents/'
+s3_folder = f'kbdocuments'
+kb_role_name = f'BedrockExecutionRoleForKB_vakb'
+chunking_strategy_configuration = {
+    "chunkingStrategy": "FIXED_SIZE",
+    "fixedSizeChunkingConfiguration": {
+        "maxTokens": 512,
+        "overlapPercentage": 20
+    }
+}
+
+
+def knowledge_base_steps(region, account_id):
+    # The knowledge base as provisioning steps (see provision.py): the bucket,
+    # the three policies and the role are independent of each other, the KB
+    # needs the role with its policies, the data source needs the KB and the
+    # documents in the bucket. Every step creates its resource, or updates
+    # it when it exists from an earlier deploy; the config of each step is
+    # what a rerun compares to decide whether to run it again.
     suffix = f"{region}-{account_id}"
     agent_name = "virtual-assistant-agent"
     bucket_name = f'{agent_name}-{suffix}'
@@ -25,311 +47,348 @@ def create_knowledgebase(region, account_id ):
     bucket_arn = f"arn:aws:s3:::{bucket_name}"
     data_source_name = f'virtual-assistant-kb-docs-{suffix}'
     embedding_model_arn = f'arn:aws:bedrock:{region}::foundation-model/cohere.embed-english-v3' #amazon.titan-embed-text-v1
-    
-    
-
-
-    print(region, account_id)
-
-    kb_textField = 'textfield'
-    kb_pinecone_conn='https://datafield-wwgx1at.svc.aped-4627-b74a.pinecone.io'
-    pinecone_key_sm_arn=f'arn:aws:secretsmanager:{region}:{account_id}:secret:pinekey-6j3iCT'
-
-    try:
-        print("Creating KB role...")
-        # create required role for KB
-        kb_role_arn = create_kb_role(region, account_id, pinecone_key_sm_arn)
+    pinecone_key_sm_arn=f'arn:aws:secretsmanager:{region}:{account_id}:secret:{pinecone_key_sm_name}'
+    schema_key = f'{agent_name}-schema.json'
+    schema_file = f'{kb_files_path}/{schema_key}'
 
-        print("Creating Knowledge Base...")
-        #create knowledgebase with pinecone storage configuration
-        kb_obj = bedrock_agent_client.create_knowledge_base(
-            name=kb_name,
-            description='Virtual Assistant KB',
-            knowledgeBaseConfiguration={
-                'type': 'VECTOR',
-                'vectorKnowledgeBaseConfiguration': {
-                    'embeddingModelArn' : embedding_model_arn,
+    #create policy for knowledgebase to invoke the model
+    bedrock_kb_allow_fm_model_policy_statement = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Sid": "BedrockInvokeModelStatement",
+                "Effect": "Allow",
+                "Action": "bedrock:InvokeModel",
+                "Resource": [
+                    embedding_model_arn
+                ]
+            }
+        ]
+    }
+    #create policy for knowledgebase to access the secret manager
+    bedrock_kb_allow_secretmanager_policy_statement = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Sid": "BedrockAccessSecretManagerStatement",
+                "Effect": "Allow",
+                "Action": [
+                    "secretsmanager:GetSecretValue"
+                ],
+                "Resource": [
+                    pinecone_key_sm_arn
+                ]
+            }
+        ]
+    }
+    kb_s3_allow_policy_statement = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Sid": "AllowKBAccessDocuments",
+                "Effect": "Allow",
+                "Action": [
+                    "s3:GetObject",
+                    "s3:ListBucket"
+                ],
+                "Resource": [
+                    f"arn:aws:s3:::{bucket_name}/*",
+                    f"arn:aws:s3:::{bucket_name}"
+                ],
+                "Condition": {
+                    "StringEquals": {
+                        "aws:ResourceAccount": f"{account_id}"
+                    }
                 }
+            }
+        ]
+    }
+    kb_policies = ("kb_model_policy", "kb_secret_policy", "kb_s3_policy")
+    kb_model_policy_name = f"va-kb-bedrock-allow-model-{suffix}"
+    kb_secret_policy_name = f"va-kb-secretmanager-api-allow-{suffix}"
+    kb_s3_policy_name = f"va-kb-s3-allow-{suffix}"
+    # by content, so that a changed PDF uploads again and, through the data
+    # source that requires the bucket, runs a new ingestion job
+    documents = {f: file_digest(f'{kb_files_path}/{f}') for f in os.listdir(kb_files_path) if f.endswith(".pdf")}
+
+    return [
+        Step("kb_bucket", lambda r: create_kb_bucket(region, bucket_name, schema_file, schema_key),
+             (), config=[bucket_name, region, file_digest(schema_file), documents, upload_file_url, kb_key]),
+        Step("kb_model_policy", lambda r: create_policy(
+            kb_model_policy_name, bedrock_kb_allow_fm_model_policy_statement, account_id),
+             (), config=[kb_model_policy_name, bedrock_kb_allow_fm_model_policy_statement]),
+        Step("kb_secret_policy", lambda r: create_policy(
+            kb_secret_policy_name, bedrock_kb_allow_secretmanager_policy_statement, account_id),
+             (), config=[kb_secret_policy_name, bedrock_kb_allow_secretmanager_policy_statement]),
+        Step("kb_s3_policy", lambda r: create_policy(
+            kb_s3_policy_name, kb_s3_allow_policy_statement, account_id),
+             (), config=[kb_s3_policy_name, kb_s3_allow_policy_statement]),
+        Step("kb_role", lambda r: create_kb_role(), (), config=[kb_role_name]),
+        Step("kb_role_policies", lambda r: attach_policies(kb_role_name, [r[p] for p in kb_policies]),
+             ("kb_role",) + kb_policies),
+        Step("kb_secret_access", lambda r: allow_secret_access(pinecone_key_sm_arn, r["kb_role"]),
+             ("kb_role",), config=[pinecone_key_sm_arn]),
+        Step("knowledge_base", lambda r: create_knowledgebase(
+            kb_name, embedding_model_arn, pinecone_key_sm_arn, r["kb_role"]), ("kb_role_policies", "kb_secret_access"),
+             config=[kb_name, embedding_model_arn, kb_pinecone_conn, kb_textField]),
+        Step("kb_data_source", lambda r: create_data_source(
+            r["knowledge_base"]["knowledgeBaseId"], data_source_name, bucket_arn), ("knowledge_base", "kb_bucket"),
+             config=[data_source_name, kb_key, chunking_strategy_configuration]),
+        Step("kb_ingestion", lambda r: ingest_job(
+            r["kb_data_source"], r["knowledge_base"]["knowledgeBaseId"]), ("kb_data_source",)),
+    ]
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def find_by_name(client, operation, summaries_key, name_key, name, **kwargs):
+    # the summary of the named resource from a paginated list call, or None
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        for summary in page[summaries_key]:
+            if summary[name_key] == name:
+                return summary
+    return None
+
+
+def create_knowledgebase(kb_name, embedding_model_arn, pinecone_key_sm_arn, kb_role_arn):
+    #create knowledgebase with pinecone storage configuration
+    kb_args = dict(
+        name=kb_name,
+        description='Virtual Assistant KB',
+        knowledgeBaseConfiguration={
+            'type': 'VECTOR',
+            'vectorKnowledgeBaseConfiguration': {
+                'embeddingModelArn' : embedding_model_arn,
+            }
 
-            },
-            storageConfiguration={
-                'type': 'PINECONE',
-                'pineconeConfiguration': {
-                    'connectionString' : kb_pinecone_conn,
-                    'credentialsSecretArn': pinecone_key_sm_arn,
-                    'namespace': 'datafield',                    
-                    'fieldMapping': { 
-                        'metadataField': 'metadata',
-                        'textField': kb_textField
-                    },                    
-                }
-            },
-            roleArn=kb_role_arn,
+        },
+        storageConfiguration={
+            'type': 'PINECONE',
+            'pineconeConfiguration': {
+                'connectionString' : kb_pinecone_conn,
+                'credentialsSecretArn': pinecone_key_sm_arn,
+                'namespace': 'datafield',
+                'fieldMapping': {
+                    'metadataField': 'metadata',
+                    'textField': kb_textField
+                },
+            }
+        },
+        roleArn=kb_role_arn,
+    )
+    existing = find_by_name(bedrock_agent_client, "list_knowledge_bases", "knowledgeBaseSummaries", "name", kb_name)
+    # retried until Bedrock can assume the new role
+    if existing:
+        print("Updating Knowledge Base...")
+        kb_obj = until_propagated("Knowledge base", lambda: bedrock_agent_client.update_knowledge_base(
+            knowledgeBaseId=existing["knowledgeBaseId"], **kb_args), kb_role_arn)
+    else:
+        print("Creating Knowledge Base...")
+        kb_obj = until_propagated("Knowledge base", lambda: bedrock_agent_client.create_knowledge_base(
             tags= {
                 'Name': kb_name
-            }            
-        )
-        # nosemgrep
-        time.sleep(20)
-
-        s3_configuration = {
-        'bucketArn': bucket_arn,
-        'inclusionPrefixes': [kb_key]  
-        }
-
-        # Define the data source configuration
-        data_source_configuration = {
-            's3Configuration': s3_configuration,
-            'type': 'S3'
-        }
-
-        knowledge_base_id = kb_obj["knowledgeBase"]["knowledgeBaseId"]
-        knowledge_base_arn = kb_obj["knowledgeBase"]["knowledgeBaseArn"]
-
-        chunking_strategy_configuration = {
-            "chunkingStrategy": "FIXED_SIZE",
-            "fixedSizeChunkingConfiguration": {
-                "maxTokens": 512,
-                "overlapPercentage": 20
-            }
+            },
+            **kb_args), kb_role_arn)
+    wait_for_knowledge_base(bedrock_agent_client, kb_obj["knowledgeBase"]["knowledgeBaseId"])
+    return {
+        "knowledgeBaseId": kb_obj["knowledgeBase"]["knowledgeBaseId"],
+        "knowledgeBaseArn": kb_obj["knowledgeBase"]["knowledgeBaseArn"],
+    }
+
+
+def create_data_source(knowledge_base_id, data_source_name, bucket_arn):
+    s3_configuration = {
+    'bucketArn': bucket_arn,
+    'inclusionPrefixes': [kb_key]
+    }
+
+    # Define the data source configuration
+    data_source_configuration = {
+        's3Configuration': s3_configuration,
+        'type': 'S3'
+    }
+
+    data_source_args = dict(
+        knowledgeBaseId=knowledge_base_id,
+        name=data_source_name,
+        description='DataSource for the virtual agent document source',
+        dataSourceConfiguration=data_source_configuration,
+        vectorIngestionConfiguration = {
+            "chunkingConfiguration": chunking_strategy_configuration
         }
-
+    )
+    existing = find_by_name(bedrock_agent_client, "list_data_sources", "dataSourceSummaries", "name",
+                            data_source_name, knowledgeBaseId=knowledge_base_id)
+    if existing:
+        data_source_response = bedrock_agent_client.update_data_source(
+            dataSourceId=existing["dataSourceId"], **data_source_args)
+    else:
         # Create the data source
-        try:
-            # ensure that the KB is created and available
-            # nosemgrep
-            #time.sleep(15)
-            data_source_response = bedrock_agent_client.create_data_source(
-                knowledgeBaseId=knowledge_base_id,
-                name=data_source_name,
-                description='DataSource for the virtual agent document source',
-                dataSourceConfiguration=data_source_configuration,
-                vectorIngestionConfiguration = {
-                    "chunkingConfiguration": chunking_strategy_configuration
-                }
-            )
-            # nosemgrep
-            time.sleep(15)
-            print("Ingest Job")
-            ingest_job(data_source_response, knowledge_base_id)
-             
-            print("KnowledgeBase created successfully")
-        except Exception as e:
-            print(f"Error occurred: {e}")
-
-    except Exception as e:
-        print(f"Error occurred while creating KB: {e}")
-
-    return knowledge_base_arn
-    
-#This Job will load the S3 document to vector DB - Pinecone in this case            
-def ingest_job(data_source_response, knowledge_base_id):
-    # Start an ingestion job
+        data_source_response = bedrock_agent_client.create_data_source(**data_source_args)
     data_source_id = data_source_response["dataSource"]["dataSourceId"]
+    wait_for_data_source(bedrock_agent_client, knowledge_base_id, data_source_id)
+    return data_source_id
+
+#This Job will load the S3 document to vector DB - Pinecone in this case
+def ingest_job(data_source_id, knowledge_base_id):
+    # Start an ingestion job
+    print("Ingest Job")
     start_job_response = bedrock_agent_client.start_ingestion_job(
-        knowledgeBaseId=knowledge_base_id, 
+        knowledgeBaseId=knowledge_base_id,
         dataSourceId=data_source_id
     )
+    ingestion_job_id = start_job_response["ingestionJob"]["ingestionJobId"]
+    # the step only counts as done once the documents are in the index
+    wait_for_ingestion_job(bedrock_agent_client, knowledge_base_id, data_source_id, ingestion_job_id)
+    print("KnowledgeBase created successfully")
+    return ingestion_job_id
 
 
-
-def create_kb_role(region, account_id, pinecone_key_sm_arn):
-
-    suffix = f"{region}-{account_id}"
-    agent_name = "virtual-assistant-agent"
-    bucket_name = f'{agent_name}-{suffix}'
-    embedding_model_arn = f'arn:aws:bedrock:us-east-1::foundation-model/cohere.embed-english-v3' #amazon.titan-embed-text-v1
-    kb_files_path = '../documents/'
-    schema_key = f'{agent_name}-schema.json'
-    schema_file = f'{kb_files_path}/{schema_key}'
-   
-    embedding_model_arn = f'arn:aws:bedrock:us-east-1::foundation-model/cohere.embed-english-v3' #amazon.titan-embed-text-v1
-    
-    s3_folder = f'kbdocuments'
-    kb_role_name = f'BedrockExecutionRoleForKB_vakb'
-    kb_bedrock_allow_model_policy_name = f"va-kb-bedrock-allow-model-{suffix}"
-    kb_secretmanager_api_policy_name = f"va-kb-secretmanager-api-allow-{suffix}"
-    kb_s3_allow_policy_name = f"va-kb-s3-allow-{suffix}"
-    create_bucket = True
-    create_role = True
-
-    if create_bucket:
-        #create S3 bucket
-        res = s3_client.create_bucket(Bucket=bucket_name)
-
-        if res['ResponseMetadata']['HTTPStatusCode'] == 200:
-            #upload schema to S3 bucket
-            s3_client.upload_file(schema_file, bucket_name, schema_key)
-            #upload kb document to S3
-            for f in os.listdir(kb_files_path):
-                if f.endswith(".pdf"):
-                        #Sample PDF. Using Amazon Bedrock user guide here 
-                    
-                    
-                    # download the file from a url and upload to S3
-                    r = requests.get(url)
-                    file_content = BytesIO(r.content)
-                    s3_client.upload_fileobj(file_content, bucket_name, s3_folder+'/'+kb_key)
-                    
-        else:
-            print("Error creating S3 bucket")
-    else:
-        print("Bucket exists, skipping S3 bucket creation")
-    
-    if create_role:
-        print("Creating required policies for KB role...")
-        #create policy for knowledgebase to invoke the model
-        bedrock_kb_allow_fm_model_policy_statement = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Sid": "BedrockInvokeModelStatement",
-                    "Effect": "Allow",
-                    "Action": "bedrock:InvokeModel",
-                    "Resource": [
-                        embedding_model_arn
-                    ]
-                }
-            ]
-        }
-
-        kb_bedrock_model_policy_json = json.dumps(bedrock_kb_allow_fm_model_policy_statement)
-    # POLICY 1
-        kb_bedrock_model_access_policy = iam_client.create_policy(
-            PolicyName=kb_bedrock_allow_model_policy_name,
-            PolicyDocument=kb_bedrock_model_policy_json
-        )
-        #create policy for knowledgebase to access the secret manager
-        bedrock_kb_allow_secretmanager_policy_statement = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Sid": "BedrockAccessSecretManagerStatement",
-                    "Effect": "Allow",                    
-                    "Action": [
-                        "secretsmanager:GetSecretValue"
-                    ],
-                    "Resource": [
-                        pinecone_key_sm_arn
-                    ]
-                }
-            ]
-        }
-        kb_bedrock_sm_policy_json = json.dumps(bedrock_kb_allow_secretmanager_policy_statement)
-    #POLICY 2
-        kb_bedrock_sm_access_policy = iam_client.create_policy(
-            PolicyName=kb_secretmanager_api_policy_name,
-            PolicyDocument=kb_bedrock_sm_policy_json
-        )
-
-        kb_s3_allow_policy_statement = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Sid": "AllowKBAccessDocuments",
-                    "Effect": "Allow",
-                    "Action": [
-                        "s3:GetObject",
-                        "s3:ListBucket"
-                    ],
-                    "Resource": [
-                        f"arn:aws:s3:::{bucket_name}/*",
-                        f"arn:aws:s3:::{bucket_name}"
-                    ],
-                    "Condition": {
-                        "StringEquals": {
-                            "aws:ResourceAccount": f"{account_id}"
-                        }
-                    }
-                }
-            ]
-        }
-
-
-        kb_s3_policy_json = json.dumps(kb_s3_allow_policy_statement)
-
-    #POLICY 3
-        kb_s3_access_policy = iam_client.create_policy(
-            PolicyName=kb_s3_allow_policy_name,
-            PolicyDocument=kb_s3_policy_json
+def create_kb_bucket(region, bucket_name, schema_file, schema_key):
+    #create S3 bucket, outside us-east-1 it has to be told its region
+    location = {} if region == "us-east-1" else {"CreateBucketConfiguration": {"LocationConstraint": region}}
+    try:
+        s3_client.create_bucket(Bucket=bucket_name, **location)
+    except ClientError as e:
+        if error_code(e) != "BucketAlreadyOwnedByYou":
+            raise
+        print("Bucket exists, uploading the documents again")
+
+    #upload schema to S3 bucket
+    s3_client.upload_file(schema_file, bucket_name, schema_key)
+    keys = [schema_key]
+    #upload kb document to S3
+    for f in os.listdir(kb_files_path):
+        if f.endswith(".pdf"):
+                #Sample PDF. Using Amazon Bedrock user guide here
+
+
+            # download the file from a url and upload to S3
+            r = requests.get(upload_file_url)
+            file_content = BytesIO(r.content)
+            s3_client.upload_fileobj(file_content, bucket_name, s3_folder+'/'+kb_key)
+            keys.append(s3_folder+'/'+kb_key)
+    # recorded in the deploy state for reference; whether a rerun uploads
+    # again is decided by the document digests in the step's config
+    return {
+        "name": bucket_name,
+        "objects": {key: s3_client.head_object(Bucket=bucket_name, Key=key)["ETag"] for key in keys},
+    }
+
+
+def create_policy(policy_name, statement, account_id, description=None):
+    # creates the IAM policy, or updates it when it exists, and returns its
+    # ARN once IAM returns it
+    policy_arn = f"arn:aws:iam::{account_id}:policy/{policy_name}"
+    kwargs = {"Description": description} if description else {}
+    try:
+        iam_client.create_policy(
+            PolicyName=policy_name,
+            PolicyDocument=json.dumps(statement),
+            **kwargs
         )
-        # nosemgrep
-        time.sleep(10)
-    #create assume role policy for knowledgebase
-        bedrock_kb_assume_role_policy_statement = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Principal": {
-                        "Service": "bedrock.amazonaws.com"
-                    },
-                    "Action": "sts:AssumeRole"
-                }
-            ]
-        }
-
-        kb_bedrock_assume_role_policy_json = json.dumps(bedrock_kb_assume_role_policy_statement)
-
-        #create role for knowledgebase
-        bedrock_kb_role = iam_client.create_role(
-            RoleName=kb_role_name,
-            AssumeRolePolicyDocument=kb_bedrock_assume_role_policy_json
+    except ClientError as e:
+        if error_code(e) != "EntityAlreadyExists":
+            raise
+        update_policy(policy_arn, statement)
+    wait_for_policy(iam_client, policy_arn)
+    return policy_arn
+
+
+def update_policy(policy_arn, statement):
+    # a new default version when the document changed
+    policy = iam_client.get_policy(PolicyArn=policy_arn)["Policy"]
+    current = iam_client.get_policy_version(PolicyArn=policy_arn, VersionId=policy["DefaultVersionId"])
+    if current["PolicyVersion"]["Document"] == statement:
+        return
+    print(f"Updating policy {policy_arn}")
+    # IAM keeps five versions of a policy; drop the oldest one to make room
+    versions = iam_client.list_policy_versions(PolicyArn=policy_arn)["Versions"]
+    old = sorted((v for v in versions if not v["IsDefaultVersion"]), key=lambda v: v["CreateDate"])
+    if len(versions) >= 5 and old:
+        iam_client.delete_policy_version(PolicyArn=policy_arn, VersionId=old[0]["VersionId"])
+    iam_client.create_policy_version(PolicyArn=policy_arn, PolicyDocument=json.dumps(statement), SetAsDefault=True)
+
+
+def create_role(role_name, trust_statement):
+    # creates the IAM role, or updates who may assume it when it exists, and
+    # returns its ARN once IAM returns it
+    trust_policy_json = json.dumps(trust_statement)
+    try:
+        role = iam_client.create_role(
+            RoleName=role_name,
+            AssumeRolePolicyDocument=trust_policy_json
         )
-
-        #wait for role to be created
-        # nosemgrep
-        time.sleep(20)
-
-        #print("Attach policy 1...")
+    except ClientError as e:
+        if error_code(e) != "EntityAlreadyExists":
+            raise
+        iam_client.update_assume_role_policy(RoleName=role_name, PolicyDocument=trust_policy_json)
+        role = iam_client.get_role(RoleName=role_name)
+    wait_for_role(iam_client, role_name)
+    return role["Role"]["Arn"]
+
+
+def attach_policies(role_name, policy_arns):
+    # attaching an attached policy again is a no-op
+    for policy_arn in policy_arns:
         iam_client.attach_role_policy(
-            RoleName=kb_role_name,
-            PolicyArn=kb_bedrock_model_access_policy['Policy']['Arn']
+            RoleName=role_name,
+            PolicyArn=policy_arn
         )
+    return policy_arns
 
-        #print("Attach policy 2...")
-        iam_client.attach_role_policy(
-            RoleName=kb_role_name,
-            PolicyArn=kb_bedrock_sm_access_policy['Policy']['Arn']
-        )
 
-        #print("Attach policy 3...")
-        iam_client.attach_role_policy(
-            RoleName=kb_role_name,
-            PolicyArn=kb_s3_access_policy['Policy']['Arn']
-        )   
-        # nosemgrep
-        time.sleep(10)
-        kb_role_arn = bedrock_kb_role["Role"]["Arn"]
-
-        #attach this role as resource policy on secret
-        
-        secret_policy_stmt = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {                    
-                    "Effect": "Allow",
-                    "Principal": {
-                        "AWS": kb_role_arn
-                    },
-                    "Action": [
-                        "secretsmanager:GetSecretValue"
-                    ],
-                    "Resource": [
-                        pinecone_key_sm_arn
-                    ]
+def create_kb_role():
+    print("Creating KB role...")
+    #create assume role policy for knowledgebase
+    bedrock_kb_assume_role_policy_statement = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {
+                    "Service": "bedrock.amazonaws.com"
                 },
-            ],
-        }
-
-        # Attach the resource-based policy to the secret
-        secret_policy_json = json.dumps(secret_policy_stmt)
-        print("Attaching resource permissions to secret...")
-        secret_manager_client.put_resource_policy(SecretId=pinecone_key_sm_arn, ResourcePolicy=secret_policy_json)             
-        #Role created for KB and all set for next step
-        print("KB role created successfully",kb_role_arn)
-        return kb_role_arn
-    else:
-        print("Role exists, skipping role creation")
-        return f'arn:aws:iam::{account_id}:role/{kb_role_name}'
-
+                "Action": "sts:AssumeRole"
+            }
+        ]
+    }
+
+    #create role for knowledgebase
+    kb_role_arn = create_role(kb_role_name, bedrock_kb_assume_role_policy_statement)
+    print("KB role created successfully",kb_role_arn)
+    return kb_role_arn
+
+
+def allow_secret_access(pinecone_key_sm_arn, kb_role_arn):
+    #attach this role as resource policy on secret (replacing the one from an earlier deploy)
+    secret_policy_stmt = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {
+                    "AWS": kb_role_arn
+                },
+                "Action": [
+                    "secretsmanager:GetSecretValue"
+                ],
+                "Resource": [
+                    pinecone_key_sm_arn
+                ]
+            },
+        ],
+    }
+
+    # Attach the resource-based policy to the secret
+    secret_policy_json = json.dumps(secret_policy_stmt)
+    print("Attaching resource permissions to secret...")
+    # Secrets Manager rejects the role as principal until it has propagated;
+    # it is the only principal in the policy, so those errors are about it
+    until_propagated("Secret resource policy", lambda: secret_manager_client.put_resource_policy(
+        SecretId=pinecone_key_sm_arn, ResourcePolicy=secret_policy_json), kb_role_arn,
+        role_messages=("unsupported principal", "invalid principal"))
+    return kb_role_arn
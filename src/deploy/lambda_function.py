@@ -1,48 +1,209 @@
+import json
+import os
 import random
 import string
+from collections import namedtuple
 
-def lambda_handler(event, context):
-    print(event)
-    
-    result = ''
-    response_code = 200
-    action_group = event['actionGroup']
-    api_path = event['apiPath']
-    
-    def passReset(event):
-        characters = string.ascii_letters + string.digits + string.punctuation
-        password = ''.join(random.choice(characters) for i in range(8))
-        return f"Password reset successfully. Temp password is: {password}"
-        
-    
-    print("api_path: ", api_path )
-    
-    if api_path == '/reset':
-        result = passReset(event)
-    else:
-        response_code = 404
-        result = f"Unrecognized api path: {action_group}::{api_path}"
-        
-    response_body = {
-        'application/json': {
-            'body': result
-        }
-    }
-    
-    action_response = {
-        'actionGroup': event['actionGroup'],
-        'apiPath': event['apiPath'],
-        'httpMethod': event['httpMethod'],
-        'httpStatusCode': 200,
-        'responseBody': response_body
-    }
-    
-    session_attributes = event['sessionAttributes']
-    prompt_session_attributes = event['promptSessionAttributes']
-    
-    api_response = {
-        'messageVersion': '1.0', 
-        'response': action_response
+# Action group executor for the virtual assistant agent.
+#
+# The OpenAPI schema the agent was given is loaded once per execution
+# environment (cold start) and compiled into a dispatch table keyed by
+# (apiPath, httpMethod). Each invocation is then a dictionary lookup, a check
+# of the parameters and request body against the compiled operation, and a
+# call to the handler registered for it with @action. Bad input is answered
+# with 400, unknown operations with 404 and handler failures with 500, so the
+# agent sees what went wrong.
+#
+# The schema is packaged next to this file by create_agent.create_action_group;
+# ACTION_SCHEMA_PATH overrides its location.
+
+SCHEMA_FILE = "virtual-assistant-agent-schema.json"
+
+Operation = namedtuple('Operation', [
+    'handler',
+    'parameters',           # name -> schema
+    'required_parameters',
+    'body_properties',      # name -> schema, None when the operation has no body
+    'body_required',
+])
+
+
+class ActionError(Exception):
+    # raised by handlers (and validation) to answer with a given status code
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+_handlers = {}
+
+
+def action(api_path, http_method):
+    # registers the function that implements one operation of the schema
+    def register(handler):
+        _handlers[(api_path, http_method.upper())] = handler
+        return handler
+    return register
+
+
+# temporary passwords come from the OS CSPRNG
+_system_random = random.SystemRandom()
+PASSWORD_CHARACTERS = string.ascii_letters + string.digits + string.punctuation
+
+
+@action('/reset', 'post')
+def reset_password(parameters, body, event):
+    password = ''.join(_system_random.choices(PASSWORD_CHARACTERS, k=8))
+    return f"Password reset successfully. Temp password is: {password}"
+
+
+def schema_path():
+    path = os.environ.get("ACTION_SCHEMA_PATH")
+    if path:
+        return path
+    here = os.path.dirname(os.path.abspath(__file__))
+    packaged = os.path.join(here, SCHEMA_FILE)
+    if os.path.exists(packaged):
+        return packaged
+    # running from the repository rather than the deployment package
+    return os.path.join(here, "..", "documents", SCHEMA_FILE)
+
+
+def _resolve(schema, node):
+    # follows local "#/components/..." references
+    while isinstance(node, dict) and "$ref" in node:
+        target = schema
+        for part in node["$ref"].lstrip("#/").split("/"):
+            target = target[part]
+        node = target
+    return node
+
+
+def compile_schema(schema, handlers):
+    operations = {}
+    for api_path, path_item in schema.get("paths", {}).items():
+        path_parameters = path_item.get("parameters", [])
+        for method, operation in path_item.items():
+            if method == "parameters":
+                continue
+            key = (api_path, method.upper())
+            parameters, required_parameters = {}, []
+            for parameter in path_parameters + operation.get("parameters", []):
+                parameter = _resolve(schema, parameter)
+                parameters[parameter["name"]] = _resolve(schema, parameter.get("schema", {}))
+                if parameter.get("required"):
+                    required_parameters.append(parameter["name"])
+            body_properties, body_required = None, ()
+            request_body = _resolve(schema, operation.get("requestBody"))
+            if request_body:
+                body_schema = _resolve(schema, request_body.get("content", {})
+                                       .get("application/json", {}).get("schema", {}))
+                body_properties = {name: _resolve(schema, prop)
+                                   for name, prop in body_schema.get("properties", {}).items()}
+                body_required = tuple(body_schema.get("required", ()))
+            handler = handlers.get(key)
+            if handler is None:
+                print(f"No handler for {method.upper()} {api_path}; it will answer 501")
+            operations[key] = Operation(handler, parameters, tuple(required_parameters),
+                                        body_properties, body_required)
+    return operations
+
+
+def load_operations(path=None):
+    with open(path or schema_path()) as f:
+        return compile_schema(json.load(f), _handlers)
+
+
+def _convert(name, value, schema):
+    # the agent sends every value as a string; convert it to the declared type
+    kind = schema.get("type", "string")
+    try:
+        if kind == "integer":
+            value = int(value)
+        elif kind == "number":
+            value = float(value)
+        elif kind == "boolean":
+            if str(value).lower() not in ("true", "false"):
+                raise ValueError(value)
+            value = str(value).lower() == "true"
+        elif kind == "array":
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    value = [item.strip() for item in value.strip("[]").split(",") if item.strip()]
+            if not isinstance(value, list):
+                raise ValueError(value)
+    except (TypeError, ValueError):
+        raise ActionError(400, f"{name} must be of type {kind}")
+    if "enum" in schema and value not in schema["enum"]:
+        raise ActionError(400, f"{name} must be one of {', '.join(map(str, schema['enum']))}")
+    return value
+
+
+def _values(items, declared, required, where):
+    values = {}
+    for item in items or []:
+        name = item.get("name")
+        if name not in declared:
+            raise ActionError(400, f"Unknown {where} {name}")
+        values[name] = _convert(name, item.get("value"), declared[name])
+    missing = [name for name in required if name not in values]
+    if missing:
+        raise ActionError(400, f"Missing required {where} {', '.join(missing)}")
+    return values
+
+
+def validate(operation, event):
+    # (parameters, body) as dicts of typed values, or ActionError(400)
+    parameters = _values(event.get("parameters"), operation.parameters, operation.required_parameters, "parameter")
+    content = (event.get("requestBody") or {}).get("content", {}).get("application/json")
+    if operation.body_properties is None:
+        return parameters, {}
+    body = _values((content or {}).get("properties"), operation.body_properties,
+                   operation.body_required, "property")
+    return parameters, body
+
+
+def response(event, status_code, body):
+    return {
+        'messageVersion': '1.0',
+        'response': {
+            'actionGroup': event.get('actionGroup'),
+            'apiPath': event.get('apiPath'),
+            'httpMethod': event.get('httpMethod'),
+            'httpStatusCode': status_code,
+            'responseBody': {
+                'application/json': {
+                    'body': body
+                }
+            }
+        },
+        'sessionAttributes': event.get('sessionAttributes', {}),
+        'promptSessionAttributes': event.get('promptSessionAttributes', {}),
     }
-        
-    return api_response
\ No newline at end of file
+
+
+# compiled once per execution environment, outside the handler
+OPERATIONS = load_operations()
+
+
+def lambda_handler(event, context):
+    action_group = event.get('actionGroup')
+    api_path = event.get('apiPath')
+    http_method = (event.get('httpMethod') or '').upper()
+    print(f"{action_group} {http_method} {api_path}")
+
+    operation = OPERATIONS.get((api_path, http_method))
+    if operation is None:
+        return response(event, 404, f"Unrecognized api path: {action_group}::{http_method} {api_path}")
+    if operation.handler is None:
+        return response(event, 501, f"Not implemented: {http_method} {api_path}")
+    try:
+        parameters, body = validate(operation, event)
+        return response(event, 200, operation.handler(parameters, body, event))
+    except ActionError as e:
+        return response(event, e.status_code, str(e))
+    except Exception as e:
+        print(f"Action {http_method} {api_path} failed: {e!r}")
+        return response(event, 500, "Internal error while running the action")
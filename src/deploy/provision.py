@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Runs the deploy as a graph of steps instead of one long sequence.
+#
+# Each Step names the steps it requires; run() starts every step as soon as
+# all of them have finished, on a bounded thread pool, so independent work
+# (IAM policies, roles, the bucket upload, the Lambda package, the waits on
+# each of them) overlaps. A step is called with the results of the finished
+# steps, by name, and returns its own result. When a step fails nothing new
+# is started, the running steps are allowed to finish and ProvisioningError
+# is raised.
+#
+# At the end a timing report lists every step and marks the critical path:
+# the chain of steps that decided the total deploy time.
+#
+# With a StateManifest, every finished step is recorded in a local JSON file
+# with its result and a hash of its config and of the hashes (or results) of
+# the steps it required, so a change anywhere upstream reaches every step
+# after it. A rerun skips steps whose hash is unchanged and reuses their
+# recorded result: a deploy that failed half way resumes after the last step
+# that succeeded, and a deploy with nothing changed finishes in seconds. A
+# step whose hash changed runs again, which is why steps create their
+# resource or update it when it already exists. Steps with config None (cheap
+# local work like building the Lambda package) always run and are not
+# recorded. Results have to be JSON.
+#
+# BR_AGENT_DEPLOY_WORKERS   steps run at the same time (8, 1 runs them in order)
+# BR_AGENT_DEPLOY_STATE     state manifest (.deploy-state-<region>-<account>.json);
+#                           delete it, or run cleanup_all.py, to start over
+
+DEPLOY_WORKERS = int(os.environ.get("BR_AGENT_DEPLOY_WORKERS", "8"))
+DEPLOY_STATE = os.environ.get("BR_AGENT_DEPLOY_STATE")
+
+Step = namedtuple('Step', ['name', 'run', 'requires', 'config'], defaults=((),))
+Timing = namedtuple('Timing', ['start', 'end'])
+
+
+class ProvisioningError(Exception):
+    def __init__(self, step, cause):
+        super().__init__(f"Step {step} failed: {cause!r}")
+        self.step = step
+        self.cause = cause
+
+
+class StateManifest:
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.steps = json.load(f).get("steps", {})
+
+    def recorded(self, name, digest):
+        # (True, result) when the step finished before with the same hash
+        entry = self.steps.get(name)
+        if entry is not None and entry["hash"] == digest:
+            return True, entry["result"]
+        return False, None
+
+    def record(self, name, digest, result):
+        self.steps[name] = {"hash": digest, "result": result, "finished_at": time.time()}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"steps": self.steps}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def state_path(region, account_id):
+    return DEPLOY_STATE or f".deploy-state-{region}-{account_id}.json"
+
+
+def _digest_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return hashlib.sha256(value).hexdigest()
+    raise TypeError(f"Cannot hash {type(value).__name__}")
+
+
+def config_hash(config, requires):
+    inputs = {"config": config, "requires": requires}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=_digest_bytes).encode()).hexdigest()
+
+
+def check(steps, done=()):
+    # ValueError for duplicate names, unknown requirements or cycles;
+    # returns the steps in an order that satisfies their requirements
+    by_name = {}
+    for step in steps:
+        if step.name in by_name or step.name in done:
+            raise ValueError(f"Duplicate step {step.name}")
+        by_name[step.name] = step
+    for step in steps:
+        unknown = [r for r in step.requires if r not in by_name and r not in done]
+        if unknown:
+            raise ValueError(f"Step {step.name} requires unknown steps {', '.join(unknown)}")
+    ordered, finished = [], set(done)
+    pending = list(steps)
+    while pending:
+        ready = [s for s in pending if all(r in finished for r in s.requires)]
+        if not ready:
+            raise ValueError(f"Steps {', '.join(s.name for s in pending)} require each other")
+        for step in ready:
+            ordered.append(step)
+            finished.add(step.name)
+            pending.remove(step)
+    return ordered
+
+
+def run(steps, results=None, max_workers=None, state=None, clock=time.monotonic):
+    # Runs the steps and returns {name: result}. results seeds it with values
+    # that steps can require without running anything for them; state is a
+    # StateManifest to skip unchanged steps with and record finished ones in.
+    results = dict(results or {})
+    check(steps, results)
+    pending = list(steps)
+    running = {}
+    digests = {}
+    timings = {}
+    skipped = []
+    failure = None
+    started = clock()
+    with ThreadPoolExecutor(max_workers=max_workers or DEPLOY_WORKERS, thread_name_prefix="deploy") as pool:
+        while pending or running:
+            # skipping a step can make more steps ready straight away
+            ready = failure is None
+            while ready:
+                ready = [s for s in pending if all(r in results for r in s.requires)]
+                for step in ready:
+                    pending.remove(step)
+                    if step.config is not None:
+                        digests[step.name] = config_hash(step.config, {
+                            r: digests[r] if r in digests else results[r] for r in step.requires})
+                        unchanged, result = state.recorded(step.name, digests[step.name]) if state else (False, None)
+                        if unchanged:
+                            results[step.name] = result
+                            skipped.append(step.name)
+                            continue
+                    print(f"[{clock() - started:7.1f}s] {step.name} ...")
+                    running[pool.submit(_timed, step, dict(results), clock)] = step
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                result, error, timings[step.name] = future.result()
+                if error is not None:
+                    print(f"[{clock() - started:7.1f}s] {step.name} failed: {error!r}")
+                    failure = failure or ProvisioningError(step.name, error)
+                else:
+                    print(f"[{clock() - started:7.1f}s] {step.name} done")
+                    results[step.name] = result
+                    if state and step.config is not None:
+                        state.record(step.name, digests[step.name], result)
+    if skipped:
+        print(f"Unchanged since the last deploy: {', '.join(skipped)}")
+    print(report(steps, timings, started))
+    if failure is not None:
+        if pending:
+            print(f"Not started: {', '.join(s.name for s in pending)}")
+        raise failure
+    return results
+
+
+def _timed(step, results, clock):
+    start = clock()
+    try:
+        return step.run(results), None, Timing(start, clock())
+    except Exception as e:
+        return None, e, Timing(start, clock())
+
+
+def critical_path(steps, timings):
+    # from the step that finished last, back through the requirement that
+    # finished last each time
+    requires = {s.name: s.requires for s in steps}
+    if not timings:
+        return []
+    path = [max(timings, key=lambda name: timings[name].end)]
+    while True:
+        previous = [r for r in requires.get(path[-1], ()) if r in timings]
+        if not previous:
+            return path[::-1]
+        path.append(max(previous, key=lambda name: timings[name].end))
+
+
+def report(steps, timings, started):
+    if not timings:
+        return "No steps ran"
+    path = set(critical_path(steps, timings))
+    total = max(t.end for t in timings.values()) - started
+    busy = sum(t.end - t.start for t in timings.values())
+    lines = [f"{'step':<28}{'start':>9}{'took':>9}"]
+    for name in sorted(timings, key=lambda name: timings[name].start):
+        timing = timings[name]
+        lines.append(f"{name:<28}{timing.start - started:>8.1f}s{timing.end - timing.start:>8.1f}s"
+                     f"{'  *' if name in path else ''}")
+    lines.append(f"Deploy took {total:.1f}s for {busy:.1f}s of steps; * marks the critical path")
+    return "\n".join(lines)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# deploy scripts import each other by plain module name, run from src/deploy
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
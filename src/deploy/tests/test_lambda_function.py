@@ -0,0 +1,97 @@
+import unittest
+
+import lambda_function
+
+SCHEMA = {
+  "openapi": "3.0.0",
+  "paths": {
+    "/reset": {"post": {"responses": {}}},
+    "/courses/{courseId}/grades": {
+      "parameters": [{"name": "courseId", "in": "path", "required": True, "schema": {"type": "integer"}}],
+      "get": {
+        "parameters": [{"name": "term", "in": "query", "schema": {"type": "string", "enum": ["fall", "spring"]}}],
+        "responses": {},
+      },
+      "put": {
+        "requestBody": {"required": True, "content": {"application/json": {"schema": {"$ref": "#/components/schemas/Grade"}}}},
+        "responses": {},
+      },
+    },
+  },
+  "components": {"schemas": {"Grade": {
+    "type": "object", "required": ["grade"],
+    "properties": {"grade": {"type": "number"}, "final": {"type": "boolean"}},
+  }}},
+}
+
+
+def event(api_path, method, parameters=(), body=None):
+  event = {
+    "messageVersion": "1.0", "actionGroup": "TestActionGroup", "apiPath": api_path, "httpMethod": method,
+    "parameters": [{"name": n, "type": "string", "value": v} for n, v in parameters],
+    "sessionAttributes": {"user": "u1"}, "promptSessionAttributes": {},
+  }
+  if body is not None:
+    event["requestBody"] = {"content": {"application/json": {"properties": [
+      {"name": n, "type": "string", "value": v} for n, v in body]}}}
+  return event
+
+
+class TestActionRouter(unittest.TestCase):
+
+  def setUp(self):
+    self.calls = []
+    handlers = {
+      ("/reset", "POST"): lambda_function.reset_password,
+      ("/courses/{courseId}/grades", "GET"): lambda p, b, e: self.calls.append(p) or "A",
+      ("/courses/{courseId}/grades", "PUT"): lambda p, b, e: self.calls.append(b) or "saved",
+    }
+    operations = lambda_function.compile_schema(SCHEMA, handlers)
+    self.original, lambda_function.OPERATIONS = lambda_function.OPERATIONS, operations
+
+  def tearDown(self):
+    lambda_function.OPERATIONS = self.original
+
+  def invoke(self, event):
+    return lambda_function.lambda_handler(event, None)["response"]
+
+  def test_parameters_are_typed_and_passed_to_the_handler(self):
+    response = self.invoke(event("/courses/{courseId}/grades", "GET", [("courseId", "42"), ("term", "fall")]))
+    self.assertEqual(response["httpStatusCode"], 200)
+    self.assertEqual(self.calls, [{"courseId": 42, "term": "fall"}])
+
+  def test_invalid_parameters_are_rejected(self):
+    for parameters in ([("term", "fall")], [("courseId", "x")], [("courseId", "1"), ("term", "summer")],
+                       [("courseId", "1"), ("other", "1")]):
+      self.assertEqual(self.invoke(event("/courses/{courseId}/grades", "GET", parameters))["httpStatusCode"], 400)
+    self.assertEqual(self.calls, [])
+
+  def test_request_body_against_referenced_schema(self):
+    path = "/courses/{courseId}/grades"
+    response = self.invoke(event(path, "PUT", [("courseId", "1")], [("grade", "3.5"), ("final", "true")]))
+    self.assertEqual(response["httpStatusCode"], 200)
+    self.assertEqual(self.calls, [{"grade": 3.5, "final": True}])
+    self.assertEqual(self.invoke(event(path, "PUT", [("courseId", "1")], [("final", "true")]))["httpStatusCode"], 400)
+
+  def test_unknown_operations_and_failing_handlers(self):
+    self.assertEqual(self.invoke(event("/nope", "POST"))["httpStatusCode"], 404)
+    self.assertEqual(self.invoke(event("/reset", "GET"))["httpStatusCode"], 404)
+    lambda_function.OPERATIONS[("/reset", "POST")] = lambda_function.OPERATIONS[("/reset", "POST")]._replace(
+      handler=lambda p, b, e: 1 / 0)
+    self.assertEqual(self.invoke(event("/reset", "POST"))["httpStatusCode"], 500)
+
+  def test_response_echoes_the_event(self):
+    result = lambda_function.lambda_handler(event("/reset", "POST"), None)
+    self.assertEqual(result["messageVersion"], "1.0")
+    self.assertEqual(result["sessionAttributes"], {"user": "u1"})
+    self.assertEqual(result["response"]["actionGroup"], "TestActionGroup")
+    self.assertIn("Temp password is: ", result["response"]["responseBody"]["application/json"]["body"])
+
+  def test_packaged_schema_compiles_with_every_operation_implemented(self):
+    operations = lambda_function.load_operations()
+    self.assertEqual(set(operations), {("/reset", "POST")})
+    self.assertTrue(all(operation.handler for operation in operations.values()))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import provision
+from provision import Step, Timing
+
+
+class TestProvision(unittest.TestCase):
+
+  def setUp(self):
+    print_patch = mock.patch("builtins.print")
+    print_patch.start()
+    self.addCleanup(print_patch.stop)
+
+  def test_independent_steps_overlap_and_results_flow(self):
+    # both roles have to be running at the same time to get past the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    steps = [
+      Step("role_a", lambda r: barrier.wait() and "a" or "a", ()),
+      Step("role_b", lambda r: barrier.wait() and "b" or "b", ()),
+      Step("agent", lambda r: r["role_a"] + r["role_b"] + r["kb"], ("role_a", "role_b", "kb")),
+    ]
+    results = provision.run(steps, results={"kb": "!"}, max_workers=4)
+    self.assertEqual(results["agent"], "ab!")
+
+  def test_failure_skips_dependants_but_lets_running_steps_finish(self):
+    ran = []
+    def fail(r):
+      raise RuntimeError("boom")
+    steps = [
+      Step("bad", fail, ()),
+      Step("slow", lambda r: ran.append("slow"), ()),
+      Step("after_bad", lambda r: ran.append("after_bad"), ("bad",)),
+    ]
+    with self.assertRaises(provision.ProvisioningError) as raised:
+      provision.run(steps, max_workers=2)
+    self.assertEqual(raised.exception.step, "bad")
+    self.assertIsInstance(raised.exception.cause, RuntimeError)
+    self.assertEqual(ran, ["slow"])
+
+  def test_bad_graphs_are_rejected_before_anything_runs(self):
+    run = mock.Mock()
+    with self.assertRaises(ValueError):
+      provision.run([Step("a", run, ("b",)), Step("b", run, ("a",))])
+    with self.assertRaises(ValueError):
+      provision.run([Step("a", run, ("missing",))])
+    with self.assertRaises(ValueError):
+      provision.run([Step("a", run, ()), Step("a", run, ())])
+    run.assert_not_called()
+
+  def test_rerun_skips_unchanged_steps_and_resumes_after_a_failure(self):
+    calls = []
+    fail = {"alias": True}
+    def step(name, requires=(), config=(), result=None):
+      def run(r):
+        calls.append(name)
+        if fail.get(name):
+          raise RuntimeError("throttled")
+        return result or name.upper()
+      return Step(name, run, requires, config)
+    def steps(instruction):
+      return [
+        step("role", config=["role-name"]),
+        step("package", config=None, result="zip"),
+        step("function", ("role", "package")),
+        step("agent", ("role",), config=[instruction]),
+        step("alias", ("agent", "function")),
+      ]
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, "state.json")
+      with self.assertRaises(provision.ProvisioningError):
+        provision.run(steps("v1"), state=provision.StateManifest(path))
+      self.assertEqual(sorted(calls), ["agent", "alias", "function", "package", "role"])
+
+      # resumes with the step that failed; the package is always rebuilt
+      calls.clear()
+      fail.clear()
+      results = provision.run(steps("v1"), state=provision.StateManifest(path))
+      self.assertEqual(sorted(calls), ["alias", "package"])
+      self.assertEqual(results["agent"], "AGENT")
+
+      calls.clear()
+      provision.run(steps("v1"), state=provision.StateManifest(path))
+      self.assertEqual(calls, ["package"])
+
+      # a changed config runs the step and everything after it again
+      calls.clear()
+      provision.run(steps("v2"), state=provision.StateManifest(path))
+      self.assertEqual(sorted(calls), ["agent", "alias", "package"])
+
+  def test_critical_path_follows_the_requirement_that_finished_last(self):
+    steps = [
+      Step("policy", None, ()),
+      Step("role", None, ()),
+      Step("kb", None, ("policy", "role")),
+      Step("package", None, ()),
+      Step("agent", None, ("kb", "package")),
+    ]
+    timings = {
+      "policy": Timing(0, 1), "role": Timing(0, 3), "package": Timing(0, 2),
+      "kb": Timing(3, 10), "agent": Timing(10, 12),
+    }
+    self.assertEqual(provision.critical_path(steps, timings), ["role", "kb", "agent"])
+    report = provision.report(steps, timings, 0)
+    self.assertIn("Deploy took 12.0s for 15.0s of steps", report)
+    self.assertTrue([line for line in report.splitlines() if line.startswith("role")][0].endswith("*"))
+
+
+if __name__ == '__main__':
+  unittest.main()
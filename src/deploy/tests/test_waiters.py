@@ -0,0 +1,131 @@
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+import waiters
+
+
+def client_error(code, message="", operation="Operation"):
+  return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class FakeClock:
+  # time that only moves when the waiter sleeps
+
+  def __init__(self):
+    self.now = 0.0
+    self.sleeps = []
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.sleeps.append(seconds)
+    self.now += seconds
+
+
+class TestWaiters(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = FakeClock()
+    self.timing = {"sleep": self.clock.sleep, "clock": self.clock}
+    print_patch = mock.patch("builtins.print")
+    print_patch.start()
+    self.addCleanup(print_patch.stop)
+
+  def test_returns_as_soon_as_ready_with_growing_delays(self):
+    client = mock.Mock()
+    client.get_knowledge_base.side_effect = [
+      client_error("ResourceNotFoundException"),
+      {"knowledgeBase": {"status": "CREATING"}},
+      {"knowledgeBase": {"status": "CREATING"}},
+      {"knowledgeBase": {"status": "ACTIVE"}},
+    ]
+    status = waiters.wait_for_knowledge_base(client, "KB1", **self.timing)
+    self.assertEqual(status, "ACTIVE")
+    self.assertEqual(client.get_knowledge_base.call_count, 4)
+    self.assertEqual(len(self.clock.sleeps), 3)
+    # each pause is drawn from a window twice as wide as the last
+    for sleep, cap in zip(self.clock.sleeps, (1, 2, 4)):
+      self.assertTrue(cap / 2 <= sleep <= cap)
+
+  def test_agent_waits_through_preparing(self):
+    client = mock.Mock()
+    client.get_agent.side_effect = [{"agent": {"agentStatus": s}} for s in ("NOT_PREPARED", "PREPARING", "PREPARED")]
+    self.assertEqual(waiters.wait_for_agent(client, "A1", ready=("PREPARED",), **self.timing), "PREPARED")
+    client.get_agent_alias.return_value = {"agentAlias": {"agentAliasStatus": "PREPARED"}}
+    self.assertEqual(waiters.wait_for_agent_alias(client, "A1", "AL1", **self.timing), "PREPARED")
+
+  def test_function_waits_for_code_update(self):
+    client = mock.Mock()
+    client.get_function_configuration.side_effect = [
+      {"State": "Active", "LastUpdateStatus": "InProgress"},
+      {"State": "Active", "LastUpdateStatus": "Successful"},
+    ]
+    self.assertEqual(waiters.wait_for_function(client, "fn", **self.timing), "READY")
+    client.get_function_configuration.side_effect = [{"State": "Active", "LastUpdateStatus": "Failed"}]
+    with self.assertRaises(waiters.ResourceFailed):
+      waiters.wait_for_function(client, "fn", **self.timing)
+
+  def test_ingestion_job_waits_until_complete(self):
+    client = mock.Mock()
+    client.get_ingestion_job.side_effect = [{"ingestionJob": {"status": s}} for s in ("STARTING", "IN_PROGRESS", "COMPLETE")]
+    self.assertEqual(waiters.wait_for_ingestion_job(client, "KB1", "DS1", "J1", **self.timing), "COMPLETE")
+    client.get_ingestion_job.assert_called_with(knowledgeBaseId="KB1", dataSourceId="DS1", ingestionJobId="J1")
+    client.get_ingestion_job.side_effect = [{"ingestionJob": {"status": "IN_PROGRESS"}}, {"ingestionJob": {"status": "FAILED"}}]
+    with self.assertRaises(waiters.ResourceFailed):
+      waiters.wait_for_ingestion_job(client, "KB1", "DS1", "J1", **self.timing)
+
+  def test_failed_status_and_timeout_raise(self):
+    client = mock.Mock()
+    client.get_agent.return_value = {"agent": {"agentStatus": "FAILED"}}
+    with self.assertRaises(waiters.ResourceFailed):
+      waiters.wait_for_agent(client, "A1", **self.timing)
+    client.get_data_source.return_value = {"dataSource": {"status": "CREATING"}}
+    with self.assertRaises(waiters.WaitTimeout):
+      waiters.wait_for_data_source(client, "KB1", "DS1", timeout=60, **self.timing)
+    self.assertLessEqual(self.clock.now, 60)
+    self.assertLessEqual(max(self.clock.sleeps), waiters.WAIT_MAX_DELAY)
+
+  def test_other_errors_are_not_swallowed(self):
+    client = mock.Mock()
+    client.get_role.side_effect = client_error("AccessDenied")
+    with self.assertRaises(ClientError):
+      waiters.wait_for_role(client, "role", **self.timing)
+    self.assertEqual(self.clock.sleeps, [])
+
+  def test_until_propagated_retries_only_errors_about_the_role(self):
+    role = "arn:aws:iam::123456789012:role/AmazonBedrockExecutionRoleForAgents_va"
+    call = mock.Mock(side_effect=[
+      client_error("ValidationException", f"Could not assume role {role}. Check the trust policy."),
+      client_error("AccessDeniedException", "AmazonBedrockExecutionRoleForAgents_va is not authorized"),
+      {"agentId": "A1"},
+    ])
+    self.assertEqual(waiters.until_propagated("Agent", call, role, **self.timing), {"agentId": "A1"})
+    self.assertEqual(call.call_count, 3)
+    # services that do not name the role are matched by their own message
+    call = mock.Mock(side_effect=[
+      client_error("InvalidParameterValueException", "The role defined for the function cannot be assumed by Lambda."),
+      {"FunctionArn": "arn"},
+    ])
+    self.assertEqual(waiters.until_propagated(
+      "Lambda", call, role, ("role defined for the function cannot be assumed",), **self.timing), {"FunctionArn": "arn"})
+    for error in (client_error("ValidationException", "Name already in use"),
+                  client_error("AccessDeniedException", "User is not authorized to perform bedrock:CreateAgent"),
+                  client_error("InvalidParameterValueException", "The role defined for the function cannot be assumed by Lambda.")):
+      call = mock.Mock(side_effect=error)
+      with self.assertRaises(ClientError):
+        waiters.until_propagated("Agent", call, role, **self.timing)
+      self.assertEqual(call.call_count, 1)
+
+  def test_until_propagated_gives_up_after_its_own_timeout(self):
+    role = "arn:aws:iam::123456789012:role/kb-role"
+    call = mock.Mock(side_effect=client_error("ValidationException", f"Unable to assume role {role}"))
+    with self.assertRaises(waiters.WaitTimeout):
+      waiters.until_propagated("Knowledge base", call, role, **self.timing)
+    self.assertLessEqual(self.clock.now, waiters.PROPAGATION_TIMEOUT)
+    self.assertLess(waiters.PROPAGATION_TIMEOUT, waiters.WAIT_TIMEOUT)
+
+if __name__ == '__main__':
+  unittest.main()
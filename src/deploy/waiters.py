@@ -0,0 +1,183 @@
+import os
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+# Readiness waiters for the deploy scripts.
+#
+# Instead of sleeping a fixed time after each create call, the scripts poll
+# the resource until it reports the state the next step needs (knowledge base
+# ACTIVE, data source AVAILABLE, ingestion job COMPLETE, agent
+# NOT_PREPARED/PREPARED, alias PREPARED) and move on as soon as it does. Polls start fast and back off exponentially
+# with jitter, and every wait has an overall timeout.
+#
+# IAM is eventually consistent: a role or policy can be read back from IAM
+# well before Bedrock, Lambda or Secrets Manager accept it. wait_for_role and
+# wait_for_policy cover the first part; until_propagated retries the call that
+# uses the role while it fails with one of the "not there yet" errors about
+# that role, for a much shorter time than the resource waits.
+#
+# BR_AGENT_WAIT_TIMEOUT         seconds before a single wait gives up (600)
+# BR_AGENT_WAIT_MAX_DELAY       longest pause between two polls (15)
+# BR_AGENT_PROPAGATION_TIMEOUT  seconds to wait for a new role to propagate (120)
+
+WAIT_TIMEOUT = float(os.environ.get("BR_AGENT_WAIT_TIMEOUT", "600"))
+WAIT_MAX_DELAY = float(os.environ.get("BR_AGENT_WAIT_MAX_DELAY", "15"))
+PROPAGATION_TIMEOUT = float(os.environ.get("BR_AGENT_PROPAGATION_TIMEOUT", "120"))
+WAIT_FIRST_DELAY = 1.0
+
+# errors AWS answers with while a resource is still being created
+NOT_FOUND_CODES = ("ResourceNotFoundException", "NoSuchEntity", "NoSuchEntityException")
+
+# errors that mean a new role or policy has not reached the calling service yet
+PROPAGATION_CODES = ("InvalidParameterValueException", "ValidationException", "AccessDeniedException",
+                     "MalformedPolicyDocumentException", "InvalidRequestException")
+
+
+class WaitError(Exception):
+    pass
+
+
+class WaitTimeout(WaitError):
+    pass
+
+
+class ResourceFailed(WaitError):
+    pass
+
+
+def error_code(error):
+    return error.response.get("Error", {}).get("Code", "") if isinstance(error, ClientError) else ""
+
+
+def poll_delays(first=WAIT_FIRST_DELAY, max_delay=None):
+    # 1, 2, 4, ... seconds up to max_delay, each between half and all of it
+    delay = first
+    while True:
+        yield random.uniform(delay / 2, delay)
+        delay = min(delay * 2, max_delay or WAIT_MAX_DELAY)
+
+
+def wait_until(what, poll, ready, failed=(), timeout=None, sleep=time.sleep, clock=time.monotonic):
+    # Calls poll() until it returns a status in ready, and returns that
+    # status. A status in failed raises ResourceFailed, running out of time
+    # WaitTimeout. poll() raising a not-found error counts as not ready yet.
+    deadline = clock() + (timeout or WAIT_TIMEOUT)
+    started = clock()
+    status = None
+    for delay in poll_delays():
+        try:
+            status = poll()
+        except ClientError as e:
+            if error_code(e) not in NOT_FOUND_CODES:
+                raise
+            status = None
+        if status in ready:
+            print(f"{what} is {status} after {clock() - started:.1f}s")
+            return status
+        if status in failed:
+            raise ResourceFailed(f"{what} is {status}")
+        if clock() + delay > deadline:
+            raise WaitTimeout(f"{what} still {status or 'missing'} after {clock() - started:.0f}s")
+        sleep(delay)
+
+
+def is_propagation_error(error, role_arn, role_messages=()):
+    # The error names the role (by ARN or name), or is one of role_messages:
+    # the way the called service refers to that role without naming it.
+    # Anything else is a real error and retrying it only delays the failure.
+    if error_code(error) not in PROPAGATION_CODES:
+        return False
+    message = error.response.get("Error", {}).get("Message", "").lower()
+    role_name = role_arn.rsplit("/", 1)[-1].lower()
+    return role_name in message or any(text.lower() in message for text in role_messages)
+
+
+def until_propagated(what, call, role_arn, role_messages=(), timeout=None, sleep=time.sleep,
+                     clock=time.monotonic):
+    # Runs call() again while it fails because the role role_arn has not
+    # propagated yet, and returns its result.
+    deadline = clock() + (timeout or PROPAGATION_TIMEOUT)
+    for delay in poll_delays():
+        try:
+            return call()
+        except ClientError as e:
+            if not is_propagation_error(e, role_arn, role_messages):
+                raise
+            if clock() + delay > deadline:
+                raise WaitTimeout(f"{what}: IAM changes did not propagate in time ({e})")
+            print(f"{what}: waiting for IAM ({error_code(e)})")
+        sleep(delay)
+
+
+def wait_for_knowledge_base(client, knowledge_base_id, **kwargs):
+    return wait_until(
+        f"Knowledge base {knowledge_base_id}",
+        lambda: client.get_knowledge_base(knowledgeBaseId=knowledge_base_id)["knowledgeBase"]["status"],
+        ready=("ACTIVE",), failed=("FAILED", "DELETING", "DELETE_UNSUCCESSFUL"), **kwargs)
+
+
+def wait_for_data_source(client, knowledge_base_id, data_source_id, **kwargs):
+    return wait_until(
+        f"Data source {data_source_id}",
+        lambda: client.get_data_source(knowledgeBaseId=knowledge_base_id,
+                                       dataSourceId=data_source_id)["dataSource"]["status"],
+        ready=("AVAILABLE",), failed=("DELETING", "DELETE_UNSUCCESSFUL"), **kwargs)
+
+
+def wait_for_ingestion_job(client, knowledge_base_id, data_source_id, ingestion_job_id, **kwargs):
+    # the agent can only answer from the documents once their job is COMPLETE
+    return wait_until(
+        f"Ingestion job {ingestion_job_id}",
+        lambda: client.get_ingestion_job(knowledgeBaseId=knowledge_base_id, dataSourceId=data_source_id,
+                                         ingestionJobId=ingestion_job_id)["ingestionJob"]["status"],
+        ready=("COMPLETE",), failed=("FAILED", "STOPPED"), **kwargs)
+
+
+def wait_for_agent(client, agent_id, ready=("NOT_PREPARED", "PREPARED"), **kwargs):
+    # NOT_PREPARED once created, PREPARED once prepare_agent has finished
+    return wait_until(
+        f"Agent {agent_id}",
+        lambda: client.get_agent(agentId=agent_id)["agent"]["agentStatus"],
+        ready=ready, failed=("FAILED", "DELETING"), **kwargs)
+
+
+def wait_for_agent_alias(client, agent_id, agent_alias_id, **kwargs):
+    return wait_until(
+        f"Agent alias {agent_alias_id}",
+        lambda: client.get_agent_alias(agentId=agent_id,
+                                       agentAliasId=agent_alias_id)["agentAlias"]["agentAliasStatus"],
+        ready=("PREPARED",), failed=("FAILED", "DELETING"), **kwargs)
+
+
+def wait_for_role(client, role_name, **kwargs):
+    return wait_until(
+        f"Role {role_name}",
+        lambda: client.get_role(RoleName=role_name)["Role"] and "EXISTS",
+        ready=("EXISTS",), **kwargs)
+
+
+def wait_for_policy(client, policy_arn, **kwargs):
+    return wait_until(
+        f"Policy {policy_arn}",
+        lambda: client.get_policy(PolicyArn=policy_arn)["Policy"] and "EXISTS",
+        ready=("EXISTS",), **kwargs)
+
+
+def _function_status(configuration):
+    # READY once the function is Active and no update is in progress
+    state, update = configuration.get("State"), configuration.get("LastUpdateStatus")
+    if state == "Failed" or update == "Failed":
+        return "FAILED"
+    if state == "Active" and update in (None, "Successful"):
+        return "READY"
+    return update if update == "InProgress" else state
+
+
+def wait_for_function(client, function_name, **kwargs):
+    # Lambda rejects a configuration change while the code is still updating
+    return wait_until(
+        f"Function {function_name}",
+        lambda: _function_status(client.get_function_configuration(FunctionName=function_name)),
+        ready=("READY",), failed=("FAILED",), **kwargs)